@@ -0,0 +1,162 @@
+# ann_index.py - Índice aproximado (IVF) para galerías grandes de encodings
+"""
+Índice IVF (inverted file) en NumPy puro para buscar el vecino más cercano
+en galerías de cientos de miles de encodings sin barrer la matriz completa.
+
+- build(): k-means sobre la galería -> `nlist` centroides, cada fila se
+  asigna a la lista de su centroide más cercano.
+- add(): inserción incremental (registro) sin reconstruir el índice.
+- search(): sólo se recorren las `nprobe` listas más cercanas a la consulta.
+  nprobe=1 es lo más rápido; nprobe=nlist equivale al barrido exacto.
+  search_k() devuelve los k vecinos de esas listas (para top-k por identidad).
+"""
+import numpy as np
+
+
+class IVFIndex:
+    """Índice IVF sobre encodings (N,128) float32 con distancia euclídea."""
+
+    def __init__(self, nlist=None, nprobe=8, n_iter=10, seed=0):
+        self.nlist = nlist          # None -> ~sqrt(N) al construir
+        self.nprobe = nprobe
+        self.n_iter = n_iter
+        self.seed = seed
+        self.dim = None
+        self.centroids = None       # (nlist, dim)
+        self._vecs = []             # por lista: buffer (cap, dim)
+        self._ids = []              # por lista: buffer (cap,)
+        self._sizes = []            # por lista: filas usadas
+        self.ntotal = 0
+
+    # ---------- construcción ----------
+    def build(self, encs: np.ndarray):
+        """Entrena los centroides con k-means y reparte la galería."""
+        encs = np.ascontiguousarray(encs, dtype=np.float32)
+        if encs.ndim == 1:
+            encs = encs.reshape(1, -1)
+        n, self.dim = encs.shape
+        nlist = self.nlist or max(1, int(np.sqrt(n)))
+        nlist = max(1, min(nlist, n))
+        self.nlist = nlist
+
+        self.centroids = self._kmeans(encs, nlist)
+        self._vecs = [np.empty((0, self.dim), dtype=np.float32) for _ in range(nlist)]
+        self._ids = [np.empty(0, dtype=np.int64) for _ in range(nlist)]
+        self._sizes = [0] * nlist
+        self.ntotal = 0
+        self.add(encs)
+        return self
+
+    def _kmeans(self, encs, k):
+        rng = np.random.default_rng(self.seed)
+        # entrenar con una muestra basta para ubicar los centroides
+        n_train = min(len(encs), max(k * 64, 10000))
+        train = encs[rng.choice(len(encs), n_train, replace=False)] if n_train < len(encs) else encs
+        centroids = train[rng.choice(len(train), k, replace=False)].copy()
+        for _ in range(self.n_iter):
+            assign = self._nearest_centroids(train, centroids, 1)[:, 0]
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assign, train)
+            counts = np.bincount(assign, minlength=k).astype(np.float32)
+            empty = counts == 0
+            centroids[~empty] = sums[~empty] / counts[~empty, None]
+            # listas vacías: re-sembrar con puntos aleatorios
+            if empty.any():
+                centroids[empty] = train[rng.choice(len(train), int(empty.sum()), replace=False)]
+        return centroids
+
+    @staticmethod
+    def _sq_dists(x, y):
+        """Distancias euclídeas al cuadrado (n,m) vía producto punto."""
+        d = (x * x).sum(1)[:, None] - 2.0 * (x @ y.T) + (y * y).sum(1)[None, :]
+        np.maximum(d, 0, out=d)
+        return d
+
+    def _nearest_centroids(self, x, centroids, nprobe):
+        d = self._sq_dists(x, centroids)
+        if nprobe >= d.shape[1]:
+            return np.argsort(d, axis=1)
+        part = np.argpartition(d, nprobe - 1, axis=1)[:, :nprobe]
+        order = np.take_along_axis(d, part, axis=1).argsort(axis=1)
+        return np.take_along_axis(part, order, axis=1)
+
+    # ---------- inserción incremental ----------
+    def add(self, encs: np.ndarray, ids=None):
+        """Agrega filas al índice; `ids` por defecto continúa la numeración."""
+        if self.centroids is None:
+            raise RuntimeError("El índice no está construido; llama a build() primero")
+        encs = np.ascontiguousarray(encs, dtype=np.float32).reshape(-1, self.dim)
+        if ids is None:
+            ids = np.arange(self.ntotal, self.ntotal + len(encs), dtype=np.int64)
+        ids = np.asarray(ids, dtype=np.int64)
+        assign = self._nearest_centroids(encs, self.centroids, 1)[:, 0]
+        for lst in np.unique(assign):
+            sel = assign == lst
+            self._append(int(lst), encs[sel], ids[sel])
+        self.ntotal += len(encs)
+
+    def _append(self, lst, vecs, ids):
+        size = self._sizes[lst]
+        need = size + len(vecs)
+        cap = len(self._ids[lst])
+        if need > cap:
+            # crecimiento geométrico para que los registros sean O(1) amortizado
+            new_cap = max(need, cap * 2, 16)
+            v = np.empty((new_cap, self.dim), dtype=np.float32)
+            i = np.empty(new_cap, dtype=np.int64)
+            v[:size] = self._vecs[lst][:size]
+            i[:size] = self._ids[lst][:size]
+            self._vecs[lst], self._ids[lst] = v, i
+        self._vecs[lst][size:need] = vecs
+        self._ids[lst][size:need] = ids
+        self._sizes[lst] = need
+
+    # ---------- búsqueda ----------
+    def search(self, query: np.ndarray, nprobe=None):
+        """Devuelve (id, distancia) del vecino más cercano o (-1, inf)."""
+        ids, dists = self.search_batch(np.asarray(query).reshape(1, -1), nprobe)
+        return int(ids[0]), float(dists[0])
+
+    def search_k(self, query: np.ndarray, k, nprobe=None):
+        """Los k vecinos más cercanos dentro de las listas sondeadas -> (ids, distancias) ordenados."""
+        q = np.ascontiguousarray(query, dtype=np.float32).reshape(1, self.dim)
+        nprobe = max(1, min(nprobe or self.nprobe, self.nlist))
+        lists = [lst for lst in self._nearest_centroids(q, self.centroids, nprobe)[0] if self._sizes[lst]]
+        if not lists:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        vecs = np.concatenate([self._vecs[lst][:self._sizes[lst]] for lst in lists])
+        ids = np.concatenate([self._ids[lst][:self._sizes[lst]] for lst in lists])
+        d = self._sq_dists(q, vecs)[0]
+        if k < len(d):
+            part = np.argpartition(d, k - 1)[:k]
+        else:
+            part = np.arange(len(d))
+        part = part[np.argsort(d[part])]
+        return ids[part], np.sqrt(d[part])
+
+    def search_batch(self, queries: np.ndarray, nprobe=None):
+        """Vecino más cercano para cada fila de `queries` -> (ids, distancias)."""
+        queries = np.ascontiguousarray(queries, dtype=np.float32).reshape(-1, self.dim)
+        nprobe = max(1, min(nprobe or self.nprobe, self.nlist))
+        probes = self._nearest_centroids(queries, self.centroids, nprobe)
+
+        best_ids = np.full(len(queries), -1, dtype=np.int64)
+        best_d = np.full(len(queries), np.inf, dtype=np.float32)
+        # agrupar consultas por lista para hacer un solo GEMM por lista
+        for lst in np.unique(probes):
+            size = self._sizes[lst]
+            if size == 0:
+                continue
+            qsel = np.nonzero((probes == lst).any(axis=1))[0]
+            d = self._sq_dists(queries[qsel], self._vecs[lst][:size])
+            j = d.argmin(axis=1)
+            dj = d[np.arange(len(qsel)), j]
+            better = dj < best_d[qsel]
+            best_d[qsel[better]] = dj[better]
+            best_ids[qsel[better]] = self._ids[lst][j[better]]
+        return best_ids, np.sqrt(best_d)
+
+
+def build_index(known_encs: np.ndarray, nlist=None, nprobe=8):
+    """Atajo: construye un IVFIndex a partir de la galería cargada."""
+    return IVFIndex(nlist=nlist, nprobe=nprobe).build(known_encs)
@@ -6,23 +6,143 @@ import json
 import time
 import threading
 import numpy as np
-import face_recognition
 from pathlib import Path
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 import os
+import base64
 import requests
+from ann_index import build_index
+from gallery_quant import QuantizedGallery
+from matching import GalleryMatcher, describe_match, identity_candidates
+from event_debounce import EventDebouncer
+from event_bus import EventBus, format_sse
+from frame_hub import FrameHub
+from scale_tuner import ScaleTuner
+from stream_manager import open_stream, streams_stats
+from camera_control import CameraControl, AdaptiveResolution, load_policy
+from embedding_cache import EmbeddingCache
+from detectors import make_detector, detector_spec_for
+from encoders import encoder_for, check_compatible, record_registration, load_gallery_meta
+from frame_bus import FrameBus, control_call
+from stream_server import StreamServer
+from mjpeg_variants import VariantCache, parse_variant
+from clip_recorder import ClipRecorder
+from storage import Store, StorageLifecycle
+from shard_matcher import ShardedMatcher
+from gallery_files import (ENCODINGS_NPY, LABELS_JSON, GALLERY_NODE_JSON, gallery_path, save_gallery,
+                           gallery_file_lock, open_gallery_node)
+from gallery_log import GallerySync, row_ids, ids_digest, insert_change, delete_change, decode_vec
 
 app = Flask(__name__)
 CORS(app)
 
 # Configuración
-ENCODINGS_NPY = "encodings.npy"
-LABELS_JSON = "labels.json"
 THRESHOLD = 0.6
 DOWNSCALE = 0.5
+# Escala de detección aprendida del tamaño de las caras que ve la cámara
+# (DOWNSCALE queda como escala inicial)
+AUTO_SCALE = os.getenv('AUTO_SCALE', '1') == '1'
 FRAMES_DIR = "captured_frames"
 RESULTS_DIR = "recognition_results"
 
+# Índice aproximado (IVF) para galerías grandes; por debajo de ANN_MIN_ROWS
+# el barrido exacto es más rápido que consultar el índice
+USE_ANN_INDEX = os.getenv('ANN_INDEX', '0') == '1'
+ANN_MIN_ROWS = int(os.getenv('ANN_MIN_ROWS', 20000))
+ANN_NLIST = int(os.getenv('ANN_NLIST', 0)) or None   # 0 -> ~sqrt(N)
+ANN_NPROBE = int(os.getenv('ANN_NPROBE', 8))         # más listas = más recall, menos velocidad
+
+# Galería compacta: 'float32' (normal), 'float16' o 'int8'. En modo compacto la
+# precisión completa se lee de encodings.npy mapeado en memoria para el rerank
+GALLERY_MODE = os.getenv('GALLERY_MODE', 'float32')
+GALLERY_RERANK = int(os.getenv('GALLERY_RERANK', 16))
+
+# Top-k por identidad: candidatos devueltos y margen mínimo entre la 1ª y la
+# 2ª identidad para no marcar el resultado como ambiguo
+TOP_K = int(os.getenv('TOP_K', 3))
+MAX_TOP_K = 50      # tope de `k` en /api/recognize
+ANN_CANDIDATES_PER_K = 8   # filas vecinas por identidad pedida al índice IVF/compacto
+AMBIGUITY_MARGIN = float(os.getenv('AMBIGUITY_MARGIN', 0.05))
+
+# Umbrales por identidad de gallery_analytics.py --write (sólo más estrictos que
+# THRESHOLD). Con IDENTITY_THRESHOLDS_GLOBAL=1 también se usa su umbral global
+# calibrado y se permiten umbrales propios más altos
+IDENTITY_THRESHOLDS = os.getenv('IDENTITY_THRESHOLDS', gallery_path('thresholds.json'))
+IDENTITY_THRESHOLDS_GLOBAL = os.getenv('IDENTITY_THRESHOLDS_GLOBAL', '0') == '1'
+
+# Debounce por (cámara, identidad): webhook/JPEG/JSON sólo en eventos
+# arrived / still_present / left en vez de en cada detección
+EVENT_DEBOUNCE = os.getenv('EVENT_DEBOUNCE', '1') == '1'
+EVENT_LEAVE_SECONDS = float(os.getenv('EVENT_LEAVE_SECONDS', 10))
+EVENT_STILL_PRESENT_SECONDS = float(os.getenv('EVENT_STILL_PRESENT_SECONDS', 0))  # 0 = desactivado
+
+# Canal push /api/events: intervalo mínimo entre mensajes de estado por detecciones
+STATUS_PUSH_INTERVAL = float(os.getenv('STATUS_PUSH_INTERVAL', 1.0))
+
+# Caché de cajas + encodings por hash de imagen para /api/recognize (0 = desactivado)
+EMBEDDING_CACHE_SIZE = int(os.getenv('EMBEDDING_CACHE_SIZE', 128))
+
+# Identificador de la cámara de este proceso (para ?camera= en /api/snapshot)
+CAMERA_ID = os.getenv('CAMERA_ID', 'default')
+
+# Detector de caras: hog (default), cnn, haar, haar+hog o dnn:path=<modelo> (ver detectors.py)
+DETECTOR = os.getenv('DETECTOR', 'hog')
+DETECTOR_BY_CAMERA = os.getenv('DETECTOR_BY_CAMERA', '')   # JSON o ruta a .json: {"CAMERA_ID": "spec"}
+
+# Perfil de encoding por ruta (modelo de landmarks large|small y jitters, ver encoders.py).
+# ENCODER_LIVE, ENCODER_HEADLESS, ENCODER_REGISTER y ENCODING_ALLOW_MIXED se leen en encoders.py
+live_encoder = encoder_for('live')
+headless_encoder = encoder_for('headless')
+
+# Resolución adaptativa del ESP32-CAM: baja en reposo, alta con movimiento/caras
+ADAPTIVE_RES = os.getenv('ADAPTIVE_RES', '0') == '1'
+ADAPTIVE_RES_POLICY = os.getenv('ADAPTIVE_RES_POLICY', '')   # JSON o ruta a .json, por CAMERA_ID
+
+# Multi-proceso: 'inline' (todo en este proceso, default) o 'worker' (worker HTTP
+# sin estado que lee frames/resultados del motor engine.py por memoria compartida)
+ENGINE_MODE = os.getenv('ENGINE_MODE', 'inline')
+FRAME_BUS_NAME = os.getenv('FRAME_BUS_NAME', 'facerec_bus')
+ENGINE_CONTROL = os.getenv('ENGINE_CONTROL', '127.0.0.1:6001')   # host:puerto o ruta de socket unix
+ENGINE_AUTHKEY = os.getenv('ENGINE_AUTHKEY', 'facerec-engine').encode()
+BUS_POLL_INTERVAL = 0.005
+
+# Puerto del servidor asyncio para /video_feed, /video_feed/annotated y /api/events
+# con muchos visores (stream_server.py); 0 = sólo Flask
+ASYNC_STREAM_PORT = int(os.getenv('ASYNC_STREAM_PORT', 0))
+
+# Clips antes/después de cada evento desde un buffer circular de JPEG (clip_recorder.py)
+CLIP_RECORDER = os.getenv('CLIP_RECORDER', '0') == '1'
+CLIP_PRE_SECONDS = float(os.getenv('CLIP_PRE_SECONDS', 5))
+CLIP_POST_SECONDS = float(os.getenv('CLIP_POST_SECONDS', 5))
+CLIP_BUFFER_MB = float(os.getenv('CLIP_BUFFER_MB', 32))    # tope de memoria del buffer por cámara
+CLIP_FORMAT = os.getenv('CLIP_FORMAT', 'mjpeg')            # mjpeg | jpeg
+CLIPS_DIR = "clips"
+
+# Ciclo de vida de captured_frames/ y recognition_results/ (storage.py): layout por
+# cámara/fecha, topes de tamaño (MB) y antigüedad (días; 0 = sin tope) y miniaturas
+STORAGE_LAYOUT = os.getenv('STORAGE_LAYOUT', 'camera/date')   # camera/date | date | flat
+FRAMES_MAX_MB = float(os.getenv('FRAMES_MAX_MB', 0))
+FRAMES_MAX_DAYS = float(os.getenv('FRAMES_MAX_DAYS', 0))
+RESULTS_MAX_MB = float(os.getenv('RESULTS_MAX_MB', 0))
+RESULTS_MAX_DAYS = float(os.getenv('RESULTS_MAX_DAYS', 0))
+STORAGE_SWEEP_SECONDS = float(os.getenv('STORAGE_SWEEP_SECONDS', 300))
+FACE_THUMBNAILS = os.getenv('FACE_THUMBNAILS', '0') == '1'    # recorte de la cara en vez del frame
+THUMBNAIL_SIZE = int(os.getenv('THUMBNAIL_SIZE', 160))
+
+# Replicación de la galería entre nodos con un log de cambios versionado (gallery_log.py)
+# GALLERY_NODE_ID (vacío = generado y guardado en gallery_node.json) se lee en gallery_files.py
+GALLERY_PEERS = [p.strip() for p in os.getenv('GALLERY_PEERS', '').split(',') if p.strip()]  # URLs de la API
+GALLERY_SHARED_DIR = os.getenv('GALLERY_SHARED_DIR', '')           # directorio con el log de cada nodo
+GALLERY_SYNC_INTERVAL = float(os.getenv('GALLERY_SYNC_INTERVAL', 5))
+
+# Matching scatter-gather con la galería densa repartida en procesos (shard_matcher.py):
+# GALLERY_SHARDS procesos locales y/o shards ya levantados en SHARD_ADDRESSES (host:puerto o socket)
+GALLERY_SHARDS = int(os.getenv('GALLERY_SHARDS', 0))
+SHARD_ADDRESSES = [a.strip() for a in os.getenv('SHARD_ADDRESSES', '').split(',') if a.strip()]
+SHARD_TIMEOUT = float(os.getenv('SHARD_TIMEOUT', 2.0))
+SHARD_LOAD_TIMEOUT = float(os.getenv('SHARD_LOAD_TIMEOUT', 60.0))
+SHARD_AUTHKEY = os.getenv('SHARD_AUTHKEY', 'facerec-shards').encode()
+
 # Webhook configuration for Next.js integration
 WEBHOOK_URL = os.getenv('NEXTJS_WEBHOOK_URL', '')
 WEBHOOK_SECRET = os.getenv('FACIAL_RECOGNITION_WEBHOOK_SECRET', '')
@@ -35,11 +155,40 @@ current_frame = None
 recognition_thread = None
 known_encs = None
 labels = []
+gallery_index = None
+gallery_matcher = None
+gallery_lock = threading.Lock()
+gallery_write_lock = threading.Lock()   # leer-modificar-escribir encodings.npy/labels.json + log
+gallery_rows = None         # (stat de los archivos, ids, huella, encs, labels) de la galería en disco
+identity_thresholds = {}    # nombre -> umbral propio (IDENTITY_THRESHOLDS)
+gallery_sync = None
+shard_matcher = None        # pool de shards (uno por proceso que matchea)
+event_debouncer = None
+event_bus = EventBus()
+frame_hub = FrameHub()
+feed_variants = VariantCache()   # variantes activas de /video_feed (fps/ancho/calidad)
+scale_tuner = None
+adaptive_res = None
+clip_recorder = None
+storage = None              # escritura y limpieza de frames/resultados en segundo plano
+detector_spec = detector_spec_for(CAMERA_ID, DETECTOR, DETECTOR_BY_CAMERA)
+detector = make_detector(detector_spec)
+embedding_cache = EmbeddingCache(EMBEDDING_CACHE_SIZE) if EMBEDDING_CACHE_SIZE > 0 else None
+last_status_push = 0.0
+frame_bus = None            # motor: escritor; worker: lector (ver frame_bus.py)
+bus_reader_thread = None
+engine_status = None        # worker: último estado publicado por el motor
+stream_server = None
 
 # Crear directorios
 os.makedirs(FRAMES_DIR, exist_ok=True)
 os.makedirs(RESULTS_DIR, exist_ok=True)
 
+# Identidad del nodo y su log de cambios: se cargan al primer uso (ver gallery_node)
+node_state = None
+change_log = None
+gallery_node_lock = threading.Lock()
+
 def send_webhook(result, camera_id=None, camera_stream_url=None):
     """Enviar resultado de detección al webhook de Next.js"""
     if not WEBHOOK_URL:
@@ -70,28 +219,58 @@ def send_webhook(result, camera_id=None, camera_stream_url=None):
     except Exception as e:
         print(f"❌ Error enviando webhook: {e}")
 
-def gen_frames():
-    """Genera frames MJPEG desde el stream del ESP32 o webcam"""
-    cap = cv2.VideoCapture(stream_url, cv2.CAP_FFMPEG)
-    if not cap.isOpened():
-        print("❌ No se pudo abrir el stream:", stream_url)
+def source_frames():
+    """Frames para /video_feed: la cámara (inline) o los frames del motor (worker)"""
+    if ENGINE_MODE == 'worker':
+        # el worker no abre la cámara: frames del motor por memoria compartida
+        version = 0
         while True:
-            yield (b'--frame\r\n'
-                   b'Content-Type: image/jpeg\r\n\r\n' + b'' + b'\r\n')
+            new_version = frame_hub.wait_frame(version, timeout=5.0)
+            if new_version is not None:
+                version = new_version
+                yield frame_hub.frame
     
+    # Conexión compartida con el reconocimiento y los demás visores
+    cap = open_stream(stream_url)
     print("📡 Enviando stream MJPEG en /video_feed desde:", stream_url)
+    try:
+        while True:
+            # Bloquea hasta el siguiente frame; si el stream está caído el
+            # gestor reconecta en segundo plano y aquí sólo se espera
+            success, frame = cap.read()
+            if success:
+                yield frame
+    finally:
+        cap.release()
+
+def gen_frames(key):
+    """Genera frames MJPEG de una variante (fps/ancho/calidad) compartida entre visores"""
+    feed_variants.subscribe(key)
+    try:
+        for frame in source_frames():
+            # reducido y codificado una vez por frame para toda la variante;
+            # None = descartado para respetar el fps pedido
+            frame_bytes = feed_variants.jpeg(key, frame)
+            if frame_bytes is None:
+                continue
+            feed_variants.sent(key, len(frame_bytes))
+            yield (b'--frame\r\n'
+                   b'Content-Type: image/jpeg\r\n\r\n' + frame_bytes + b'\r\n')
+    finally:
+        feed_variants.unsubscribe(key)
 
+def gen_annotated_frames():
+    """MJPEG del frame del reconocimiento con cajas/nombres; sin volver a detectar"""
+    version = 0
     while True:
-        success, frame = cap.read()
-        if not success:
+        new_version = frame_hub.wait_frame(version, timeout=5.0)
+        if new_version is None:
+            # reconocimiento detenido o sin frames: esperar sin consumir CPU
+            continue
+        version = new_version
+        frame_bytes = frame_hub.annotated_jpeg()
+        if frame_bytes is None:
             continue
-        
-        # (Opcional) puedes reducir tamaño si quieres:
-        # frame = cv2.resize(frame, (640, 480))
-
-        ret, buffer = cv2.imencode('.jpg', frame)
-        frame_bytes = buffer.tobytes()
-
         yield (b'--frame\r\n'
                b'Content-Type: image/jpeg\r\n\r\n' + frame_bytes + b'\r\n')
 
@@ -100,69 +279,282 @@ def load_encodings():
     if not Path(ENCODINGS_NPY).exists() or not Path(LABELS_JSON).exists():
         return None, None
     
-    encs = np.load(ENCODINGS_NPY)
+    if GALLERY_MODE != "float32":
+        # no se carga en RAM: sólo se leen las filas del rerank
+        encs = np.load(ENCODINGS_NPY, mmap_mode="r")
+    else:
+        encs = np.load(ENCODINGS_NPY)
     with open(LABELS_JSON, "r", encoding="utf-8") as f:
         labels = json.load(f)
     
-    if encs.dtype != np.float32:
+    if encs.dtype != np.float32 and GALLERY_MODE == "float32":
         encs = encs.astype(np.float32)
     
     return encs, labels
 
-def best_match(unknown_enc: np.ndarray, known_encs: np.ndarray, labels: list, thr=THRESHOLD):
-    """Encontrar la mejor coincidencia"""
-    dists = np.linalg.norm(known_encs - unknown_enc.astype(np.float32), axis=1)
-    idx = int(np.argmin(dists))
-    name = labels[idx]
-    dist = float(dists[idx])
-    if dist <= thr:
-        return name, dist
-    return "Desconocido", dist
+def load_identity_thresholds(apply_global=False):
+    """Cargar umbrales por identidad; con `apply_global` también el umbral global calibrado (opt-in)"""
+    global identity_thresholds, THRESHOLD
+    if not IDENTITY_THRESHOLDS or not Path(IDENTITY_THRESHOLDS).exists():
+        identity_thresholds = {}
+        return
+    try:
+        with open(IDENTITY_THRESHOLDS, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        identity_thresholds = {str(k): float(v) for k, v in data.get("per_identity", {}).items()}
+    except (OSError, ValueError, AttributeError) as e:
+        print(f"⚠️ No se pudo leer {IDENTITY_THRESHOLDS}: {e}")
+        return
+    if apply_global and IDENTITY_THRESHOLDS_GLOBAL and data.get("global") is not None:
+        THRESHOLD = float(data["global"])
+    base = data.get("base")
+    if base is not None and abs(float(base) - THRESHOLD) > 1e-6:
+        print(f"⚠️ Los umbrales por identidad de {IDENTITY_THRESHOLDS} se calcularon contra {base} y el "
+              f"umbral actual es {THRESHOLD}: volver a correr gallery_analytics.py "
+              f"{'--use-global ' if IDENTITY_THRESHOLDS_GLOBAL else '--threshold ' + str(THRESHOLD) + ' '}--write")
+    print(f"🎯 Umbrales de {IDENTITY_THRESHOLDS}: global {THRESHOLD}, {len(identity_thresholds)} por identidad")
+
+load_identity_thresholds(apply_global=True)
+
+def build_gallery_index(encs):
+    """Construir el índice IVF o la galería compacta según la configuración"""
+    if encs is None:
+        return None
+    t0 = time.time()
+    if USE_ANN_INDEX and len(encs) >= ANN_MIN_ROWS:
+        index = build_index(np.asarray(encs), nlist=ANN_NLIST, nprobe=ANN_NPROBE)
+        print(f"⚡ Índice IVF construido: {index.nlist} listas, nprobe={index.nprobe} ({time.time() - t0:.1f}s)")
+        return index
+    if GALLERY_MODE in ("float16", "int8"):
+        index = QuantizedGallery(encs, mode=GALLERY_MODE, rerank=GALLERY_RERANK)
+        print(f"⚡ Galería {GALLERY_MODE}: {index.nbytes() / 1e6:.1f} MB en RAM "
+              f"(float32: {len(encs) * encs.shape[1] * 4 / 1e6:.1f} MB), rerank={GALLERY_RERANK}")
+        return index
+    return None
+
+def build_gallery_matcher(encs, labels, index, appended=None, current=None):
+    """
+    Matcher top-k vectorizado; sólo para la galería densa (sin índice).
+    Con shards la galería se lee de encodings.npy: llamar con el archivo ya guardado.
+    Con `appended` (filas sólo agregadas al final) se extiende `current` en vez de
+    reconstruirlo: GalleryMatcher.append o el último shard.
+    """
+    global shard_matcher
+    if encs is None or index is not None or len(encs) == 0:
+        return None
+    # los workers no lanzan shards propios (serían N por worker); sí usan SHARD_ADDRESSES
+    local_shards = GALLERY_SHARDS if ENGINE_MODE != 'worker' else 0
+    if not (local_shards or SHARD_ADDRESSES):
+        if appended is not None and isinstance(current, GalleryMatcher) and len(current) == len(labels) - len(appended):
+            # filas nuevas al final: se agregan al matcher publicado sin reagrupar la galería
+            return current.append(appended, labels[len(current):])
+        return GalleryMatcher(encs, labels)
+    if shard_matcher is None:
+        shard_matcher = ShardedMatcher(local_shards, SHARD_ADDRESSES, SHARD_AUTHKEY, SHARD_TIMEOUT,
+                                       SHARD_LOAD_TIMEOUT)
+        print(f"🧩 Galería repartida en {len(shard_matcher.shards)} shards")
+    if appended is not None and 0 < len(shard_matcher) == len(labels) - len(appended):
+        # filas nuevas al final: sólo recarga el último shard
+        return shard_matcher.extend(len(labels))
+    return shard_matcher.load(ENCODINGS_NPY, LABELS_JSON, len(labels))
+
+def match_faces(encs, g_encs, g_labels, g_index=None, g_matcher=None, thr=None, k=None):
+    """Matchear todas las caras de un frame -> lista de dicts (name, distance, candidates...)"""
+    thr = THRESHOLD if thr is None else thr
+    k = TOP_K if k is None else k
+    if len(encs) == 0:
+        return []
+    if g_matcher is not None:
+        top = g_matcher.top_k(np.asarray(encs), k)
+    elif g_index is not None:
+        # índice IVF/compacto: vecinos de las listas sondeadas / del rerank, agrupados por identidad
+        rows = max(GALLERY_RERANK, ANN_CANDIDATES_PER_K * max(k, 2))
+        top = [identity_candidates(*g_index.search_k(enc, rows), g_labels, k) for enc in encs]
+    else:
+        top = GalleryMatcher(g_encs, g_labels).top_k(np.asarray(encs), k)
+    # con shards cada resultado trae además si faltó algún shard
+    return [describe_match(cands, margin, thr, AMBIGUITY_MARGIN, identity_thresholds, IDENTITY_THRESHOLDS_GLOBAL,
+                           partial=bool(rest and rest[0]))
+            for cands, margin, *rest in top]
+
+def emit_result(result, frame=None, i=0):
+    """Enviar un resultado/evento a los sinks: webhook, JPEG y JSON en disco"""
+    name = result["name"]
+    
+    # Clip con los segundos previos y posteriores donde antes sólo se guardaba el frame
+    if clip_recorder is not None and frame is not None and name != "Desconocido":
+        result["clip"] = clip_recorder.trigger(name)
+    
+    # ✨ NUEVO: Enviar webhook a Next.js
+    send_webhook(result, camera_id=None, camera_stream_url=stream_url)
+    
+    if name == "Desconocido":
+        return
+    
+    now = datetime.now()
+    ts = now.strftime('%Y%m%d_%H%M%S')
+    # Guardar frame si es reconocido (en el hilo de storage, no en el loop)
+    store = start_storage()
+    if frame is not None:
+        store.save_frame(f"{name}_{ts}_{i}.jpg", frame, result.get("box"), now)
+    
+    # Guardar resultado en JSON
+    event = result.get("event")
+    suffix = f"_{name}_{event}" if event else ""
+    store.save_json(f"result_{ts}{suffix}.json", json.dumps(result, indent=2), now)
+
+def start_storage():
+    """Escritor y limpieza de captured_frames/recognition_results (uno por proceso)"""
+    global storage
+    if storage is None:
+        storage = StorageLifecycle({
+            "frames": Store(FRAMES_DIR, STORAGE_LAYOUT, FRAMES_MAX_MB, FRAMES_MAX_DAYS),
+            "results": Store(RESULTS_DIR, STORAGE_LAYOUT, RESULTS_MAX_MB, RESULTS_MAX_DAYS)
+        }, CAMERA_ID, FACE_THUMBNAILS, THUMBNAIL_SIZE, STORAGE_SWEEP_SECONDS)
+        storage.start()
+    return storage
+
+def bus_post(kind, data):
+    """Mensaje para los workers (sólo en el motor, con frame bus)"""
+    if frame_bus is not None and frame_bus.owner:
+        frame_bus.post(kind, data)
+
+def broadcast(kind, data):
+    """Publicar en /api/events de este proceso y de los workers"""
+    event_bus.publish(kind, data)
+    bus_post(kind, data)
+
+def emit_events(events, frame=None, i=0):
+    """Emitir eventos del debouncer; el frame completo sólo se guarda al llegar"""
+    for event in events:
+        broadcast("visit", event)
+        print(f"📣 Evento {event['event']}: {event['name']} "
+              f"(mejor confianza: {event['best_confidence']:.2f}, permanencia: {event['dwell_seconds']}s)")
+        emit_result(event, frame if event["event"] == "arrived" else None, i)
 
 def recognition_loop():
     """Loop principal de reconocimiento"""
     global recognition_active, last_recognitions, current_frame
+    global known_encs, labels, gallery_index, gallery_matcher, event_debouncer, scale_tuner, adaptive_res
+    global clip_recorder
     
-    known_encs, labels = load_encodings()
-    if known_encs is None:
+    encs_loaded, labels_loaded = load_encodings()
+    if encs_loaded is None:
         print("❌ No se encontraron encodings. Registra personas primero.")
         return
     
-    print(f"✅ Encodings cargados: {len(labels)} personas")
-    
-    cap = cv2.VideoCapture(stream_url)
-    if not cap.isOpened():
-        print(f"❌ No se pudo abrir el stream: {stream_url}")
+    try:
+        check_compatible(live_encoder.model)
+    except ValueError as e:
+        print(f"❌ {e}")
         return
     
-    print(f"✅ Conectado al stream: {stream_url}")
+    load_identity_thresholds()
+    index = build_gallery_index(encs_loaded)
+    matcher = build_gallery_matcher(encs_loaded, labels_loaded, index)
+    with gallery_lock:
+        known_encs, labels, gallery_index, gallery_matcher = encs_loaded, labels_loaded, index, matcher
+    print(f"✅ Encodings cargados: {len(labels_loaded)} personas")
+    
+    # El gestor de conexión reintenta solo (backoff con jitter) si la cámara cae
+    cap = open_stream(stream_url)
+    print(f"📡 Conectando al stream: {stream_url}")
     
     frame_count = 0
+    status_dirty = False
+    debouncer = None
+    if EVENT_DEBOUNCE:
+        debouncer = EventDebouncer(EVENT_LEAVE_SECONDS, EVENT_STILL_PRESENT_SECONDS)
+    event_debouncer = debouncer
+    tuner = ScaleTuner(base_scale=DOWNSCALE, min_face_px=detector.min_face_px) if AUTO_SCALE else None
+    scale_tuner = tuner
+    adaptive = None
+    if ADAPTIVE_RES:
+        policy = load_policy(ADAPTIVE_RES_POLICY, CAMERA_ID)
+        control = CameraControl(policy["control_url"]) if policy["control_url"] else CameraControl.for_stream(stream_url)
+        adaptive = AdaptiveResolution(control, policy)
+    adaptive_res = adaptive
+    recorder = None
+    if CLIP_RECORDER:
+        # hilo propio sobre la misma conexión: el loop sólo marca eventos
+        recorder = ClipRecorder(stream_url, CLIPS_DIR, CLIP_PRE_SECONDS, CLIP_POST_SECONDS,
+                                int(CLIP_BUFFER_MB * 1024 * 1024), CLIP_FORMAT)
+        recorder.start()
+    clip_recorder = recorder
+    start_storage()
     
     while recognition_active:
         ok, frame = cap.read()
+        
+        # Cerrar visitas de quienes ya no están frente a la cámara
+        if debouncer is not None:
+            emit_events(debouncer.sweep())
+        
+        # Estado pendiente de publicar (limitado a STATUS_PUSH_INTERVAL)
+        if status_dirty and publish_status():
+            status_dirty = False
+        
         if not ok:
-            time.sleep(1)
+            # sin frames en READ_TIMEOUT: el gestor ya está reconectando
             continue
         
         frame_count += 1
-        current_frame = frame.copy()
+        # Los frames del gestor son compartidos y nadie los modifica: sin copia
+        current_frame = frame
+        frame_hub.publish_frame(current_frame)
+        if frame_bus is not None:
+            frame_bus.write_frame(frame)
+        
+        # Movimiento -> subir resolución; reposo -> bajarla
+        if adaptive is not None:
+            adaptive.observe(frame)
         
         # Procesar cada AVA Frame para acelerar
         if frame_count % 3 != 0:
             continue
         
         # Redimensionar para acelerar
-        small = cv2.resize(frame, (0, 0), fx=DOWNSCALE, fy=DOWNSCALE)
-        rgb_small = cv2.cvtColor(small, cv2.COLOR_BGR2RGB)
+        def prepare(scale, frame=frame):
+            small = cv2.resize(frame, (0, 0), fx=scale, fy=scale)
+            return cv2.cvtColor(small, cv2.COLOR_BGR2RGB)
         
-        # Detectar y encodear
-        boxes = face_recognition.face_locations(rgb_small, model="hog")
-        encs = face_recognition.face_encodings(rgb_small, boxes)
+        # Detectar (con la escala aprendida para esta cámara) y encodear
+        if tuner is not None:
+            boxes, scale, rgb_small = tuner.detect(
+                detector.detect, prepare,
+                frame_width=frame.shape[1])
+        else:
+            scale = DOWNSCALE
+            rgb_small = prepare(scale)
+            boxes = detector.detect(rgb_small)
+        encs = live_encoder.encode(rgb_small, boxes)
+        if adaptive is not None:
+            adaptive.saw_faces(len(boxes))
+        
+        # Snapshot de la galería (puede cambiar con /api/register)
+        with gallery_lock:
+            g_encs, g_labels, g_index, g_matcher = known_encs, labels, gallery_index, gallery_matcher
+        
+        # Todas las caras del frame contra la galería en una sola pasada
+        matches = match_faces(encs, g_encs, g_labels, g_index, g_matcher)
+        
+        # Overlay para /video_feed/annotated (cajas en coordenadas del frame completo)
+        detections = [
+            {
+                "box": {"top": int(t / scale), "right": int(r / scale),
+                        "bottom": int(b / scale), "left": int(l / scale)},
+                "name": m["name"],
+                "distance": m["distance"],
+                "ambiguous": m["ambiguous"]
+            }
+            for m, (t, r, b, l) in zip(matches, boxes)
+        ]
+        frame_hub.set_detections(detections)
+        bus_post("detections", detections)
         
         # Procesar detecciones
-        for i, (enc, (t, r, b, l)) in enumerate(zip(encs, boxes)):
-            name, dist = best_match(enc, known_encs, labels, THRESHOLD)
+        for i, (match, (t, r, b, l)) in enumerate(zip(matches, boxes)):
+            name, dist = match["name"], match["distance"]
             
             result = {
                 "timestamp": datetime.now().isoformat(),
@@ -170,36 +562,43 @@ def recognition_loop():
                 "confidence": round(1 - dist, 2),
                 "distance": round(dist, 3),
                 "box": {
-                    "top": int(t / DOWNSCALE),
-                    "right": int(r / DOWNSCALE),
-                    "bottom": int(b / DOWNSCALE),
-                    "left": int(l / DOWNSCALE)
-                }
+                    "top": int(t / scale),
+                    "right": int(r / scale),
+                    "bottom": int(b / scale),
+                    "left": int(l / scale)
+                },
+                "candidates": match["candidates"],
+                "margin": match["margin"],
+                "ambiguous": match["ambiguous"],
+                "partial": match["partial"]
             }
             
             # Guardar en lista de resultados
             last_recognitions.append(result)
             
-            # ✨ NUEVO: Enviar webhook a Next.js
-            send_webhook(result, camera_id=None, camera_stream_url=stream_url)
-            
             if len(last_recognitions) > 50:  # Mantener solo últimos 50
                 last_recognitions.pop(0)
             
+            broadcast("recognition", result)
             print(f"👤 Reconocido: {name} (confianza: {result['confidence']:.2f})")
             
-            # Guardar frame si es reconocido
-            if name != "Desconocido":
-                filename = f"{name}_{datetime.now().strftime('%Y%m%d_%H%M%S')}_{i}.jpg"
-                filepath = os.path.join(FRAMES_DIR, filename)
-                cv2.imwrite(filepath, frame)
-                
-                # Guardar resultado en JSON
-                result_file = os.path.join(RESULTS_DIR, f"result_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json")
-                with open(result_file, 'w') as f:
-                    json.dump(result, f, indent=2)
+            # Webhook y disco: por evento de visita o, sin debounce, por detección
+            if debouncer is not None:
+                emit_events(debouncer.observe(stream_url, result), frame, i)
+            else:
+                emit_result(result, frame, i)
+        
+        if matches:
+            status_dirty = True
     
+    if debouncer is not None:
+        emit_events(debouncer.flush())
     cap.release()
+    if adaptive is not None:
+        adaptive.control.close()
+    if recorder is not None:
+        recorder.stop()
+    publish_status(force=True)
     print("🛑 Reconocimiento detenido")
 
 
@@ -500,12 +899,51 @@ def index():
                 <div class="endpoint-item">
                     <span><span class="method method-put">PUT</span> <strong>/api/config</strong> - Cambiar configuración</span>
                 </div>
+                <div class="endpoint-item">
+                    <span><span class="method method-post">POST</span> <strong>/api/recognize</strong> - Reconocer imagen (top-k)</span>
+                </div>
+                <div class="endpoint-item">
+                    <span><span class="method method-get">GET</span> <strong>/video_feed/annotated</strong> - Video con resultados dibujados</span>
+                </div>
+                <div class="endpoint-item">
+                    <span><span class="method method-get">GET</span> <strong>/api/snapshot</strong> - Último frame (JPEG)</span>
+                </div>
+                <div class="endpoint-item">
+                    <span><span class="method method-get">GET</span> <strong>/api/events</strong> - Stream SSE de resultados y estado</span>
+                </div>
             </div>
         </div>
         
         <script>
             const API_URL = window.location.origin + '/api';
             
+            function render(status, stats) {
+                // Mostrar dashboard
+                document.getElementById('loading').style.display = 'none';
+                document.getElementById('dashboard').style.display = 'grid';
+                
+                // Actualizar estado
+                const statusHtml = `
+                    <div class="status-badge ${status.active ? 'status-active' : 'status-inactive'}">
+                        ${status.active ? '🔴 ACTIVO' : '⚪ INACTIVO'}
+                    </div>
+                    <p><strong>Stream:</strong> ${status.stream_url}</p>
+                    <p><strong>Encodings:</strong> ${status.encodings_loaded ? '✅ Cargados' : '❌ No cargados'}</p>
+                    <p><strong>Total Resultados:</strong> ${status.total_results}</p>
+                `;
+                document.getElementById('statusContent').innerHTML = statusHtml;
+                
+                // Actualizar estadísticas
+                document.getElementById('totalDetections').textContent = stats.total_detections || 0;
+                document.getElementById('uniquePersons').textContent = stats.unique_persons || 0;
+                document.getElementById('unknownCount').textContent = stats.unknown_count || 0;
+                document.getElementById('totalResults').textContent = status.total_results || 0;
+                
+                // Actualizar botones
+                document.getElementById('btnStart').disabled = status.active;
+                document.getElementById('btnStop').disabled = !status.active;
+            }
+            
             async function fetchData() {
                 try {
                     const [statusRes, statsRes] = await Promise.all([
@@ -513,34 +951,7 @@ def index():
                         fetch(API_URL + '/stats')
                     ]);
                     
-                    const status = await statusRes.json();
-                    const stats = await statsRes.json();
-                    
-                    // Mostrar dashboard
-                    document.getElementById('loading').style.display = 'none';
-                    document.getElementById('dashboard').style.display = 'grid';
-                    
-                    // Actualizar estado
-                    const statusHtml = `
-                        <div class="status-badge ${status.active ? 'status-active' : 'status-inactive'}">
-                            ${status.active ? '🔴 ACTIVO' : '⚪ INACTIVO'}
-                        </div>
-                        <p><strong>Stream:</strong> ${status.stream_url}</p>
-                        <p><strong>Encodings:</strong> ${status.encodings_loaded ? '✅ Cargados' : '❌ No cargados'}</p>
-                        <p><strong>Total Resultados:</strong> ${status.total_results}</p>
-                    `;
-                    document.getElementById('statusContent').innerHTML = statusHtml;
-                    
-                    // Actualizar estadísticas
-                    document.getElementById('totalDetections').textContent = stats.total_detections || 0;
-                    document.getElementById('uniquePersons').textContent = stats.unique_persons || 0;
-                    document.getElementById('unknownCount').textContent = stats.unknown_count || 0;
-                    document.getElementById('totalResults').textContent = status.total_results || 0;
-                    
-                    // Actualizar botones
-                    document.getElementById('btnStart').disabled = status.active;
-                    document.getElementById('btnStop').disabled = !status.active;
-                    
+                    render(await statusRes.json(), await statsRes.json());
                 } catch (error) {
                     document.getElementById('loading').innerHTML = '<div class="error">❌ Error al cargar datos: ' + error.message + '</div>';
                 }
@@ -575,8 +986,18 @@ def index():
             // Cargar datos iniciales
             fetchData();
             
-            // Actualizar cada 5 segundos
-            setInterval(fetchData, 5000);
+            // Actualizaciones push vía SSE (reconecta solo y reanuda con Last-Event-ID);
+            // sin soporte de EventSource se vuelve a consultar cada 5 segundos
+            if (window.EventSource) {
+                const events = new EventSource(API_URL + '/events');
+                events.addEventListener('status', (e) => {
+                    const data = JSON.parse(e.data);
+                    render(data.status, data.stats);
+                });
+                events.addEventListener('reset', () => fetchData());
+            } else {
+                setInterval(fetchData, 5000);
+            }
         </script>
     </body>
     </html>
@@ -584,49 +1005,162 @@ def index():
     return html
 @app.route('/video_feed')
 def video_feed():
-    """Endpoint que entrega video MJPEG para la web"""
-    return Response(gen_frames(),
+    """Endpoint que entrega video MJPEG para la web (?fps=&width=&quality= opcionales)"""
+    return Response(gen_frames(parse_variant(request.args)),
                     mimetype='multipart/x-mixed-replace; boundary=frame')
 
 
-@app.route('/api/start', methods=['POST'])
-def start_recognition():
-    """Iniciar reconocimiento facial"""
+@app.route('/video_feed/annotated')
+def video_feed_annotated():
+    """MJPEG con los resultados del reconocimiento dibujados (requiere /api/start)"""
+    return Response(gen_annotated_frames(),
+                    mimetype='multipart/x-mixed-replace; boundary=frame')
+
+
+def snapshot_etag(version, frame_time, variant):
+    """ETag de un frame: la versión vuelve a 0 en cada proceso, el timestamp (ms) no se repite"""
+    return f"{CAMERA_ID}-{version}-{int((frame_time or 0) * 1000)}-{variant}"
+
+
+@app.route('/api/snapshot')
+def snapshot():
+    """Último frame como JPEG (cacheado por versión) con ETag/Last-Modified"""
+    camera = request.args.get('camera')
+    if camera and camera != CAMERA_ID:
+        return jsonify({"error": f"Cámara desconocida: {camera}"}), 404
+    width = request.args.get('w', type=int)
+    variant = frame_hub.snapshot_width(width) or 'full'
+    
+    # Cliente con la versión actual: 304 sin codificar ni enviar bytes
+    version, frame_time = frame_hub.version, frame_hub.frame_time
+    etag = snapshot_etag(version, frame_time, variant)
+    if version and request.if_none_match.contains(etag):
+        resp = Response(status=304)
+    else:
+        version, frame_time, jpeg = frame_hub.snapshot_jpeg(width)
+        if jpeg is None:
+            return jsonify({"error": "No hay frames disponibles (inicia el reconocimiento)"}), 404
+        etag = snapshot_etag(version, frame_time, variant)
+        resp = Response(jpeg, mimetype='image/jpeg')
+    resp.set_etag(etag)
+    resp.last_modified = datetime.fromtimestamp(frame_time, tz=timezone.utc)
+    resp.cache_control.no_cache = True
+    return resp
+
+
+def start_engine():
+    """Arrancar el loop de reconocimiento en este proceso -> (respuesta, código)"""
     global recognition_active, recognition_thread
     
     if recognition_active:
-        return jsonify({"error": "El reconocimiento ya está activo"}), 400
+        return {"error": "El reconocimiento ya está activo"}, 400
     
     recognition_active = True
     recognition_thread = threading.Thread(target=recognition_loop, daemon=True)
     recognition_thread.start()
+    publish_status(force=True)
     
-    return jsonify({
+    return {
         "status": "started",
         "message": "Reconocimiento facial iniciado",
         "stream_url": stream_url
-    })
+    }, 200
 
-@app.route('/api/stop', methods=['POST'])
-def stop_recognition():
-    """Detener reconocimiento facial"""
+def stop_engine():
+    """Detener el loop de reconocimiento -> (respuesta, código)"""
     global recognition_active
     
     recognition_active = False
-    return jsonify({
+    publish_status(force=True)
+    return {
         "status": "stopped",
         "message": "Reconocimiento facial detenido"
-    })
+    }, 200
 
-@app.route('/api/status', methods=['GET'])
-def get_status():
-    """Obtener estado actual"""
-    return jsonify({
+def run_command(cmd, **kwargs):
+    """Comando que cambia el estado del reconocimiento: aquí, o en el motor si somos worker"""
+    if ENGINE_MODE != 'worker':
+        return ENGINE_COMMANDS[cmd](**kwargs)
+    try:
+        return control_call(ENGINE_CONTROL, ENGINE_AUTHKEY, cmd, **kwargs)
+    except (OSError, EOFError) as e:
+        return {"error": f"Motor de reconocimiento no disponible en {ENGINE_CONTROL}: {e}"}, 503
+
+def engine_command(cmd, kwargs):
+    """Handler del canal de control en engine.py"""
+    if cmd not in ENGINE_COMMANDS:
+        return {"error": f"Comando desconocido: {cmd}"}, 400
+    return ENGINE_COMMANDS[cmd](**kwargs)
+
+@app.route('/api/start', methods=['POST'])
+def start_recognition():
+    """Iniciar reconocimiento facial"""
+    body, code = run_command("start")
+    return jsonify(body), code
+
+@app.route('/api/stop', methods=['POST'])
+def stop_recognition():
+    """Detener reconocimiento facial"""
+    body, code = run_command("stop")
+    return jsonify(body), code
+
+def worker_status_payload():
+    """Estado del motor (último publicado) + el de este worker"""
+    status = dict(engine_status or {"active": False})
+    status["total_results"] = len(last_recognitions)
+    status["engine_alive"] = frame_bus is not None and not frame_bus.is_stale()
+    status["worker"] = {
+        "pid": os.getpid(),
+        "frame_bus": frame_bus.stats() if frame_bus is not None else None,
+        "annotated_feed": frame_hub.stats(),
+        "video_feed": feed_variants.stats(),
+        "embedding_cache": embedding_cache.stats() if embedding_cache is not None else None,
+        "async_stream": stream_server.stats() if stream_server is not None else None
+    }
+    return status
+
+def status_payload():
+    """Estado actual (compartido por /api/status y /api/events)"""
+    if ENGINE_MODE == 'worker':
+        return worker_status_payload()
+    return {
         "active": recognition_active,
         "stream_url": stream_url,
         "total_results": len(last_recognitions),
-        "encodings_loaded": Path(ENCODINGS_NPY).exists()
-    })
+        "encodings_loaded": Path(ENCODINGS_NPY).exists(),
+        "gallery_mode": GALLERY_MODE,
+        "events": event_debouncer.stats() if event_debouncer is not None else None,
+        "annotated_feed": frame_hub.stats(),
+        "video_feed": feed_variants.stats(),
+        "encoding": {
+            "live": live_encoder.spec,
+            "headless": headless_encoder.spec,
+            "gallery": load_gallery_meta()
+        },
+        "detection": dict(scale_tuner.stats() if scale_tuner is not None else {"scale": DOWNSCALE},
+                          detector=detector_spec),
+        "connections": streams_stats(),
+        "adaptive_resolution": adaptive_res.stats() if adaptive_res is not None else None,
+        "clips": clip_recorder.stats() if clip_recorder is not None else None,
+        "storage": storage.stats() if storage is not None else None,
+        "gallery_sync": gallery_sync.stats() if gallery_sync is not None else None,
+        "shards": shard_matcher.stats() if shard_matcher is not None else None,
+        "thresholds": {"global": THRESHOLD, "per_identity": len(identity_thresholds)},
+        "embedding_cache": embedding_cache.stats() if embedding_cache is not None else None,
+        "frame_bus": frame_bus.stats() if frame_bus is not None else None,
+        "async_stream": stream_server.stats() if stream_server is not None else None
+    }
+
+@app.route('/api/status', methods=['GET'])
+def get_status():
+    """Obtener estado actual"""
+    global engine_status
+    if ENGINE_MODE == 'worker':
+        # estado fresco del motor; si no responde queda el último publicado
+        body, code = run_command("status")
+        if code == 200:
+            engine_status = body
+    return jsonify(status_payload())
 
 @app.route('/api/results', methods=['GET'])
 def get_results():
@@ -663,20 +1197,19 @@ def get_latest():
     
     return jsonify(last_recognitions[-1])
 
-@app.route('/api/stats', methods=['GET'])
-def get_stats():
-    """Obtener estadísticas de reconocimiento"""
+def stats_payload():
+    """Estadísticas de reconocimiento (compartidas por /api/stats y /api/events)"""
     if not last_recognitions:
-        return jsonify({
+        return {
             "total_detections": 0,
             "recognized": {},
             "unknown_count": 0
-        })
+        }
     
     recognized = {}
     unknown_count = 0
     
-    for result in last_recognitions:
+    for result in list(last_recognitions):
         if result["name"] == "Desconocido":
             unknown_count += 1
         else:
@@ -684,43 +1217,281 @@ def get_stats():
                 recognized[result["name"]] = 0
             recognized[result["name"]] += 1
     
-    return jsonify({
+    return {
         "total_detections": len(last_recognitions),
         "recognized": recognized,
         "unknown_count": unknown_count,
         "unique_persons": len(recognized)
-    })
+    }
 
-@app.route('/api/config', methods=['PUT'])
-def update_config():
-    """Actualizar configuración"""
+@app.route('/api/stats', methods=['GET'])
+def get_stats():
+    """Obtener estadísticas de reconocimiento"""
+    return jsonify(stats_payload())
+
+def publish_status(force=False):
+    """Publicar estado + estadísticas a los suscriptores de /api/events"""
+    global last_status_push
+    now = time.time()
+    if not force and now - last_status_push < STATUS_PUSH_INTERVAL:
+        return False
+    last_status_push = now
+    broadcast("status", {"status": status_payload(), "stats": stats_payload()})
+    return True
+
+@app.route('/api/events', methods=['GET'])
+def events_stream():
+    """Stream SSE con cada reconocimiento, evento de visita y cambio de estado"""
+    since = request.headers.get('Last-Event-ID') or request.args.get('since')
+    try:
+        since = int(since) if since is not None else None
+    except ValueError:
+        since = None
+    # Al conectarse el cliente recibe el estado completo sin esperar cambios
+    initial = format_sse("status", {"status": status_payload(), "stats": stats_payload()}, None)
+    return Response(event_bus.stream(since, initial),
+                    mimetype='text/event-stream',
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+def apply_config(data):
+    """Aplicar cambios de configuración -> (respuesta, código)"""
     global stream_url, THRESHOLD
     
-    data = request.json
     if 'stream_url' in data:
         if recognition_active:
-            return jsonify({"error": "Detén el reconocimiento antes de cambiar la URL"}), 400
+            return {"error": "Detén el reconocimiento antes de cambiar la URL"}, 400
         stream_url = data['stream_url']
         os.environ['STREAM_URL'] = stream_url
     
     if 'threshold' in data:
         THRESHOLD = data['threshold']
     
-    return jsonify({
+    bus_post("config", {"stream_url": stream_url, "threshold": THRESHOLD})
+    publish_status(force=True)
+    
+    return {
         "stream_url": stream_url,
         "threshold": THRESHOLD
-    })
+    }, 200
+
+@app.route('/api/config', methods=['PUT'])
+def update_config():
+    """Actualizar configuración"""
+    body, code = run_command("config", data=request.json)
+    return jsonify(body), code
+
+def gallery_files_stat():
+    return tuple((st.st_mtime_ns, st.st_size) for st in
+                 (os.stat(p) for p in (ENCODINGS_NPY, LABELS_JSON) if Path(p).exists()))
+
+def read_gallery_rows():
+    """Galería en disco (float32) con el id de cada fila; llamar con gallery_write_lock"""
+    global gallery_rows
+    # filas e ids cacheados mientras nadie más (p.ej. append_embeddings.py) toque los archivos:
+    # aplicar un lote de cambios no vuelve a leer toda la galería. En float16/int8 las filas
+    # no se guardan: serían una copia float32 que esos modos evitan tener en RAM
+    stat = gallery_files_stat()
+    if gallery_rows is not None and gallery_rows[0] == stat and gallery_rows[3] is not None:
+        # encs no se modifica en el lugar (vstack/indexado crean otro arreglo)
+        return gallery_rows[3], list(gallery_rows[4]), list(gallery_rows[1])
+    if Path(ENCODINGS_NPY).exists() and Path(LABELS_JSON).exists():
+        encs = np.load(ENCODINGS_NPY).astype(np.float32).reshape(-1, 128)
+        with open(LABELS_JSON, "r", encoding="utf-8") as f:
+            g_labels = json.load(f)
+    else:
+        encs = np.zeros((0, 128), dtype=np.float32)
+        g_labels = []
+    if gallery_rows is None or gallery_rows[0] != stat:
+        ids = row_ids(encs, g_labels)
+    else:
+        ids = gallery_rows[1]
+    gallery_rows = (stat, ids, ids_digest(ids), encs if GALLERY_MODE == "float32" else None, g_labels)
+    return encs, list(g_labels), list(ids)
+
+def commit_gallery(new_encs, new_labels, new_ids, changes, appended=None):
+    """
+    Guardar la galería, anotar `changes` en el log y publicarla en memoria;
+    llamar con gallery_write_lock. `appended`: filas sólo agregadas al final
+    (se insertan en el índice sin reconstruirlo).
+    """
+    global known_encs, labels, gallery_index, gallery_matcher, gallery_rows
+    save_gallery(new_encs, new_labels)
+    change_log.append(changes)
+    gallery_rows = (gallery_files_stat(), new_ids, ids_digest(new_ids),
+                    new_encs if GALLERY_MODE == "float32" else None, list(new_labels))
+    if GALLERY_MODE != "float32":
+        new_encs = np.load(ENCODINGS_NPY, mmap_mode="r")
+    
+    # Publicar en memoria: inserción incremental en el índice, sin reconstruir.
+    # Una reconstrucción (k-means/cuantización) se hace fuera de gallery_lock
+    # para no frenar al loop de reconocimiento; bajo el lock sólo se cambian referencias
+    with gallery_lock:
+        index, current = gallery_index, gallery_matcher
+    n_old = len(new_labels) - (len(appended) if appended is not None else 0)
+    incremental = appended is not None and index is not None and index.ntotal == n_old
+    if not incremental:
+        index = build_gallery_index(new_encs)
+    matcher = build_gallery_matcher(new_encs, new_labels, index, appended, current)
+    with gallery_lock:
+        if incremental:
+            index.add(appended, ids=list(range(n_old, len(new_labels))))
+        known_encs, labels, gallery_index, gallery_matcher = new_encs, new_labels, index, matcher
+    
+    # los workers recargan la galería desde disco en su próximo /api/recognize
+    bus_post("gallery", {"total_users": len(new_labels)})
+    publish_status(force=True)
+
+def register_encoding(name, encoding, landmark_model='large'):
+    """Agregar un encoding a la galería (disco + memoria + log) -> (respuesta, código)"""
+    try:
+        enc_array = np.asarray(encoding, dtype=np.float32)
+        node = gallery_node()["node"]
+        
+        with gallery_write_lock, gallery_file_lock():
+            # Cargar encodings existentes
+            new_encs, new_labels, new_ids = read_gallery_rows()
+            
+            # Mismo modelo de landmarks que la galería (gallery_meta.json)
+            try:
+                check_compatible(landmark_model, gallery_empty=not new_labels)
+            except ValueError as e:
+                return {"error": str(e)}, 409
+            
+            # Agregar nuevo encoding
+            change = insert_change(name, enc_array, landmark_model, node)
+            new_encs = np.vstack([new_encs, enc_array.reshape(1, -1)])
+            new_labels.append(name)
+            new_ids.append(change["id"])
+            
+            # Guardar
+            record_registration(landmark_model, gallery_empty=len(new_labels) == 1)
+            commit_gallery(new_encs, new_labels, new_ids, [change], appended=enc_array.reshape(1, -1))
+        
+        print(f"✅ Usuario {name} registrado exitosamente")
+        
+        return {
+            "success": True,
+            "message": f"Usuario {name} registrado exitosamente",
+            "total_users": len(new_labels)
+        }, 200
+    except Exception as e:
+        print(f"❌ Error registrando usuario: {e}")
+        return {"error": str(e)}, 500
+
+def delete_identity(name):
+    """Borrar todas las muestras de una persona (disco + memoria + log) -> (respuesta, código)"""
+    node = gallery_node()["node"]
+    with gallery_write_lock, gallery_file_lock():
+        encs, g_labels, ids = read_gallery_rows()
+        keep = [i for i, label in enumerate(g_labels) if label != name]
+        if len(keep) == len(g_labels):
+            return {"error": f"Usuario {name} no encontrado en la galería"}, 404
+        changes = [delete_change(rid, name, node)
+                   for rid in dict.fromkeys(ids[i] for i, label in enumerate(g_labels) if label == name)]
+        commit_gallery(encs[keep], [g_labels[i] for i in keep], [ids[i] for i in keep], changes)
+    print(f"🗑️ Usuario {name} eliminado ({len(g_labels) - len(keep)} muestras)")
+    return {"success": True, "deleted": len(g_labels) - len(keep), "total_users": len(keep)}, 200
+
+def apply_gallery_changes(changes):
+    """
+    Cambios de otro nodo: aplicar los que falten y anotarlos en el log local.
+    Insert de un id presente o con lápida, o delete ya anotado: se ignoran.
+    """
+    with gallery_write_lock, gallery_file_lock():
+        encs, g_labels, ids = read_gallery_rows()
+        present = set(ids)
+        deleted = set()
+        inserts, applied = [], []
+        for change in changes:
+            rid = change["id"]
+            if change["op"] == "insert":
+                if rid in present or rid in change_log.deleted or rid in deleted:
+                    continue
+                enc = decode_vec(change["enc"])
+                try:
+                    check_compatible(change.get("model", "large"), gallery_empty=not present)
+                except ValueError as e:
+                    print(f"⚠️ Cambio {rid} de {change.get('origin')} rechazado: {e}")
+                    continue
+                if not present:
+                    record_registration(change.get("model", "large"), gallery_empty=True)
+                present.add(rid)
+                inserts.append((rid, change["name"], enc))
+            elif rid not in change_log.deleted and rid not in deleted:
+                deleted.add(rid)
+                present.discard(rid)
+            else:
+                continue
+            applied.append({k: v for k, v in change.items() if k != "v"})
+        if not applied:
+            return 0
+        inserts = [(rid, n, e) for rid, n, e in inserts if rid not in deleted]
+        keep = [i for i, rid in enumerate(ids) if rid not in deleted]
+        new_rows = np.asarray([e for _, _, e in inserts], dtype=np.float32).reshape(-1, 128)
+        new_encs = np.vstack([encs[keep], new_rows])
+        new_labels = [g_labels[i] for i in keep] + [n for _, n, _ in inserts]
+        new_ids = [ids[i] for i in keep] + [rid for rid, _, _ in inserts]
+        # sin borrados las filas nuevas van al índice sin reconstruirlo
+        commit_gallery(new_encs, new_labels, new_ids, applied,
+                       appended=new_rows if len(keep) == len(ids) else None)
+    print(f"🔄 Galería sincronizada: +{len(inserts)} / -{len(ids) - len(keep)} "
+          f"filas ({len(new_labels)} en total, versión {change_log.version})")
+    return len(applied)
+
+def gallery_node():
+    """
+    Estado del nodo (id y cursores) y su log de cambios (en el directorio
+    compartido si lo hay). Sólo el proceso dueño de la galería (inline o
+    engine.py) crea gallery_node.json; un worker lo lee y, si el motor todavía
+    no lo creó, devuelve None.
+    """
+    global node_state, change_log
+    if node_state is None:
+        with gallery_node_lock:
+            if node_state is None:
+                node = open_gallery_node(owner=ENGINE_MODE != 'worker')
+                if node is None:
+                    return None
+                change_log = node[1]
+                node_state = node[0]
+    return node_state
+
+def start_gallery_sync():
+    """Hilo que trae los cambios de GALLERY_PEERS / GALLERY_SHARED_DIR"""
+    global gallery_sync
+    gallery_node()
+    if gallery_sync is None and (GALLERY_PEERS or GALLERY_SHARED_DIR):
+        gallery_sync = GallerySync(change_log, node_state, GALLERY_NODE_JSON, apply_gallery_changes,
+                                   GALLERY_PEERS, GALLERY_SHARED_DIR or None, GALLERY_SYNC_INTERVAL)
+        gallery_sync.start()
+        print(f"🔄 Sincronización de galería: nodo {node_state['node']}, "
+              f"pares {', '.join(GALLERY_PEERS + ([GALLERY_SHARED_DIR] if GALLERY_SHARED_DIR else []))}")
+    return gallery_sync
+
+def gallery_sync_payload():
+    """Versión del log y huella de la galería de este nodo (None si el nodo aún no existe)"""
+    if gallery_node() is None:
+        return None
+    with gallery_write_lock:
+        # sólo se relee el disco si la galería cambió desde la última vez
+        if gallery_rows is None or gallery_rows[0] != gallery_files_stat():
+            read_gallery_rows()
+        ids, digest = gallery_rows[1], gallery_rows[2]
+    payload = {"node": node_state["node"], "version": change_log.version, "rows": len(ids),
+               "digest": digest}
+    if gallery_sync is not None:
+        payload.update(sync=gallery_sync.stats())
+    return payload
 
 @app.route('/api/register', methods=['POST'])
 def register_person():
     """Registrar una nueva persona con encoding facial"""
-    global known_encs, labels
-    
     data = request.json
     name = data.get('name')
     encoding = data.get('encoding')  # Array de 128 números
     image_url = data.get('image_url')
     client_id = data.get('client_id')
+    landmark_model = data.get('landmark_model', 'large')   # con qué modelo se calculó el encoding
     
     if not name or not encoding:
         return jsonify({"error": "name and encoding are required"}), 400
@@ -728,41 +1499,215 @@ def register_person():
     try:
         # Convertir encoding a numpy array
         enc_array = np.array(encoding, dtype=np.float32)
-        
-        # Validar que sea un array de 128 dimensiones
-        if enc_array.shape != (128,):
-            return jsonify({
-                "error": f"Encoding must be 128-dimensional, got {enc_array.shape}"
-            }), 400
-        
-        # Cargar encodings existentes
-        if Path(ENCODINGS_NPY).exists() and Path(LABELS_JSON).exists():
-            known_encs = np.load(ENCODINGS_NPY)
-            with open(LABELS_JSON, "r", encoding="utf-8") as f:
-                labels = json.load(f)
-        else:
-            known_encs = np.array([]).reshape(0, 128)
-            labels = []
-        
-        # Agregar nuevo encoding
-        known_encs = np.vstack([known_encs, enc_array.reshape(1, -1)])
-        labels.append(name)
-        
-        # Guardar
-        np.save(ENCODINGS_NPY, known_encs)
-        with open(LABELS_JSON, "w", encoding="utf-8") as f:
-            json.dump(labels, f, ensure_ascii=False, indent=2)
-        
-        print(f"✅ Usuario {name} registrado exitosamente")
-        
+    except (TypeError, ValueError) as e:
+        return jsonify({"error": str(e)}), 400
+    
+    # Validar que sea un array de 128 dimensiones
+    if enc_array.shape != (128,):
         return jsonify({
-            "success": True,
-            "message": f"Usuario {name} registrado exitosamente",
-            "total_users": len(labels)
-        })
+            "error": f"Encoding must be 128-dimensional, got {enc_array.shape}"
+        }), 400
+    
+    # En modo worker el motor es el único que escribe la galería
+    body, code = run_command("register", name=name, encoding=enc_array.tolist(),
+                             landmark_model=landmark_model)
+    return jsonify(body), code
+
+@app.route('/api/gallery/<name>', methods=['DELETE'])
+def delete_person(name):
+    """Eliminar a una persona de la galería (se replica a los demás nodos)"""
+    body, code = run_command("delete", name=name)
+    return jsonify(body), code
+
+@app.route('/api/gallery/changes', methods=['GET'])
+def gallery_changes():
+    """Cambios de la galería con versión > since (para la sincronización entre nodos)"""
+    since = request.args.get('since', 0, type=int)
+    limit = min(request.args.get('limit', 500, type=int), 5000)
+    if gallery_node() is None:
+        return jsonify({"error": "El motor todavía no inicializó el nodo de la galería"}), 503
+    return jsonify({
+        "node": node_state["node"],
+        "version": change_log.version,
+        "changes": change_log.since(since, limit)
+    })
+
+@app.route('/api/gallery', methods=['GET'])
+def gallery_info():
+    """Versión del log, filas y huella de la galería de este nodo"""
+    payload = gallery_sync_payload()
+    if payload is None:
+        return jsonify({"error": "El motor todavía no inicializó el nodo de la galería"}), 503
+    return jsonify(payload)
+
+@app.route('/api/recognize', methods=['POST'])
+def recognize_image():
+    """Reconocer todas las caras de una imagen (base64) con top-k y margen"""
+    global known_encs, labels, gallery_index, gallery_matcher
+    
+    data = request.json or {}
+    image_b64 = data.get('image')
+    if not image_b64:
+        return jsonify({"error": "image (base64) is required"}), 400
+    k = data.get('k', TOP_K)
+    try:
+        k = int(k) if isinstance(k, (int, str)) and not isinstance(k, bool) else None
+    except ValueError:
+        k = None
+    if k is None or not 1 <= k <= MAX_TOP_K:
+        return jsonify({"error": f"k must be an integer between 1 and {MAX_TOP_K}"}), 400
+    try:
+        check_compatible(headless_encoder.model)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 409
+    
+    try:
+        img_data = base64.b64decode(image_b64.split(',')[1] if ',' in image_b64 else image_b64)
     except Exception as e:
-        print(f"❌ Error registrando usuario: {e}")
-        return jsonify({"error": str(e)}), 500
+        return jsonify({"error": f"Could not decode image: {e}"}), 400
+    
+    def decode(raw):
+        try:
+            return cv2.imdecode(np.frombuffer(raw, np.uint8), cv2.IMREAD_COLOR)
+        except cv2.error:
+            return None
+    
+    def detect_and_encode(img):
+        rgb = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+        boxes = detector.detect(rgb)
+        return boxes, headless_encoder.encode(rgb, boxes)
+    
+    # Detección + encoding cacheados por hash; el matching se rehace siempre
+    if embedding_cache is not None:
+        boxes, encs, img, cached = embedding_cache.lookup(img_data, decode, detect_and_encode,
+                                                        params=f"{detector_spec}|{headless_encoder.spec}")
+        if boxes is None:
+            return jsonify({"error": "Could not decode image"}), 400
+    else:
+        img = decode(img_data)
+        if img is None:
+            return jsonify({"error": "Could not decode image"}), 400
+        boxes, encs = detect_and_encode(img)
+        cached = False
+    
+    # Cargar la galería si el reconocimiento en vivo aún no la cargó (el índice
+    # se construye fuera de gallery_lock; si otro request la cargó antes, se usa esa)
+    with gallery_lock:
+        g_encs, g_labels, g_index, g_matcher = known_encs, labels, gallery_index, gallery_matcher
+    if g_encs is None:
+        encs_loaded, labels_loaded = load_encodings()
+        if encs_loaded is None:
+            return jsonify({"error": "No encodings loaded"}), 404
+        index = build_gallery_index(encs_loaded)
+        matcher = build_gallery_matcher(encs_loaded, labels_loaded, index)
+        with gallery_lock:
+            if known_encs is None:
+                known_encs, labels, gallery_index, gallery_matcher = encs_loaded, labels_loaded, index, matcher
+            g_encs, g_labels, g_index, g_matcher = known_encs, labels, gallery_index, gallery_matcher
+    
+    matches = match_faces(encs, g_encs, g_labels, g_index, g_matcher, k=k)
+    
+    faces = []
+    for match, (t, r, b, l) in zip(matches, boxes):
+        match["confidence"] = round(1 - match["distance"], 2)
+        match["distance"] = round(match["distance"], 3)
+        match["box"] = {"top": int(t), "right": int(r), "bottom": int(b), "left": int(l)}
+        faces.append(match)
+    
+    return jsonify({
+        "faces": faces,
+        "total": len(faces),
+        "cached": cached
+    })
+
+# Comandos del canal de control (engine.py los atiende para los workers)
+ENGINE_COMMANDS = {
+    "start": start_engine,
+    "stop": stop_engine,
+    "config": apply_config,
+    "register": register_encoding,
+    "delete": delete_identity,
+    "status": lambda: (status_payload(), 200),
+}
+
+def apply_bus_message(kind, data):
+    """Worker: reflejar en este proceso un mensaje del motor"""
+    global engine_status, stream_url, THRESHOLD, known_encs, labels, gallery_index, gallery_matcher
+    if kind == "recognition":
+        last_recognitions.append(data)
+        if len(last_recognitions) > 50:
+            last_recognitions.pop(0)
+        event_bus.publish(kind, data)
+    elif kind == "visit":
+        event_bus.publish(kind, data)
+    elif kind == "status":
+        engine_status = data["status"]
+        event_bus.publish(kind, {"status": status_payload(), "stats": stats_payload()})
+    elif kind == "detections":
+        frame_hub.set_detections(data)
+    elif kind == "config":
+        stream_url, THRESHOLD = data["stream_url"], data["threshold"]
+    elif kind == "gallery":
+        # otro proceso cambió la galería: recargar desde disco al próximo uso
+        with gallery_lock:
+            known_encs, labels, gallery_index, gallery_matcher = None, [], None, None
+
+def bus_reader_loop():
+    """Worker: seguir el frame bus del motor (frames -> frame_hub, mensajes -> estado local)"""
+    global frame_bus, current_frame
+    frame_seq = msg_seq = 0
+    last_attach = 0.0
+    while True:
+        if (frame_bus is None or frame_bus.is_stale()) and time.time() - last_attach >= 1.0:
+            # motor sin arrancar o reiniciado (segmento nuevo): (re)conectar
+            last_attach = time.time()
+            try:
+                bus = FrameBus.attach(FRAME_BUS_NAME)
+            except FileNotFoundError:
+                bus = None
+            if bus is not None and (frame_bus is None or bus.created != frame_bus.created):
+                old, frame_bus, frame_seq, msg_seq = frame_bus, bus, 0, 0
+                if old is not None:
+                    old.close()
+                print(f"🔗 Conectado al frame bus '{FRAME_BUS_NAME}' (motor pid {bus.pid})")
+            elif bus is not None:
+                bus.close()
+        if frame_bus is None:
+            time.sleep(1.0)
+            continue
+        
+        msg_seq, messages = frame_bus.read_messages(msg_seq)
+        for _, kind, data in messages:
+            apply_bus_message(kind, data)
+        got = frame_bus.read_frame(frame_seq)
+        if got is not None:
+            frame_seq, _, current_frame = got
+            frame_hub.publish_frame(current_frame)
+        elif not messages:
+            time.sleep(BUS_POLL_INTERVAL)
+
+@app.before_request
+def ensure_bus_reader():
+    """Worker: arrancar el lector en el primer request (después del fork del servidor)"""
+    global bus_reader_thread
+    if ENGINE_MODE != 'worker' or bus_reader_thread is not None:
+        return
+    with gallery_lock:
+        if bus_reader_thread is None:
+            bus_reader_thread = threading.Thread(target=bus_reader_loop, daemon=True)
+            bus_reader_thread.start()
+
+def start_async_streams(port=ASYNC_STREAM_PORT, host='0.0.0.0'):
+    """Levantar stream_server.py en un hilo con su propio event loop"""
+    global stream_server
+    # inline: /video_feed lee la cámara (conexión compartida); worker: frames del motor
+    open_camera = None if ENGINE_MODE == 'worker' else (lambda: open_stream(stream_url))
+    stream_server = StreamServer(frame_hub, event_bus,
+                                 status_fn=lambda: {"status": status_payload(), "stats": stats_payload()},
+                                 open_camera=open_camera, variants=feed_variants)
+    if ENGINE_MODE == 'worker':
+        ensure_bus_reader()
+    return stream_server.start_in_thread(host, port)
 
 def add_seed_results():
     """Agregar 5 resultados de prueba al inicio"""
@@ -815,6 +1760,12 @@ if __name__ == '__main__':
     else:
         print("⚠️ No se encontraron encodings. Registra personas primero con register_auto.py")
     
+    if ASYNC_STREAM_PORT:
+        start_async_streams()
+    
+    if ENGINE_MODE != 'worker':
+        start_gallery_sync()
+    
     # Usar puerto de variable de entorno o 5000 por defecto
     port = int(os.environ.get('FLASK_PORT', 5000))
     app.run(host='0.0.0.0', port=port, debug=False)
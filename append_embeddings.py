@@ -2,40 +2,12 @@
 import sys
 import json
 import os
-from pathlib import Path
-import numpy as np
+from gallery_files import append_rows
 
-ENCODINGS_NPY = "encodings.npy"
-LABELS_JSON = "labels.json"
 
-
-def load_master():
-    if Path(ENCODINGS_NPY).exists():
-        enc_master = np.load(ENCODINGS_NPY)
-        if enc_master.ndim == 1:
-            enc_master = enc_master.reshape(1, -1)
-        if Path(LABELS_JSON).exists():
-            labels = json.loads(Path(LABELS_JSON).read_text(encoding="utf-8"))
-        else:
-            labels = []
-    else:
-        enc_master = np.zeros((0, 128), dtype=np.float32)
-        labels = []
-    return enc_master, labels
-
-
-def append_embeddings(name, enc_list):
-    enc_master, labels = load_master()
-    # normalize enc_list to numpy
-    enc_new = np.vstack([np.asarray(e, dtype=np.float32).reshape(1, -1) for e in enc_list])
-    if enc_master.size:
-        enc_all = np.vstack([enc_master, enc_new])
-    else:
-        enc_all = enc_new
-    labels += [name] * len(enc_list)
-    np.save(ENCODINGS_NPY, enc_all)
-    Path(LABELS_JSON).write_text(json.dumps(labels, ensure_ascii=False, indent=2), encoding="utf-8")
-    return enc_all.shape[0], len(labels)
+def append_embeddings(name, enc_list, landmark_model="large"):
+    # bloqueo entre procesos + escritura atómica (gallery_files.py)
+    return append_rows(name, enc_list, landmark_model)
 
 
 def main():
@@ -52,7 +24,7 @@ def main():
         sys.exit(3)
 
     try:
-        total_rows, total_labels = append_embeddings(name, encs)
+        total_rows, total_labels = append_embeddings(name, encs, payload.get("landmark_model", "large"))
         print(json.dumps({"ok": True, "message": "Appended embeddings", "total_rows": total_rows}))
         sys.exit(0)
     except Exception as e:
@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+"""
+Benchmark de backends de detección (detectors.py): latencia y recall sobre
+un conjunto local de imágenes.
+
+Verdad de referencia:
+- `--annotations anotaciones.json` con {"archivo.jpg": [[top, right, bottom, left], ...]}
+- o, si no hay anotaciones, las cajas de un detector de referencia
+  (`--reference`, por defecto HOG con 2 upsamples: lento pero con buen recall)
+
+Una detección cuenta como acierto si su IoU con una caja de referencia es
+>= `--iou` (0.3 por defecto: cada backend recorta la cara distinto).
+
+Uso:
+    python bench_detectors.py --images captured_frames \
+        --detectors "hog;haar;haar+hog;dnn:path=models/face_detection_yunet_2023mar.onnx,conf=0.7" \
+        --downscale 0.5
+"""
+import os
+import json
+import time
+import argparse
+import cv2
+import numpy as np
+
+from detectors import make_detector, _iou
+
+IMAGE_EXTS = (".jpg", ".jpeg", ".png", ".bmp")
+
+
+def load_images(dirs, limit=None):
+    paths = []
+    for d in dirs:
+        for root, _, files in os.walk(d):
+            paths += [os.path.join(root, f) for f in sorted(files) if f.lower().endswith(IMAGE_EXTS)]
+    return paths[:limit] if limit else paths
+
+
+def match_counts(found, truth, iou_threshold):
+    """(verdaderos positivos, falsos positivos) con emparejamiento voraz por IoU."""
+    used = set()
+    tp = 0
+    for box in found:
+        best, best_iou = None, iou_threshold
+        for j, ref in enumerate(truth):
+            if j in used:
+                continue
+            iou = _iou(box, ref)
+            if iou >= best_iou:
+                best, best_iou = j, iou
+        if best is not None:
+            used.add(best)
+            tp += 1
+    return tp, len(found) - tp
+
+
+def run(detector, images, truth, iou_threshold):
+    times, tp, fp, total = [], 0, 0, 0
+    for key, rgb in images:
+        t0 = time.perf_counter()
+        found = detector.detect(rgb)
+        times.append(time.perf_counter() - t0)
+        a, b = match_counts(found, truth[key], iou_threshold)
+        tp, fp, total = tp + a, fp + b, total + len(truth[key])
+    times = np.asarray(times) * 1000
+    return {
+        "mean_ms": round(float(times.mean()), 1),
+        "p95_ms": round(float(np.percentile(times, 95)), 1),
+        "recall": round(tp / total, 3) if total else None,
+        "precision": round(tp / (tp + fp), 3) if tp + fp else None,
+        "faces": total,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--images', default="captured_frames,capturas_registro",
+                        help="directorios separados por coma")
+    parser.add_argument('--detectors', default="hog;haar;haar+hog",
+                        help="especificaciones separadas por ';'")
+    parser.add_argument('--annotations', default=None)
+    parser.add_argument('--reference', default="hog:upsample=2")
+    parser.add_argument('--downscale', type=float, default=0.5, help="igual que DOWNSCALE del loop")
+    parser.add_argument('--iou', type=float, default=0.3)
+    parser.add_argument('--limit', type=int, default=200)
+    args = parser.parse_args()
+
+    paths = load_images([d for d in args.images.split(",") if d], args.limit)
+    if not paths:
+        raise SystemExit(f"No hay imágenes en {args.images}")
+    images = []
+    for p in paths:
+        bgr = cv2.imread(p)
+        if bgr is None:
+            continue
+        small = cv2.resize(bgr, (0, 0), fx=args.downscale, fy=args.downscale)
+        images.append((p, cv2.cvtColor(small, cv2.COLOR_BGR2RGB)))
+
+    if args.annotations:
+        with open(args.annotations, encoding="utf-8") as f:
+            ann = json.load(f)
+        # anotaciones en px de la imagen original
+        truth = {k: [tuple(int(v * args.downscale) for v in b) for b in ann.get(os.path.basename(k), [])]
+                 for k, _ in images}
+        source = args.annotations
+    else:
+        ref = make_detector(args.reference)
+        truth = {k: ref.detect(rgb) for k, rgb in images}
+        source = f"detector de referencia {args.reference}"
+
+    print(f"{len(images)} imágenes, {sum(len(v) for v in truth.values())} caras ({source}), "
+          f"downscale {args.downscale}, IoU >= {args.iou}")
+    print(f"{'detector':<40} {'media ms':>9} {'p95 ms':>8} {'recall':>7} {'precisión':>10}")
+    for spec in args.detectors.split(";"):
+        det = make_detector(spec)
+        det.detect(images[0][1])   # calentamiento (carga de modelos)
+        r = run(det, images, truth, args.iou)
+        print(f"{spec:<40} {r['mean_ms']:>9} {r['p95_ms']:>8} {str(r['recall']):>7} {str(r['precision']):>10}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+"""
+Benchmark del matcher por shards (shard_matcher.py) contra un solo proceso.
+
+Escribe una galería sintética (encodings.npy + labels.json en un directorio
+temporal), arma GalleryMatcher en este proceso y ShardedMatcher con 1..S
+procesos, y reporta para cada uno:
+
+  consultas/s   consultas de `--faces` caras (como un frame) en serie
+  p50 / p95     latencia por consulta (ms)
+  MB/proceso    memoria de la galería en el proceso más cargado
+  iguales       fracción de consultas con el mismo top-k que un solo proceso
+
+Con `--kill` mata un shard a mitad de la medición y reporta las consultas
+respondidas con shards faltantes y el tiempo hasta que se relanza.
+
+Los shards sólo rinden más con más núcleos que shards: con un núcleo el
+scatter-gather agrega la ida y vuelta por socket sin paralelizar nada.
+
+Uso: python bench_shards.py --rows 1000000 --shards 2,4 --queries 200
+"""
+import os
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import numpy as np
+
+from matching import GalleryMatcher
+from shard_matcher import ShardedMatcher
+from bench_ann import synthetic_gallery, SAMPLE_STD, DIM
+
+
+def run(matcher, queries, k):
+    lat, results = [], []
+    for q in queries:
+        t0 = time.perf_counter()
+        results.append(matcher.top_k(q, k))
+        lat.append(time.perf_counter() - t0)
+    return np.asarray(lat), results
+
+
+def same(a, b):
+    return [c[0] for c in a[0]] == [c[0] for c in b[0]] and np.allclose(
+        [c[1] for c in a[0]], [c[1] for c in b[0]], atol=1e-4)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=200000)
+    parser.add_argument('--shards', default="1,2,4")
+    parser.add_argument('--queries', type=int, default=100)
+    parser.add_argument('--faces', type=int, default=2, help="caras por consulta")
+    parser.add_argument('-k', type=int, default=3)
+    parser.add_argument('--kill', action='store_true', help="matar un shard a mitad de la medición")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    gallery, centers = synthetic_gallery(args.rows, rng)
+    labels = [f"id{i % len(centers)}" for i in range(args.rows)]
+    who = rng.integers(0, len(centers), (args.queries, args.faces))
+    queries = centers[who] + rng.normal(0, SAMPLE_STD, (args.queries, args.faces, DIM)).astype(np.float32)
+
+    tmp = tempfile.mkdtemp(prefix="bench_shards_")
+    npy, lbl = os.path.join(tmp, "encodings.npy"), os.path.join(tmp, "labels.json")
+    np.save(npy, gallery)
+    with open(lbl, "w", encoding="utf-8") as f:
+        json.dump(labels, f)
+    try:
+        print(f"{args.rows} filas, {len(centers)} identidades, {args.queries} consultas de {args.faces} caras, "
+              f"{os.cpu_count()} CPUs")
+        print(f"{'modo':<12} {'consultas/s':>12} {'p50 ms':>8} {'p95 ms':>8} {'MB/proceso':>11} {'iguales':>8} "
+              f"{'carga(s)':>9}")
+        t0 = time.perf_counter()
+        single = GalleryMatcher(gallery, labels)
+        t_load = time.perf_counter() - t0
+        run(single, queries[:5], args.k)
+        lat, truth = run(single, queries, args.k)
+        print(f"{'1 proceso':<12} {len(lat) / lat.sum():>12.1f} {np.percentile(lat, 50) * 1000:>8.1f} "
+              f"{np.percentile(lat, 95) * 1000:>8.1f} {single.encs.nbytes / 1e6:>11.0f} {1.0:>8.2f} "
+              f"{t_load:>9.1f}")
+        del single
+
+        for n in (int(s) for s in args.shards.split(",")):
+            t0 = time.perf_counter()
+            sharded = ShardedMatcher(workers=n, timeout=10.0).load(npy, lbl, args.rows)
+            t_load = time.perf_counter() - t0
+            try:
+                run(sharded, queries[:5], args.k)
+                if args.kill:
+                    half = len(queries) // 2
+                    lat1, res1 = run(sharded, queries[:half], args.k)
+                    victim = sharded.shards[-1]
+                    victim.process.kill()
+                    t_kill = time.perf_counter()
+                    lat2, res2 = run(sharded, queries[half:], args.k)
+                    lat, results = np.concatenate([lat1, lat2]), res1 + res2
+                    while not victim.up and time.perf_counter() - t_kill < 60:
+                        time.sleep(0.05)
+                    print(f"   shard matado: {sharded.partial_queries} consultas parciales, "
+                          f"relanzado en {time.perf_counter() - t_kill:.1f}s")
+                else:
+                    lat, results = run(sharded, queries, args.k)
+                equal = np.mean([same(a, b) for a, b in zip(results, truth) for a, b in zip(a, b)])
+                mb = max(s.get("mb", 0.0) for s in sharded.stats()["shards"])
+                print(f"{f'{n} shards':<12} {len(lat) / lat.sum():>12.1f} {np.percentile(lat, 50) * 1000:>8.1f} "
+                      f"{np.percentile(lat, 95) * 1000:>8.1f} {mb:>11.0f} {equal:>8.2f} {t_load:>9.1f}")
+            finally:
+                sharded.close()
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
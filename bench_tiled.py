@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+"""
+Benchmark de la detección por mosaicos (TiledDetector) en frames UXGA.
+
+Arma frames sintéticos de 1600x1200 pegando caras recortadas de imágenes
+locales (una cara por imagen, detectada con HOG) a tamaños entre
+`--min-face` y `--max-face` px en posiciones al azar, y compara:
+
+  full      face_locations en una sola llamada a resolución completa (referencia)
+  half      una sola llamada con el frame reducido a 0.5 (lo que se hace hoy)
+  tiled     mosaicos en paralelo con 1 hilo y con `--workers` hilos
+
+Reporta ms por frame, speedup contra `full`, recall contra las caras pegadas
+(una cara cuenta si el centro de alguna caja cae dentro) y coincidencia con
+las cajas de `full`. Antes verifica que la grilla de frames chicos (más
+chicos que un mosaico, como en /api/recognize o con escala reducida) quede
+dentro del frame y lo cubra, y que en ellos tiled dé las mismas cajas que HOG.
+
+Uso: python bench_tiled.py --faces capturas_registro --frames 10 --workers 4
+"""
+import os
+import time
+import argparse
+import cv2
+import numpy as np
+
+from detectors import HogDetector, TiledDetector, _iou
+from bench_detectors import load_images
+
+W, H = 1600, 1200
+
+
+def face_sprites(dirs, limit=50):
+    """Recortes de cara (con margen) de las imágenes locales."""
+    hog = HogDetector()
+    sprites = []
+    for path in load_images(dirs, limit):
+        bgr = cv2.imread(path)
+        if bgr is None:
+            continue
+        boxes = hog.detect(cv2.cvtColor(bgr, cv2.COLOR_BGR2RGB))
+        if not boxes:
+            continue
+        t, r, b, l = max(boxes, key=lambda x: (x[2] - x[0]) * (x[1] - x[3]))
+        m = (b - t) // 2
+        crop = bgr[max(0, t - m):b + m, max(0, l - m):r + m]
+        if crop.size:
+            sprites.append(crop)
+    return sprites
+
+
+def synthetic_frame(sprites, n_faces, min_face, max_face, rng):
+    """Frame UXGA con fondo suave y caras pegadas; devuelve (rgb, rectángulos de cara)."""
+    bg = cv2.resize(rng.integers(60, 200, (12, 16, 3), dtype=np.uint8), (W, H), interpolation=cv2.INTER_CUBIC)
+    rects = []
+    for _ in range(n_faces * 20):
+        if len(rects) >= n_faces:
+            break
+        sprite = sprites[rng.integers(len(sprites))]
+        size = int(rng.uniform(min_face, max_face) * 2)     # el recorte incluye margen ~2x la cara
+        h = size
+        w = int(sprite.shape[1] * size / sprite.shape[0])
+        y, x = int(rng.integers(0, H - h)), int(rng.integers(0, W - w))
+        rect = (y, x + w, y + h, x)
+        if any(_iou(rect, o) > 0 for o in rects):
+            continue
+        bg[y:y + h, x:x + w] = cv2.resize(sprite, (w, h), interpolation=cv2.INTER_AREA)
+        rects.append(rect)
+    return cv2.cvtColor(bg, cv2.COLOR_BGR2RGB), rects
+
+
+def found_faces(boxes, rects, scale=1.0):
+    hits = 0
+    for (t, r, b, l) in rects:
+        for bt, br, bb, bl in boxes:
+            cy, cx = (bt + bb) / 2 / scale, (bl + br) / 2 / scale
+            if t <= cy <= b and l <= cx <= r:
+                hits += 1
+                break
+    return hits
+
+
+def agreement(boxes, ref):
+    if not ref:
+        return 1.0
+    return sum(any(_iou(b, r) >= 0.5 for b in boxes) for r in ref) / len(ref)
+
+
+def check_small_frames(tiled, hog, sprites, rng):
+    """Mosaicos dentro del frame y cubriéndolo, y mismas cajas que HOG en frames chicos."""
+    for shape in [(100, 100), (150, 120), (240, 320), (300, 1600), (1200, 200)]:
+        rects = tiled.tiles(shape)
+        h, w = shape
+        assert all(0 <= y0 < y1 <= h and 0 <= x0 < x1 <= w for y0, x0, y1, x1 in rects), (shape, rects)
+        covered = np.zeros(shape, dtype=bool)
+        for y0, x0, y1, x1 in rects:
+            covered[y0:y1, x0:x1] = True
+        assert covered.all(), (shape, rects)
+    for size in [(160, 120), (320, 240)]:
+        rgb, _ = synthetic_frame(sprites, 1, 40, 60, rng)
+        rgb = cv2.resize(rgb, size, interpolation=cv2.INTER_AREA)
+        assert agreement(tiled.detect(rgb), hog.detect(rgb)) == 1.0, size
+    print("✅ Frames chicos: mosaicos dentro del frame y mismas cajas que HOG")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--faces', default="capturas_registro,captured_frames")
+    parser.add_argument('--frames', type=int, default=10)
+    parser.add_argument('--faces-per-frame', type=int, default=6)
+    parser.add_argument('--min-face', type=int, default=30, help="lado de cara mínimo (px UXGA)")
+    parser.add_argument('--max-face', type=int, default=260)
+    parser.add_argument('--overlap', type=int, default=160)
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    sprites = face_sprites([d for d in args.faces.split(",") if d])
+    if not sprites:
+        raise SystemExit(f"No se encontraron caras en {args.faces}")
+    rng = np.random.default_rng(args.seed)
+    frames = [synthetic_frame(sprites, args.faces_per_frame, args.min_face, args.max_face, rng)
+              for _ in range(args.frames)]
+    total = sum(len(r) for _, r in frames)
+
+    hog = HogDetector()
+    tiled = TiledDetector(workers=args.workers, overlap=args.overlap)
+    check_small_frames(tiled, hog, sprites, rng)
+    tile_rects = tiled.tiles((H, W))
+    grid = f"{len({r[1] for r in tile_rects})}x{len({r[0] for r in tile_rects})}"
+    variants = [
+        ("full", hog.detect, 1.0),
+        ("half", lambda img: hog.detect(cv2.resize(img, (0, 0), fx=0.5, fy=0.5)), 0.5),
+        # mismos mosaicos en un solo hilo: separa el costo del solape del paralelismo
+        ("tiled x1", TiledDetector(workers=1, overlap=args.overlap, grid=grid).detect, 1.0),
+        (f"tiled x{args.workers}", tiled.detect, 1.0),
+    ]
+    print(f"{args.frames} frames {W}x{H}, {total} caras de {args.min_face}-{args.max_face} px, "
+          f"grilla {grid} solape {args.overlap}, {os.cpu_count()} CPUs")
+    print(f"{'modo':<12} {'ms/frame':>9} {'speedup':>8} {'recall':>7} {'= full':>7}")
+    ref_boxes, ref_ms = None, None
+    for name, fn, scale in variants:
+        fn(frames[0][0])    # calentamiento
+        outs, t0 = [], time.perf_counter()
+        for rgb, _ in frames:
+            outs.append(fn(rgb))
+        ms = 1000 * (time.perf_counter() - t0) / len(frames)
+        hits = sum(found_faces(o, rects, scale) for o, (_, rects) in zip(outs, frames))
+        if ref_boxes is None:
+            ref_boxes, ref_ms = outs, ms
+        agree = (np.mean([agreement(o, r) for o, r in zip(outs, ref_boxes)]) if scale == 1.0 else float("nan"))
+        print(f"{name:<12} {ms:>9.1f} {ref_ms / ms:>8.2f} {hits / total:>7.3f} {agree:>7.3f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,185 @@
+# burst_register.py - Registro por ráfaga: captura N frames, puntúa en paralelo y elige
+"""
+En vez de aceptar el primer frame con cara (muestras borrosas o casi
+idénticas, y reintentos secuenciales), se toma una ráfaga corta del stream
+y cada frame se puntúa en paralelo por:
+
+- tamaño: lado de la caja en px del frame completo (más grande = mejor)
+- nitidez: varianza del Laplaciano del recorte de la cara a 128x128
+- pose: qué tan frontal está, con los 5 landmarks (nariz respecto al
+  centro de los ojos y ángulo de la línea de ojos)
+
+Los procesos son un pool persistente creado en la primera ráfaga: el
+arranque y la carga de los modelos de dlib se pagan una sola vez (con hilos
+no alcanza: los modelos globales de face_recognition no son seguros entre
+hilos). La calidad es el producto de los tres (0..1). Luego se eligen las N mejores
+con diversidad: se descartan candidatos a menos de `min_distance` (distancia
+de embeddings) de uno ya elegido, para no guardar la misma foto N veces.
+
+Uso desde scripts:
+    frames = grab_burst(cap, 12)
+    cands = score_frames(frames)
+    chosen = select_diverse(cands, 3)     # [{index, encoding, quality, ...}]
+"""
+import os
+import time
+import atexit
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import cv2
+import numpy as np
+import face_recognition
+from detectors import make_detector
+from encoders import make_encoder
+
+BURST_FRAMES = 12
+BURST_INTERVAL = 0.08     # segundos mínimos entre frames de la ráfaga
+DOWNSCALE_DETECT = 0.7
+GOOD_FACE_PX = 120        # cara de este tamaño (o más) puntúa 1.0
+GOOD_SHARPNESS = 120.0    # varianza del Laplaciano que puntúa 1.0
+MIN_QUALITY = 0.15
+MIN_DISTANCE = 0.06       # embeddings más cercanos que esto se consideran duplicados
+DETECTOR_SPEC = os.getenv("DETECTOR", "hog")
+ENCODER_SPEC = os.getenv("ENCODER_REGISTER", "large")
+
+_detectors = {}           # uno por especificación y proceso
+_encoders = {}
+_pool = None              # pool de procesos reutilizado entre ráfagas
+_pool_workers = 0
+_pool_lock = threading.Lock()
+
+
+def grab_burst(cap, count=BURST_FRAMES, interval=BURST_INTERVAL, timeout=5.0):
+    """Lee `count` frames nuevos separados al menos `interval` segundos."""
+    frames = []
+    last = 0.0
+    deadline = time.time() + timeout + count * interval
+    while len(frames) < count and time.time() < deadline:
+        ok, frame = cap.read()
+        if not ok:
+            continue
+        now = time.time()
+        if now - last < interval:
+            continue
+        last = now
+        frames.append(frame)
+    return frames
+
+
+def _sharpness(frame_bgr, box):
+    t, r, b, l = box
+    crop = frame_bgr[max(t, 0):b, max(l, 0):r]
+    if crop.size == 0:
+        return 0.0
+    gray = cv2.cvtColor(cv2.resize(crop, (128, 128), interpolation=cv2.INTER_AREA), cv2.COLOR_BGR2GRAY)
+    return float(cv2.Laplacian(gray, cv2.CV_64F).var())
+
+
+def _pose(landmarks):
+    """(yaw, roll): nariz desplazada respecto a los ojos (0 = frontal) y ángulo de ojos en grados."""
+    left = np.mean(landmarks["left_eye"], axis=0)
+    right = np.mean(landmarks["right_eye"], axis=0)
+    nose = np.asarray(landmarks["nose_tip"][0], dtype=float)
+    eye_dist = np.linalg.norm(right - left) or 1.0
+    mid = (left + right) / 2
+    yaw = abs(nose[0] - mid[0]) / eye_dist
+    roll = abs(np.degrees(np.arctan2(right[1] - left[1], right[0] - left[0])))
+    roll = min(roll, 180 - roll)
+    return float(yaw), float(roll)
+
+
+def score_frame(frame_bgr, downscale=DOWNSCALE_DETECT, detector_spec=DETECTOR_SPEC, encoder_spec=ENCODER_SPEC):
+    """Puntúa la cara más grande de un frame; None si no hay cara."""
+    if detector_spec not in _detectors:
+        _detectors[detector_spec] = make_detector(detector_spec)
+    if encoder_spec not in _encoders:
+        _encoders[encoder_spec] = make_encoder(encoder_spec)
+    small = cv2.resize(frame_bgr, (0, 0), fx=downscale, fy=downscale)
+    rgb_small = cv2.cvtColor(small, cv2.COLOR_BGR2RGB)
+    boxes = _detectors[detector_spec].detect(rgb_small)
+    if not boxes:
+        return None
+    box = max(boxes, key=lambda b: (b[2] - b[0]) * (b[1] - b[3]))
+    encs = _encoders[encoder_spec].encode(rgb_small, [box])
+    if not encs:
+        return None
+    marks = face_recognition.face_landmarks(rgb_small, [box], model="small")
+    box_full = tuple(int(v / downscale) for v in box)
+    t, r, b, l = box_full
+    face_px = max(b - t, r - l)
+    sharpness = _sharpness(frame_bgr, box_full)
+    yaw, roll = _pose(marks[0]) if marks else (0.5, 45.0)
+
+    size_score = min(1.0, face_px / GOOD_FACE_PX)
+    sharp_score = min(1.0, sharpness / GOOD_SHARPNESS)
+    pose_score = max(0.0, 1.0 - 2.0 * yaw) * max(0.0, 1.0 - roll / 30.0)
+    return {
+        "box": box_full,
+        "encoding": encs[0],
+        "face_px": face_px,
+        "sharpness": round(sharpness, 1),
+        "yaw": round(yaw, 3),
+        "roll": round(roll, 1),
+        "faces": len(boxes),
+        "quality": round(size_score * sharp_score * pose_score, 4),
+    }
+
+
+def _get_pool(workers):
+    """Pool persistente de `workers` procesos (se crea en el primer uso)."""
+    global _pool, _pool_workers
+    with _pool_lock:
+        if _pool is None or _pool_workers != workers:
+            if _pool is not None:
+                _pool.shutdown(wait=False)
+            _pool = ProcessPoolExecutor(max_workers=workers)
+            _pool_workers = workers
+        return _pool
+
+
+def shutdown_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=False, cancel_futures=True)
+            _pool = None
+
+
+atexit.register(shutdown_pool)
+
+
+def score_frames(frames, workers=None, downscale=DOWNSCALE_DETECT, detector_spec=DETECTOR_SPEC,
+                 encoder_spec=ENCODER_SPEC):
+    """Puntúa todos los frames (en procesos si hay más de un CPU); lista de candidatos con `index`."""
+    workers = workers or os.cpu_count() or 1
+    scores = None
+    if workers > 1 and len(frames) > 1:
+        n = len(frames)
+        try:
+            scores = list(_get_pool(workers).map(score_frame, frames, [downscale] * n,
+                                                 [detector_spec] * n, [encoder_spec] * n))
+        except BrokenProcessPool as e:
+            # un proceso murió: se descarta el pool (el próximo uso crea otro) y se puntúa aquí
+            print(f"⚠️ Pool de puntuación caído ({e}), puntuando en este proceso")
+            shutdown_pool()
+    if scores is None:
+        scores = [score_frame(f, downscale, detector_spec, encoder_spec) for f in frames]
+    cands = []
+    for i, s in enumerate(scores):
+        if s is not None:
+            s["index"] = i
+            cands.append(s)
+    return cands
+
+
+def select_diverse(cands, n, min_quality=MIN_QUALITY, min_distance=MIN_DISTANCE):
+    """Las `n` mejores por calidad, sin casi-duplicados (distancia de embeddings)."""
+    pool = sorted((c for c in cands if c["quality"] >= min_quality), key=lambda c: -c["quality"])
+    chosen = []
+    for c in pool:
+        if len(chosen) >= n:
+            break
+        if all(np.linalg.norm(c["encoding"] - o["encoding"]) >= min_distance for o in chosen):
+            chosen.append(c)
+    return chosen
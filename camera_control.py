@@ -0,0 +1,266 @@
+# camera_control.py - Control del ESP32-CAM (/control) y resolución adaptativa
+"""
+CameraControl usa una sesión HTTP persistente (keep-alive) contra el
+endpoint `/control?var=...&val=...` de CameraWebServer, en vez de abrir una
+conexión nueva por cada `requests.get` (flash, framesize, quality). Sólo
+envía un valor si cambió.
+
+AdaptiveResolution decide la resolución del stream:
+
+  idle    sin movimiento ni caras: framesize/quality bajos (menos Wi-Fi y
+          menos CPU de decodificación)
+  active  hubo movimiento o se vio una cara: resolución apta para detectar
+          durante `hold_seconds` desde la última actividad
+
+El movimiento se mide con la diferencia de una miniatura en gris contra la
+anterior. Los cambios se envían en un hilo aparte para no frenar el loop.
+
+Los bytes/s y el tiempo de decodificación por modo son estimados: cada
+`sample_every` frames se recodifica el frame a JPEG con una calidad
+equivalente y se mide tamaño y tiempo de cv2.imdecode.
+"""
+import json
+import os
+import time
+import threading
+from urllib.parse import urlparse, urlunparse
+import cv2
+import requests
+from requests.adapters import HTTPAdapter
+
+# Valores de framesize de esp32-camera (sensor.h reciente). Firmwares viejos
+# usan otra numeración: en la política se puede poner el número directamente.
+FRAMESIZES = {
+    "96X96": (0, 96, 96), "QQVGA": (1, 160, 120), "QCIF": (2, 176, 144),
+    "HQVGA": (3, 240, 176), "240X240": (4, 240, 240), "QVGA": (5, 320, 240),
+    "CIF": (6, 400, 296), "HVGA": (7, 480, 320), "VGA": (8, 640, 480),
+    "SVGA": (9, 800, 600), "XGA": (10, 1024, 768), "HD": (11, 1280, 720),
+    "SXGA": (12, 1280, 1024), "UXGA": (13, 1600, 1200),
+}
+
+DEFAULT_POLICY = {
+    "idle": {"framesize": "QVGA", "quality": 15},
+    "active": {"framesize": "VGA", "quality": 10},
+    "hold_seconds": 8.0,         # tiempo en activo tras la última actividad
+    "min_switch_seconds": 2.0,   # evita oscilar entre modos
+    "motion_threshold": 6.0,     # diferencia media (0-255) de la miniatura
+    "sample_every": 30,
+    "control_url": None,         # None = derivada de la URL del stream
+}
+
+
+def control_url_from_stream(stream_url):
+    """http://cam:81/stream -> http://cam/control (servidor web en el puerto 80)."""
+    pr = urlparse(stream_url)
+    host = pr.hostname or ""
+    if pr.port and pr.port != 81:
+        host = f"{host}:{pr.port}"
+    return urlunparse((pr.scheme or "http", host, "/control", "", "", ""))
+
+
+def framesize_value(framesize):
+    """Nombre ('VGA') o número de framesize -> número para /control."""
+    if isinstance(framesize, int):
+        return framesize
+    return FRAMESIZES[str(framesize).upper()][0]
+
+
+def esp_to_cv_quality(q):
+    """Calidad del ESP32 (0-63, menor = mejor) -> calidad de cv2 (aproximada)."""
+    return max(5, min(95, int(100 - 1.5 * q)))
+
+
+def load_policy(spec=None, camera_id="default"):
+    """
+    Política de la cámara `camera_id`. `spec` es JSON (o ruta a un .json) con
+    políticas por cámara: {"default": {...}, "entrada": {...}}.
+    """
+    policy = json.loads(json.dumps(DEFAULT_POLICY))
+    if not spec:
+        return policy
+    if os.path.exists(spec):
+        with open(spec, encoding="utf-8") as f:
+            spec = f.read()
+    per_camera = json.loads(spec)
+    for key in ("default", camera_id):
+        for k, v in (per_camera.get(key) or {}).items():
+            if isinstance(v, dict) and isinstance(policy.get(k), dict):
+                policy[k].update(v)
+            else:
+                policy[k] = v
+    return policy
+
+
+class CameraControl:
+    """Cliente de /control con sesión persistente y caché de valores enviados."""
+
+    def __init__(self, control_url, timeout=0.7):
+        self.control_url = control_url
+        self.timeout = timeout
+        self.session = requests.Session()
+        self.session.mount("http://", HTTPAdapter(pool_connections=1, pool_maxsize=2))
+        self._values = {}
+        self.requests_sent = 0
+        self.failures = 0
+
+    @classmethod
+    def for_stream(cls, stream_url, **kwargs):
+        return cls(control_url_from_stream(stream_url), **kwargs)
+
+    def set(self, var, val, force=False):
+        """Envía var=val; True si la cámara respondió 200 (o ya tenía ese valor)."""
+        if not force and self._values.get(var) == val:
+            return True
+        try:
+            resp = self.session.get(self.control_url, params={"var": var, "val": val},
+                                    timeout=self.timeout)
+            self.requests_sent += 1
+            if resp.status_code != 200:
+                self.failures += 1
+                return False
+        except requests.RequestException:
+            self.failures += 1
+            return False
+        self._values[var] = val
+        return True
+
+    def flash(self, on=True):
+        return self.set("led_intensity", 255 if on else 0, force=True)
+
+    def set_framesize(self, framesize):
+        return self.set("framesize", framesize_value(framesize))
+
+    def set_quality(self, quality):
+        return self.set("quality", int(quality))
+
+    def close(self):
+        self.session.close()
+
+
+class AdaptiveResolution:
+    """Política idle/active de framesize y quality para una cámara."""
+
+    def __init__(self, control, policy=None):
+        self.control = control
+        self.policy = policy or load_policy()
+        self.mode = None            # modo pedido
+        self.applied = None         # modo confirmado por la cámara
+        self._busy = threading.Lock()
+        self._prev_thumb = None
+        self._prev_shape = None
+        self._last_activity = 0.0
+        self._last_switch = 0.0
+        self._frames = 0
+        self.switches = 0
+        self.switch_failures = 0
+        self.motion_triggers = 0
+        self.face_triggers = 0
+        # por modo: segundos, frames y muestra de bytes/decodificación
+        self._mode_since = None
+        self.modes = {m: {"seconds": 0.0, "frames": 0, "bytes": None, "decode_ms": None, "width": None}
+                      for m in ("idle", "active")}
+
+    # ---------- actividad ----------
+    def _motion(self, frame):
+        small = cv2.resize(frame, (64, 48), interpolation=cv2.INTER_AREA)
+        thumb = cv2.GaussianBlur(cv2.cvtColor(small, cv2.COLOR_BGR2GRAY), (5, 5), 0)
+        prev, self._prev_thumb = self._prev_thumb, thumb
+        # un cambio de resolución no es movimiento
+        shape, self._prev_shape = self._prev_shape, frame.shape
+        if prev is None or shape != frame.shape:
+            return False
+        return float(cv2.absdiff(thumb, prev).mean()) >= self.policy["motion_threshold"]
+
+    def saw_faces(self, count, now=None):
+        """El detector encontró `count` caras (mantiene el modo activo)."""
+        if count:
+            self.face_triggers += 1
+            self._last_activity = time.time() if now is None else now
+
+    def observe(self, frame, now=None):
+        """Un frame del stream; devuelve el modo pedido."""
+        now = time.time() if now is None else now
+        self._account(frame, now)
+        if self._motion(frame):
+            self.motion_triggers += 1
+            self._last_activity = now
+
+        want = "active" if now - self._last_activity < self.policy["hold_seconds"] else "idle"
+        if self.mode is None or (want != self.mode and now - self._last_switch >= self.policy["min_switch_seconds"]):
+            self.mode = want
+            self._last_switch = now
+        if self.mode != self.applied:
+            self._apply_async(self.mode)
+        return self.mode
+
+    # ---------- envío a la cámara ----------
+    def _apply_async(self, mode):
+        if not self._busy.acquire(blocking=False):
+            return          # hay un cambio en curso; se reintenta en el próximo frame
+        threading.Thread(target=self._apply, args=(mode,), daemon=True).start()
+
+    def _apply(self, mode):
+        try:
+            cfg = self.policy[mode]
+            ok = self.control.set_framesize(cfg["framesize"]) and self.control.set_quality(cfg["quality"])
+            if ok:
+                self.applied = mode
+                self.switches += 1
+                print(f"📐 Cámara en modo {mode}: {cfg['framesize']} q={cfg['quality']}")
+            else:
+                self.switch_failures += 1
+                # no insistir en cada frame contra una cámara que no responde
+                time.sleep(self.policy["min_switch_seconds"])
+        finally:
+            self._busy.release()
+
+    # ---------- métricas ----------
+    def _account(self, frame, now):
+        mode = self.applied
+        if self._mode_since is not None and mode in self.modes:
+            self.modes[mode]["seconds"] += now - self._mode_since
+        self._mode_since = now
+        if mode not in self.modes:
+            return
+        m = self.modes[mode]
+        m["frames"] += 1
+        m["width"] = frame.shape[1]
+        self._frames += 1
+        if m["bytes"] is None or self._frames % self.policy["sample_every"] == 0:
+            q = esp_to_cv_quality(self.policy[mode]["quality"])
+            ok, buf = cv2.imencode(".jpg", frame, [cv2.IMWRITE_JPEG_QUALITY, q])
+            if ok:
+                t0 = time.perf_counter()
+                cv2.imdecode(buf, cv2.IMREAD_COLOR)
+                m["bytes"] = len(buf)
+                m["decode_ms"] = 1000 * (time.perf_counter() - t0)
+
+    def stats(self):
+        out = {
+            "mode": self.applied,
+            "requested": self.mode,
+            "switches": self.switches,
+            "switch_failures": self.switch_failures,
+            "motion_triggers": self.motion_triggers,
+            "face_triggers": self.face_triggers,
+            "control_requests": self.control.requests_sent,
+            "modes": {},
+        }
+        for name, m in self.modes.items():
+            fps = m["frames"] / m["seconds"] if m["seconds"] else None
+            out["modes"][name] = {
+                "seconds": round(m["seconds"], 1),
+                "frames": m["frames"],
+                "width": m["width"],
+                "est_bytes_per_frame": m["bytes"],
+                "est_bytes_per_sec": round(m["bytes"] * fps) if m["bytes"] and fps else None,
+                "est_decode_ms": round(m["decode_ms"], 2) if m["decode_ms"] is not None else None,
+            }
+        idle, active = self.modes["idle"], self.modes["active"]
+        # ahorro: frames servidos en idle que habrían costado lo de active
+        if idle["bytes"] and active["bytes"]:
+            out["est_bytes_saved"] = max(0, (active["bytes"] - idle["bytes"]) * idle["frames"])
+            out["est_decode_ms_saved"] = round(max(0.0, (active["decode_ms"] - idle["decode_ms"]) * idle["frames"]), 1)
+            if idle["seconds"]:
+                out["est_bytes_per_sec_saved"] = round(out["est_bytes_saved"] / idle["seconds"])
+        return out
@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+"""
+Prueba local de convergencia de la galería replicada (gallery_log.py).
+
+Levanta dos nodos `app.py` en directorios temporales separados, cada uno
+con su propia galería (opcionalmente con `--seed` filas comunes), y los
+configura como pares por HTTP (`--mode http`) o por un directorio
+compartido (`--mode dir`). Después, en paralelo en ambos nodos:
+
+  - registra `--registrations` encodings aleatorios por nodo
+  - borra una identidad propia en A y una de la semilla en B
+
+y espera a que la huella de `/api/gallery` de los dos nodos sea igual a la
+esperada (calculada aquí con los mismos ids). Reporta el tiempo hasta
+converger, filas y versión del log de cada nodo.
+
+Uso:
+    python check_gallery_sync.py
+    python check_gallery_sync.py --mode dir --registrations 50 --seed 1000
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import socket
+import argparse
+import tempfile
+import subprocess
+import threading
+import numpy as np
+import requests
+
+from gallery_log import row_id, ids_digest
+
+APP = os.path.join(os.path.dirname(os.path.abspath(__file__)), "app.py")
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def wait_http(url, timeout=60):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            requests.get(url, timeout=1)
+            return True
+        except requests.RequestException:
+            time.sleep(0.3)
+    return False
+
+
+def write_gallery(directory, encs, labels):
+    np.save(os.path.join(directory, "encodings.npy"), encs)
+    with open(os.path.join(directory, "labels.json"), "w", encoding="utf-8") as f:
+        json.dump(labels, f)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--mode', choices=["http", "dir"], default="http")
+    parser.add_argument('--registrations', type=int, default=20, help="registros por nodo")
+    parser.add_argument('--seed', type=int, default=100, help="filas comunes a ambos nodos al arrancar")
+    parser.add_argument('--interval', type=float, default=0.5, help="GALLERY_SYNC_INTERVAL de los nodos")
+    parser.add_argument('--timeout', type=float, default=60)
+    parser.add_argument('--keep', action='store_true', help="no borrar los directorios temporales")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    seed_encs = rng.normal(0, 0.1, (args.seed, 128)).astype(np.float32)
+    seed_labels = [f"seed_{i % max(1, args.seed // 4)}" for i in range(args.seed)]
+
+    root = tempfile.mkdtemp(prefix="gallery_sync_")
+    shared = os.path.join(root, "shared")
+    nodes = {}
+    for name in ("A", "B"):
+        directory = os.path.join(root, name)
+        os.makedirs(directory)
+        if args.seed:
+            write_gallery(directory, seed_encs, seed_labels)
+        nodes[name] = {"dir": directory, "port": free_port()}
+    procs = []
+    try:
+        for name, other in (("A", "B"), ("B", "A")):
+            env = dict(os.environ, FLASK_PORT=str(nodes[name]["port"]), GALLERY_NODE_ID=f"node{name}",
+                       GALLERY_SYNC_INTERVAL=str(args.interval), ENGINE_MODE="inline")
+            if args.mode == "http":
+                env["GALLERY_PEERS"] = f"http://127.0.0.1:{nodes[other]['port']}"
+            else:
+                env["GALLERY_SHARED_DIR"] = shared
+            log = open(os.path.join(nodes[name]["dir"], "app.log"), "w")
+            procs.append(subprocess.Popen([sys.executable, APP], cwd=nodes[name]["dir"], env=env,
+                                          stdout=log, stderr=subprocess.STDOUT))
+            nodes[name]["url"] = f"http://127.0.0.1:{nodes[name]['port']}"
+        for name, node in nodes.items():
+            if not wait_http(node["url"] + "/api/gallery"):
+                raise SystemExit(f"El nodo {name} no levantó (ver {node['dir']}/app.log)")
+
+        # lo que cada nodo registra y borra, y el conjunto de ids esperado al final
+        expected = {row_id(n, e) for n, e in zip(seed_labels, seed_encs)}
+        plan = {}
+        for name in nodes:
+            encs = rng.normal(0, 0.1, (args.registrations, 128)).astype(np.float32)
+            regs = [(f"{name.lower()}_{i}", encs[i]) for i in range(args.registrations)]
+            expected |= {row_id(n, e) for n, e in regs}
+            plan[name] = regs
+        delete = {"A": "a_0" if args.registrations else None, "B": "seed_1" if args.seed > 4 else None}
+        for name, person in delete.items():
+            if person is not None:
+                gone = [n for n, _ in plan[name] if n == person] or [n for n in seed_labels if n == person]
+                expected -= {row_id(n, e) for n, e in plan[name] + list(zip(seed_labels, seed_encs))
+                             if n == person}
+                assert gone
+
+        def drive(name):
+            url = nodes[name]["url"]
+            for person, enc in plan[name]:
+                r = requests.post(url + "/api/register", json={"name": person, "encoding": enc.tolist()},
+                                  timeout=30)
+                r.raise_for_status()
+            if delete[name] is not None:
+                requests.delete(f"{url}/api/gallery/{delete[name]}", timeout=30).raise_for_status()
+
+        t0 = time.time()
+        threads = [threading.Thread(target=drive, args=(name,)) for name in nodes]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        writes = time.time() - t0
+        target = ids_digest(expected)
+
+        print(f"modo {args.mode}: {args.seed} filas semilla, {args.registrations} registros y 1 borrado por nodo "
+              f"({writes:.1f}s), esperadas {len(expected)} filas, huella {target}")
+        while time.time() - t0 < args.timeout:
+            info = {name: requests.get(node["url"] + "/api/gallery", timeout=5).json()
+                    for name, node in nodes.items()}
+            if all(i["digest"] == target for i in info.values()):
+                print(f"✅ Convergieron en {time.time() - t0:.2f}s desde el primer registro")
+                for name, i in info.items():
+                    sync = i.get("sync") or {}
+                    print(f"   nodo {name}: {i['rows']} filas, versión del log {i['version']}, "
+                          f"aplicados de pares {sync.get('applied')}")
+                return
+            time.sleep(0.2)
+        print("❌ No convergieron:")
+        for name, i in info.items():
+            print(f"   nodo {name}: {i['rows']} filas, huella {i['digest']}, versión {i['version']}")
+        sys.exit(1)
+    finally:
+        for p in procs:
+            p.terminate()
+        for p in procs:
+            p.wait(timeout=10)
+        if args.keep:
+            print(f"📁 {root}")
+        else:
+            shutil.rmtree(root, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
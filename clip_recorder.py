@@ -0,0 +1,241 @@
+# clip_recorder.py - Clips de N segundos antes y después de un evento
+"""
+Un hilo por cámara guarda en un buffer circular los JPEG de los últimos
+`pre_seconds`, acotado también en bytes (`max_bytes`): si la cámara manda
+frames grandes se pierde historia antes que memoria.
+
+- Con el lector MJPEG de stream_manager los bytes son los que mandó la
+  cámara (sin decodificar ni recodificar). Con FFmpeg no hay acceso al
+  JPEG original y el frame se codifica en este hilo, nunca en el del
+  reconocimiento.
+- trigger() sólo toma una lista de referencias del buffer: no bloquea el
+  loop. El clip sigue juntando frames `post_seconds` y se escribe a disco
+  en un hilo aparte.
+- Un evento durante el post de otro clip lo extiende en vez de abrir un
+  clip nuevo, si el clip extendido no pasa de max_clip_seconds; si no,
+  (o si el clip ya venció y espera al hilo) se abre uno nuevo.
+
+Formatos:
+  mjpeg   <clip>.mjpeg (JPEGs concatenados; `ffplay -f mjpeg <clip>.mjpeg`)
+          + <clip>.json con timestamp, offset y tamaño de cada frame
+  jpeg    carpeta <clip>/ con 000001.jpg... + index.json
+"""
+import os
+import json
+import time
+import threading
+from collections import deque
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+import cv2
+
+from stream_manager import open_stream
+
+FORMATS = ("mjpeg", "jpeg")
+
+
+class JpegRing:
+    """(timestamp, jpeg) de los últimos `seconds`, sin pasar de `max_bytes`."""
+
+    def __init__(self, seconds, max_bytes):
+        self.seconds = seconds
+        self.max_bytes = max_bytes
+        self.items = deque()
+        self.bytes = 0
+        self.evicted_for_memory = 0
+
+    def push(self, ts, jpeg):
+        self.items.append((ts, jpeg))
+        self.bytes += len(jpeg)
+        while self.items and (ts - self.items[0][0] > self.seconds or self.bytes > self.max_bytes):
+            if ts - self.items[0][0] <= self.seconds:
+                self.evicted_for_memory += 1
+            _, old = self.items.popleft()
+            self.bytes -= len(old)
+
+    def since(self, ts):
+        return [item for item in self.items if item[0] >= ts]
+
+    def span(self):
+        return self.items[-1][0] - self.items[0][0] if len(self.items) > 1 else 0.0
+
+
+class Clip:
+    def __init__(self, path, label, trigger_time, end, frames):
+        self.path = path
+        self.labels = [label]
+        self.trigger_time = trigger_time
+        self.end = end
+        self.frames = frames
+        self.bytes = sum(len(j) for _, j in frames)
+        self.truncated = False
+
+
+class ClipRecorder:
+    """Buffer circular de JPEG de una cámara y clips por evento."""
+
+    def __init__(self, url, out_dir, pre_seconds=5.0, post_seconds=5.0, max_bytes=32 * 1024 * 1024,
+                 fmt="mjpeg", quality=80, max_clip_seconds=60.0):
+        if fmt not in FORMATS:
+            raise ValueError(f"Formato de clip desconocido: {fmt} (opciones: {', '.join(FORMATS)})")
+        self.url = url
+        self.out_dir = out_dir
+        self.pre_seconds = pre_seconds
+        self.post_seconds = post_seconds
+        self.max_bytes = max_bytes
+        self.fmt = fmt
+        self.quality = quality
+        self.max_clip_seconds = max_clip_seconds
+        self.ring = JpegRing(pre_seconds, max_bytes)
+        self._lock = threading.Lock()
+        self._pending = []
+        self._writer = ThreadPoolExecutor(max_workers=1)
+        self._stop = threading.Event()
+        self._thread = None
+        self.passthrough = 0
+        self.reencoded = 0
+        self.triggers = 0
+        self.merged = 0
+        self.clips_written = 0
+        self.bytes_written = 0
+        self.last_clip = None
+        os.makedirs(out_dir, exist_ok=True)
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=None):
+        """Detiene la captura; los clips en curso se escriben con lo que tengan."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    # ---- captura (hilo propio) ----
+
+    def _run(self):
+        cap = open_stream(self.url)
+        try:
+            while not self._stop.is_set():
+                ok, frame, jpeg, ts = cap.read_packet(timeout=1.0)
+                if ok:
+                    if jpeg is None:
+                        ok, buf = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, self.quality])
+                        jpeg = buf.tobytes() if ok else None
+                        self.reencoded += 1
+                    else:
+                        self.passthrough += 1
+                if jpeg is not None:
+                    with self._lock:
+                        self.ring.push(ts, jpeg)
+                        for clip in self._pending:
+                            if ts > clip.end:
+                                continue
+                            if clip.bytes + len(jpeg) > self.max_bytes:
+                                clip.truncated = True
+                                continue
+                            clip.frames.append((ts, jpeg))
+                            clip.bytes += len(jpeg)
+                # también sin frames (cámara caída): cerrar los clips vencidos
+                self._finish(time.time())
+        finally:
+            cap.release()
+            self._finish(None)
+            self._writer.shutdown(wait=True)
+
+    def _finish(self, now):
+        """Manda a escribir los clips cuyo post terminó (todos si `now` es None)."""
+        with self._lock:
+            done = [c for c in self._pending if now is None or now > c.end]
+            self._pending = [c for c in self._pending if c not in done]
+        for clip in done:
+            self._writer.submit(self._write, clip)
+
+    # ---- eventos ----
+
+    def trigger(self, label, now=None):
+        """Marca un evento; devuelve la ruta del clip (el archivo aparece al terminar el post)."""
+        now = time.time() if now is None else now
+        with self._lock:
+            self.triggers += 1
+            for clip in self._pending:
+                # evento durante el post de otro clip: extenderlo si el post completo todavía entra
+                if now > clip.end or now + self.post_seconds > clip.trigger_time + self.max_clip_seconds:
+                    continue
+                clip.end = max(clip.end, now + self.post_seconds)
+                if label not in clip.labels:
+                    clip.labels.append(label)
+                self.merged += 1
+                return self._clip_path(clip.path)
+            stamp = datetime.fromtimestamp(now).strftime('%Y%m%d_%H%M%S')
+            base = os.path.join(self.out_dir, f"{stamp}_{label}")
+            n = 1
+            while any(c.path == base for c in self._pending):
+                n += 1
+                base = os.path.join(self.out_dir, f"{stamp}_{label}_{n}")
+            clip = Clip(base, label, now, now + self.post_seconds, self.ring.since(now - self.pre_seconds))
+            self._pending.append(clip)
+            return self._clip_path(base)
+
+    def _clip_path(self, base):
+        return base + ".mjpeg" if self.fmt == "mjpeg" else base
+
+    def _write(self, clip):
+        index = {
+            "camera_url": self.url,
+            "labels": clip.labels,
+            "trigger_time": datetime.fromtimestamp(clip.trigger_time).isoformat(),
+            "pre_seconds": self.pre_seconds,
+            "post_seconds": self.post_seconds,
+            "truncated": clip.truncated,
+            "format": self.fmt,
+            "frames": []
+        }
+        try:
+            if self.fmt == "mjpeg":
+                offset = 0
+                with open(clip.path + ".mjpeg.tmp", "wb") as f:
+                    for ts, jpeg in clip.frames:
+                        f.write(jpeg)
+                        index["frames"].append({"t": round(ts - clip.trigger_time, 3),
+                                                "offset": offset, "size": len(jpeg)})
+                        offset += len(jpeg)
+                os.replace(clip.path + ".mjpeg.tmp", clip.path + ".mjpeg")
+                index_path = clip.path + ".json"
+            else:
+                os.makedirs(clip.path, exist_ok=True)
+                for i, (ts, jpeg) in enumerate(clip.frames, 1):
+                    name = f"{i:06d}.jpg"
+                    with open(os.path.join(clip.path, name), "wb") as f:
+                        f.write(jpeg)
+                    index["frames"].append({"t": round(ts - clip.trigger_time, 3), "file": name,
+                                            "size": len(jpeg)})
+                index_path = os.path.join(clip.path, "index.json")
+            with open(index_path, "w", encoding="utf-8") as f:
+                json.dump(index, f, ensure_ascii=False, indent=2)
+        except OSError as e:
+            print(f"❌ Error guardando clip {clip.path}: {e}")
+            return
+        self.clips_written += 1
+        self.bytes_written += clip.bytes
+        self.last_clip = self._clip_path(clip.path)
+        print(f"🎞️ Clip guardado: {self.last_clip} ({len(clip.frames)} frames, {clip.bytes / 1e6:.1f} MB)")
+
+    def stats(self):
+        with self._lock:
+            return {
+                "format": self.fmt,
+                "buffer_frames": len(self.ring.items),
+                "buffer_mb": round(self.ring.bytes / 1e6, 2),
+                "buffer_seconds": round(self.ring.span(), 1),
+                "max_buffer_mb": round(self.max_bytes / 1e6, 1),
+                "evicted_for_memory": self.ring.evicted_for_memory,
+                "passthrough_frames": self.passthrough,
+                "reencoded_frames": self.reencoded,
+                "triggers": self.triggers,
+                "merged_triggers": self.merged,
+                "pending_clips": len(self._pending),
+                "clips_written": self.clips_written,
+                "mb_written": round(self.bytes_written / 1e6, 1),
+                "last_clip": self.last_clip
+            }
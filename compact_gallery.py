@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+"""
+Compacta la galería (encodings.npy / labels.json) eliminando muestras
+redundantes por identidad.
+
+Por cada persona:
+  1) elimina duplicados exactos (re-registros que copian el mismo set)
+  2) elige un subconjunto diverso con farthest-point sampling: se parte de
+     la muestra más central y se agrega siempre la más lejana a las ya
+     elegidas, hasta --max-per-id muestras o hasta que la más lejana esté a
+     menos de --min-dist (el resto no aporta información nueva)
+
+Antes de escribir verifica con leave-one-out que cada muestra original se
+sigue reconociendo igual contra la galería compactada. Si alguna cambia, se
+reincorpora la muestra que la reconocía en la galería original y se repite
+hasta que no haya cambios (puede superar --max-per-id en esas personas).
+
+Uso:
+  python compact_gallery.py                 # sólo reporta (dry-run)
+  python compact_gallery.py --write         # reemplaza los archivos (deja .bak)
+"""
+import json
+import shutil
+import argparse
+import numpy as np
+from pathlib import Path
+from contextlib import nullcontext
+from gallery_files import ENCODINGS_NPY, LABELS_JSON, save_gallery, gallery_file_lock, open_gallery_node
+from gallery_log import row_ids, delete_change
+
+THRESHOLD = 0.6
+UNKNOWN = "Desconocido"
+
+MAX_PER_ID = 5
+MIN_DIST = 0.08
+BLOCK_ROWS = 1024
+
+
+def load_gallery():
+    if not Path(ENCODINGS_NPY).exists() or not Path(LABELS_JSON).exists():
+        raise SystemExit("No encuentro encodings.npy o labels.json.")
+    encs = np.load(ENCODINGS_NPY).astype(np.float32)
+    if encs.ndim == 1:
+        encs = encs.reshape(1, -1)
+    labels = json.loads(Path(LABELS_JSON).read_text(encoding="utf-8"))
+    if len(encs) != len(labels):
+        raise SystemExit("Inconsistencia: encodings.npy y labels.json tienen diferente tamaño.")
+    return encs, labels
+
+
+def farthest_point_sample(rows, max_keep, min_dist):
+    """Índices (relativos a `rows`) de un subconjunto diverso."""
+    if len(rows) <= 1:
+        return list(range(len(rows)))
+    center = rows.mean(axis=0)
+    first = int(np.argmin(np.linalg.norm(rows - center, axis=1)))
+    keep = [first]
+    nearest = np.linalg.norm(rows - rows[first], axis=1)
+    while len(keep) < max_keep:
+        far = int(np.argmax(nearest))
+        if nearest[far] < min_dist:
+            break
+        keep.append(far)
+        nearest = np.minimum(nearest, np.linalg.norm(rows - rows[far], axis=1))
+    return sorted(keep)
+
+
+def compact(encs, labels, max_keep=MAX_PER_ID, min_dist=MIN_DIST):
+    """Devuelve los índices de filas a conservar (en orden original) y stats."""
+    labels_arr = np.asarray(labels, dtype=object)
+    keep_rows, n_dupes = [], 0
+    for name in dict.fromkeys(labels):     # conserva el orden de aparición
+        idx = np.nonzero(labels_arr == name)[0]
+        # duplicados exactos: misma fila byte a byte
+        _, first = np.unique(encs[idx], axis=0, return_index=True)
+        uniq = idx[np.sort(first)]
+        n_dupes += len(idx) - len(uniq)
+        sel = farthest_point_sample(encs[uniq], max_keep, min_dist)
+        keep_rows.extend(uniq[sel].tolist())
+    keep_rows = np.array(sorted(keep_rows), dtype=np.int64)
+    return keep_rows, {"duplicates": n_dupes}
+
+
+def loo_names(queries, query_rows, gallery, gallery_rows, labels, thr):
+    """
+    Nombre reconocido para cada consulta excluyendo su propia fila de la
+    galería (leave-one-out), y la fila vecina que lo decidió.
+    `*_rows` son índices en la galería original.
+    """
+    g_sq = (gallery * gallery).sum(1)
+    pos = {int(r): j for j, r in enumerate(gallery_rows)}
+    names, nearest = [], []
+    for s in range(0, len(queries), BLOCK_ROWS):
+        q = queries[s:s + BLOCK_ROWS]
+        d = (q * q).sum(1)[:, None] - 2.0 * (q @ gallery.T) + g_sq[None, :]
+        for i, r in enumerate(query_rows[s:s + BLOCK_ROWS]):
+            j = pos.get(int(r))
+            if j is not None:
+                d[i, j] = np.inf
+        best = d.argmin(axis=1)
+        dist = np.sqrt(np.maximum(d[np.arange(len(q)), best], 0))
+        for b, dd in zip(best, dist):
+            names.append(labels[gallery_rows[b]] if dd <= thr and np.isfinite(dd) else UNKNOWN)
+            nearest.append(int(gallery_rows[b]))
+    return names, nearest
+
+
+def repair(encs, labels, keep, thr):
+    """Reincorpora filas hasta que leave-one-out coincida con la galería original."""
+    all_rows = np.arange(len(encs))
+    ref, ref_nn = loo_names(encs, all_rows, encs, all_rows, labels, thr)
+    keep = set(keep.tolist())
+    added = 0
+    while True:
+        rows = np.array(sorted(keep), dtype=np.int64)
+        new, _ = loo_names(encs, all_rows, encs[rows], rows, labels, thr)
+        changed = [i for i in all_rows if new[i] != ref[i]]
+        missing = {ref_nn[i] for i in changed} - keep
+        if not missing:
+            # con la galería completa el resultado es idéntico, así que
+            # sólo se llega aquí sin cambios (o sin nada más que agregar)
+            return rows, changed, added
+        keep |= missing
+        added += len(missing)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--max-per-id', type=int, default=MAX_PER_ID)
+    parser.add_argument('--min-dist', type=float, default=MIN_DIST)
+    parser.add_argument('--threshold', type=float, default=THRESHOLD)
+    parser.add_argument('--write', action='store_true', help="reemplazar los archivos")
+    parser.add_argument('--force', action='store_true', help="escribir aunque cambie algún match")
+    args = parser.parse_args()
+    # con --write, nadie más escribe la galería entre la lectura y el reemplazo
+    with gallery_file_lock() if args.write else nullcontext():
+        run(args)
+
+
+def run(args):
+    encs, labels = load_gallery()
+    keep, stats = compact(encs, labels, args.max_per_id, args.min_dist)
+    keep, changed, added = repair(encs, labels, keep, args.threshold)
+
+    n_before, n_after = len(encs), len(keep)
+    print(f"Identidades: {len(set(labels))}")
+    print(f"Filas: {n_before} -> {n_after} ({100 * (1 - n_after / max(n_before, 1)):.1f}% menos, "
+          f"{(n_before - n_after) * encs.shape[1] * 4 / 1024:.1f} KB)")
+    print(f"Duplicados exactos eliminados: {stats['duplicates']}")
+    for name in dict.fromkeys(labels):
+        before = labels.count(name)
+        after = sum(1 for r in keep if labels[r] == name)
+        if before != after:
+            print(f"   {name}: {before} -> {after}")
+
+    if added:
+        print(f"Filas reincorporadas para conservar los matches: {added}")
+    if changed:
+        print(f"⚠️ {len(changed)} resultados leave-one-out cambian:")
+        for i in changed[:20]:
+            print(f"   fila {i} ({labels[i]})")
+    else:
+        print("✅ Leave-one-out sin cambios")
+
+    if not args.write:
+        print("(dry-run: usa --write para aplicar)")
+        return
+    if changed and not args.force:
+        raise SystemExit("No se escribió nada: hay cambios de match (usa --force para ignorar)")
+
+    shutil.copy2(ENCODINGS_NPY, ENCODINGS_NPY + ".bak")
+    shutil.copy2(LABELS_JSON, LABELS_JSON + ".bak")
+    save_gallery(encs[keep], [labels[r] for r in keep])
+    # los pares borran las mismas filas (un duplicado exacto comparte id con la fila conservada)
+    state, log = open_gallery_node()
+    ids = row_ids(encs, labels)
+    kept = {ids[r] for r in keep}
+    removed = {ids[r]: labels[r] for r in range(len(ids)) if ids[r] not in kept}
+    log.append([delete_change(rid, name, state["node"]) for rid, name in removed.items()])
+    print(f"✅ Galería compactada guardada ({n_after} filas). Respaldo en *.bak")
+
+
+if __name__ == '__main__':
+    main()
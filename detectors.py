@@ -0,0 +1,310 @@
+# detectors.py - Backends de detección de caras intercambiables
+"""
+Todos los detectores reciben una imagen RGB y devuelven cajas en el formato
+de face_recognition: [(top, right, bottom, left), ...], así el resto del
+código (encodings, escalado de cajas, overlay) no cambia.
+
+Backends (se eligen con una especificación de texto, ver make_detector):
+
+  hog                  dlib HOG de face_recognition (el de siempre)
+  cnn                  dlib CNN (mmod); mucho más lento sin GPU
+  haar                 cascada Haar incluida en OpenCV; muy barata, pierde
+                       caras de perfil
+  dnn:path=<modelo>    detector OpenCV-DNN en CPU desde un archivo local:
+                       SSD (res10 .caffemodel + prototxt, o .onnx/.pb con
+                       salida [1,1,N,7]) o YuNet (.onnx con "yunet" en el
+                       nombre, o kind=yunet)
+  haar+hog             Haar como pre-filtro: HOG sólo corre en recortes
+                       alrededor de lo que encontró Haar (o nada si Haar
+                       no ve caras)
+  tiled                HOG a resolución completa en mosaicos solapados,
+                       uno por hilo (dlib suelta el GIL) + una pasada
+                       gruesa para caras más grandes que el solape; para
+                       frames UXGA sin reducir
+
+Ejemplos: "hog:upsample=0", "haar:min_neighbors=4", "tiled:workers=4,overlap=160",
+"dnn:path=models/face_detection_yunet_2023mar.onnx,conf=0.7".
+"""
+import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import cv2
+import numpy as np
+import dlib
+import face_recognition
+
+DEFAULT_SPEC = "hog"
+
+
+def _iou(a, b):
+    t, r, bt, l = max(a[0], b[0]), min(a[1], b[1]), min(a[2], b[2]), max(a[3], b[3])
+    inter = max(0, r - l) * max(0, bt - t)
+    area = lambda x: max(0, x[1] - x[3]) * max(0, x[2] - x[0])
+    union = area(a) + area(b) - inter
+    return inter / union if union else 0.0
+
+
+def nms(boxes, scores=None, iou_threshold=0.4):
+    """Supresión de no-máximos sobre cajas (t, r, b, l); mantiene las de mayor score (o área)."""
+    if scores is None:
+        scores = [(b[2] - b[0]) * (b[1] - b[3]) for b in boxes]
+    order = sorted(range(len(boxes)), key=lambda i: -scores[i])
+    keep = []
+    for i in order:
+        if all(_iou(boxes[i], boxes[j]) < iou_threshold for j in keep):
+            keep.append(i)
+    return [boxes[i] for i in keep]
+
+
+def _clip(box, shape):
+    t, r, b, l = box
+    h, w = shape[:2]
+    return (max(0, int(t)), min(w, int(r)), min(h, int(b)), max(0, int(l)))
+
+
+class Detector:
+    """Interfaz: detect(rgb) -> [(top, right, bottom, left)]."""
+    name = "base"
+    # lado mínimo de cara (px en la imagen recibida) que el backend detecta
+    min_face_px = 40
+
+    def detect(self, rgb):
+        raise NotImplementedError
+
+    def __call__(self, rgb):
+        return self.detect(rgb)
+
+
+class HogDetector(Detector):
+    name = "hog"
+
+    def __init__(self, upsample=1):
+        self.upsample = int(upsample)
+        self.min_face_px = 80 // (2 ** self.upsample)
+
+    def detect(self, rgb):
+        return face_recognition.face_locations(rgb, number_of_times_to_upsample=self.upsample, model="hog")
+
+
+class CnnDetector(Detector):
+    name = "cnn"
+
+    def __init__(self, upsample=1):
+        self.upsample = int(upsample)
+
+    def detect(self, rgb):
+        return face_recognition.face_locations(rgb, number_of_times_to_upsample=self.upsample, model="cnn")
+
+
+class HaarDetector(Detector):
+    name = "haar"
+
+    def __init__(self, scale_factor=1.1, min_neighbors=5, min_size=30,
+                 cascade="haarcascade_frontalface_default.xml"):
+        path = cascade if os.path.exists(cascade) else os.path.join(cv2.data.haarcascades, cascade)
+        self.cascade = cv2.CascadeClassifier(path)
+        if self.cascade.empty():
+            raise ValueError(f"No se pudo cargar la cascada Haar: {path}")
+        self.scale_factor = float(scale_factor)
+        self.min_neighbors = int(min_neighbors)
+        self.min_face_px = int(min_size)
+
+    def detect(self, rgb):
+        gray = cv2.equalizeHist(cv2.cvtColor(rgb, cv2.COLOR_RGB2GRAY))
+        found = self.cascade.detectMultiScale(gray, scaleFactor=self.scale_factor,
+                                              minNeighbors=self.min_neighbors,
+                                              minSize=(self.min_face_px, self.min_face_px))
+        return [(int(y), int(x + w), int(y + h), int(x)) for (x, y, w, h) in found]
+
+
+class DnnDetector(Detector):
+    """Detector OpenCV-DNN en CPU: SSD (salida [1,1,N,7]) o YuNet (cv2.FaceDetectorYN)."""
+    name = "dnn"
+
+    def __init__(self, path, config=None, kind=None, conf=0.6, size=300, nms_threshold=0.3):
+        if not os.path.exists(path):
+            raise ValueError(f"Modelo de detección no encontrado: {path}")
+        self.kind = kind or ("yunet" if "yunet" in os.path.basename(path).lower() else "ssd")
+        self.conf = float(conf)
+        self.size = int(size)
+        self.min_face_px = 20
+        if self.kind == "yunet":
+            self.net = cv2.FaceDetectorYN.create(path, "", (self.size, self.size), self.conf, float(nms_threshold))
+        else:
+            self.net = cv2.dnn.readNet(path, config) if config else cv2.dnn.readNet(path)
+            self.net.setPreferableBackend(cv2.dnn.DNN_BACKEND_OPENCV)
+            self.net.setPreferableTarget(cv2.dnn.DNN_TARGET_CPU)
+
+    def detect(self, rgb):
+        h, w = rgb.shape[:2]
+        bgr = cv2.cvtColor(rgb, cv2.COLOR_RGB2BGR)
+        if self.kind == "yunet":
+            self.net.setInputSize((w, h))
+            _, faces = self.net.detect(bgr)
+            if faces is None:
+                return []
+            return [_clip((y, x + fw, y + fh, x), rgb.shape) for x, y, fw, fh in faces[:, :4]]
+        blob = cv2.dnn.blobFromImage(bgr, 1.0, (self.size, self.size), (104.0, 177.0, 123.0))
+        self.net.setInput(blob)
+        out = self.net.forward().reshape(-1, 7)
+        boxes, scores = [], []
+        for det in out[out[:, 2] >= self.conf]:
+            x1, y1, x2, y2 = det[3] * w, det[4] * h, det[5] * w, det[6] * h
+            box = _clip((y1, x2, y2, x1), rgb.shape)
+            if box[1] > box[3] and box[2] > box[0]:
+                boxes.append(box)
+                scores.append(float(det[2]))
+        return nms(boxes, scores)
+
+
+class PrefilterDetector(Detector):
+    """Corre `inner` sólo en recortes alrededor de las cajas de `prefilter`."""
+
+    def __init__(self, prefilter, inner, pad=0.5):
+        self.prefilter = prefilter
+        self.inner = inner
+        self.pad = float(pad)
+        self.name = f"{prefilter.name}+{inner.name}"
+        self.min_face_px = max(prefilter.min_face_px, inner.min_face_px)
+        self.candidates = 0
+        self.calls = 0
+
+    def detect(self, rgb):
+        self.calls += 1
+        rois = self.prefilter.detect(rgb)
+        self.candidates += len(rois)
+        found = []
+        for (t, r, b, l) in rois:
+            ph, pw = int((b - t) * self.pad), int((r - l) * self.pad)
+            ct, cr, cb, cl = _clip((t - ph, r + pw, b + ph, l - pw), rgb.shape)
+            crop = np.ascontiguousarray(rgb[ct:cb, cl:cr])
+            for (t2, r2, b2, l2) in self.inner.detect(crop):
+                found.append((t2 + ct, r2 + cl, b2 + ct, l2 + cl))
+        return nms(found)
+
+
+class TiledDetector(Detector):
+    """
+    HOG en mosaicos solapados en paralelo. La grilla sale del número de
+    hilos (cols x filas >= workers) para no procesar más píxeles de los
+    necesarios. Toda cara de lado <= `overlap` cae entera en algún mosaico;
+    las más grandes las encuentra una pasada sobre el frame reducido a
+    `coarse` (una cara de overlap px queda en overlap*coarse >= min_face_px).
+    Las cajas que tocan un borde interior del mosaico son cortes de una cara
+    que está entera en el vecino y se descartan; los duplicados del solape
+    se unen con NMS.
+    """
+    name = "tiled"
+
+    def __init__(self, workers=None, overlap=160, grid=None, upsample=1, coarse=None):
+        self.upsample = int(upsample)
+        self.min_face_px = 80 // (2 ** self.upsample)
+        self.overlap = int(overlap)
+        self.workers = int(workers) if workers else (os.cpu_count() or 1)
+        self.grid = tuple(int(v) for v in grid.split("x")) if grid else None   # "3x2" = 3 columnas, 2 filas
+        # escala de la pasada gruesa: la necesaria para que una cara de `overlap` px se detecte
+        self.coarse = float(coarse) if coarse else min(1.0, 1.25 * self.min_face_px / self.overlap)
+        self._pool = ThreadPoolExecutor(max_workers=self.workers) if self.workers > 1 else None
+        # el detector HOG de dlib no es seguro entre hilos: uno por hilo
+        self._local = threading.local()
+
+    def _hog(self, rgb):
+        det = getattr(self._local, "det", None)
+        if det is None:
+            det = self._local.det = dlib.get_frontal_face_detector()
+        h, w = rgb.shape[:2]
+        return [(max(f.top(), 0), min(f.right(), w), min(f.bottom(), h), max(f.left(), 0))
+                for f in det(rgb, self.upsample)]
+
+    def tiles(self, shape):
+        """Rectángulos (y0, x0, y1, x1) que cubren la imagen con solape."""
+        h, w = shape[:2]
+        if self.grid:
+            cols, rows = self.grid
+        else:
+            cols = max(1, round(np.sqrt(self.workers * w / h)))
+            rows = max(1, -(-self.workers // cols))
+
+        def spans(n, k):
+            size = -(-(n + (k - 1) * self.overlap) // k)
+            if k == 1 or size >= n:
+                # lado más chico que un mosaico: una sola franja (sin orígenes negativos)
+                return [0], n
+            return [max(0, round(i * (n - size) / (k - 1))) for i in range(k)], size
+
+        ys, th = spans(h, rows)
+        xs, tw = spans(w, cols)
+        return [(y, x, min(y + th, h), min(x + tw, w)) for y in ys for x in xs]
+
+    def _detect_tile(self, rgb, rect):
+        y0, x0, y1, x1 = rect
+        h, w = rgb.shape[:2]
+        crop = np.ascontiguousarray(rgb[y0:y1, x0:x1])
+        out = []
+        margin = 2
+        for (t, r, b, l) in self._hog(crop):
+            # borde interior (no del frame): la cara sigue en el mosaico vecino
+            if ((t <= margin and y0 > 0) or (l <= margin and x0 > 0) or
+                    (b >= y1 - y0 - margin and y1 < h) or (r >= x1 - x0 - margin and x1 < w)):
+                continue
+            out.append((t + y0, r + x0, b + y0, l + x0))
+        return out
+
+    def _detect_coarse(self, rgb):
+        if self.coarse >= 1.0:
+            return []
+        small = cv2.resize(rgb, (0, 0), fx=self.coarse, fy=self.coarse, interpolation=cv2.INTER_AREA)
+        # sólo las caras que los mosaicos pueden haber cortado
+        return [_clip(tuple(v / self.coarse for v in box), rgb.shape) for box in self._hog(small)
+                if max(box[2] - box[0], box[1] - box[3]) / self.coarse > self.overlap * 0.8]
+
+    def detect(self, rgb):
+        rects = self.tiles(rgb.shape)
+        if len(rects) == 1:
+            return self._hog(rgb)
+        tasks = [lambda r=r: self._detect_tile(rgb, r) for r in rects] + [lambda: self._detect_coarse(rgb)]
+        if self._pool is not None:
+            results = list(self._pool.map(lambda task: task(), tasks))
+        else:
+            results = [task() for task in tasks]
+        boxes = [b for res in results for b in res]
+        return nms(boxes, iou_threshold=0.3)
+
+
+BACKENDS = {"hog": HogDetector, "cnn": CnnDetector, "haar": HaarDetector, "dnn": DnnDetector,
+            "tiled": TiledDetector}
+
+
+def _parse_one(spec):
+    name, _, args = spec.strip().partition(":")
+    kwargs = {}
+    for item in filter(None, args.split(",")):
+        k, _, v = item.partition("=")
+        kwargs[k.strip()] = v.strip()
+    if name not in BACKENDS:
+        raise ValueError(f"Detector desconocido: {name} (opciones: {', '.join(BACKENDS)})")
+    return BACKENDS[name](**kwargs)
+
+
+def make_detector(spec=DEFAULT_SPEC):
+    """Detector desde una especificación: 'hog', 'haar+hog', 'dnn:path=...,conf=0.7'."""
+    parts = (spec or DEFAULT_SPEC).split("+")
+    detector = _parse_one(parts[-1])
+    for pre in reversed(parts[:-1]):
+        detector = PrefilterDetector(_parse_one(pre), detector)
+    return detector
+
+
+def detector_spec_for(camera_id, default=None, per_camera=None):
+    """
+    Especificación para `camera_id`: entrada de `per_camera` (JSON o ruta a
+    .json con {"camara": "spec"}) o `default`.
+    """
+    default = default or DEFAULT_SPEC
+    if not per_camera:
+        return default
+    if os.path.exists(per_camera):
+        with open(per_camera, encoding="utf-8") as f:
+            per_camera = f.read()
+    return json.loads(per_camera).get(camera_id, default)
@@ -0,0 +1,159 @@
+# embedding_cache.py - Caché LRU de cajas + encodings por hash de imagen
+"""
+El flujo del kiosco manda la misma captura varias veces (reintento,
+confirmación, auditoría). Detectar (HOG) y encodear (dlib) es lo caro; el
+matching contra la galería es barato y se rehace siempre, así que un
+registro nuevo se refleja aunque la imagen venga del caché.
+
+Claves:
+- hash de los bytes recibidos (JPEG/PNG): acierto sin decodificar
+- hash de los píxeles decodificados: acierto aunque la imagen se haya
+  recodificado con los mismos píxeles
+
+Ambas incluyen los parámetros de detección (modelo, upsample), así un
+cambio de configuración no devuelve cajas de otro detector.
+
+Con `path` las entradas también se guardan en disco (un .npz por clave),
+para procesos de una sola consulta como recognize_headless.py.
+"""
+import os
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+import numpy as np
+
+
+def content_key(data, params=""):
+    """Hash de bytes (o de un array de píxeles, incluyendo su forma)."""
+    h = hashlib.blake2b(digest_size=16)
+    h.update(params.encode("utf-8"))
+    if isinstance(data, np.ndarray):
+        h.update(str(data.shape).encode("ascii"))
+        data = np.ascontiguousarray(data).data
+    h.update(data)
+    return h.hexdigest()
+
+
+class EmbeddingCache:
+    """LRU acotado: clave -> (cajas, encodings, segundos que costó calcularlos)."""
+
+    def __init__(self, max_items=128, path=None):
+        self.max_items = max_items
+        self.path = path
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.pixel_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.saved_seconds = 0.0
+        if path:
+            os.makedirs(path, exist_ok=True)
+
+    # ---------- disco ----------
+    def _file(self, key):
+        return os.path.join(self.path, f"{key}.npz")
+
+    def _load(self, key):
+        fn = self._file(key)
+        try:
+            with np.load(fn) as z:
+                entry = ([tuple(int(v) for v in b) for b in z["boxes"]], list(z["encs"]), float(z["seconds"]))
+            os.utime(fn)        # LRU en disco por mtime
+            return entry
+        except (OSError, KeyError, ValueError):
+            return None
+
+    def _store(self, key, entry):
+        boxes, encs, seconds = entry
+        tmp = self._file(key) + ".tmp.npz"
+        np.savez(tmp, boxes=np.asarray(boxes, dtype=np.int32).reshape(-1, 4),
+                 encs=np.asarray(encs, dtype=np.float64).reshape(-1, 128), seconds=seconds)
+        os.replace(tmp, self._file(key))
+        files = [os.path.join(self.path, f) for f in os.listdir(self.path) if f.endswith(".npz")]
+        if len(files) > self.max_items:
+            files.sort(key=lambda f: os.path.getmtime(f))
+            for f in files[:len(files) - self.max_items]:
+                try:
+                    os.remove(f)
+                    self.evictions += 1
+                except OSError:
+                    pass
+
+    # ---------- API ----------
+    def get(self, key):
+        with self._lock:
+            entry = self._items.get(key)
+            if entry is not None:
+                self._items.move_to_end(key)
+        if entry is None and self.path:
+            entry = self._load(key)
+            if entry is not None:
+                self._remember(key, entry)
+        return entry
+
+    def _remember(self, key, entry):
+        with self._lock:
+            self._items[key] = entry
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_items:
+                self._items.popitem(last=False)
+                if not self.path:
+                    self.evictions += 1
+
+    def put(self, key, entry):
+        self._remember(key, entry)
+        if self.path:
+            self._store(key, entry)
+
+    def lookup(self, raw, decode_fn, compute_fn, params=""):
+        """
+        (cajas, encodings, img, hit) para los bytes `raw`.
+        `decode_fn(raw)` -> imagen BGR (o None); `compute_fn(img)` -> (cajas, encodings).
+        `img` es None si hubo acierto por bytes (no hizo falta decodificar).
+        """
+        byte_key = content_key(raw, params)
+        entry = self.get(byte_key)
+        if entry is not None:
+            self._hit(entry)
+            return entry[0], entry[1], None, True
+
+        img = decode_fn(raw)
+        if img is None:
+            return None, None, None, False
+        pixel_key = content_key(img, params)
+        entry = self.get(pixel_key)
+        if entry is not None:
+            self.pixel_hits += 1
+            self._hit(entry)
+            self.put(byte_key, entry)
+            return entry[0], entry[1], img, True
+
+        with self._lock:
+            self.misses += 1
+        t0 = time.perf_counter()
+        boxes, encs = compute_fn(img)
+        entry = (list(boxes), list(encs), time.perf_counter() - t0)
+        self.put(byte_key, entry)
+        self.put(pixel_key, entry)
+        return entry[0], entry[1], img, False
+
+    def _hit(self, entry):
+        with self._lock:
+            self.hits += 1
+            self.saved_seconds += entry[2]
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "entries": len(self._items),
+                "max_items": self.max_items,
+                "hits": self.hits,
+                "pixel_hits": self.pixel_hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / total, 3) if total else None,
+                "evictions": self.evictions,
+                "saved_seconds": round(self.saved_seconds, 2),
+            }
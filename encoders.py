@@ -0,0 +1,121 @@
+# encoders.py - Perfil de encoding (modelo de landmarks + jitter) y compatibilidad de galería
+"""
+face_encodings alinea la cara con landmarks antes de la red de 128-d:
+
+  large   68 puntos (default de face_recognition; con el que se construyó
+          toda galería existente)
+  small   5 puntos: alineación más rápida, embeddings algo distintos
+
+`jitters` re-muestrea la cara N veces y promedia: más estable, N veces más
+lento. Conviene en el registro, no en el loop en vivo.
+
+Cada ruta tiene su perfil ("large", "small:jitters=1", "large:jitters=10"):
+  live       ENCODER_LIVE      loop de reconocimiento y scripts en vivo
+  register   ENCODER_REGISTER  registro (scripts y ráfaga)
+  headless   ENCODER_HEADLESS  /api/recognize y recognize_headless.py
+
+Compatibilidad: gallery_meta.json guarda el modelo de landmarks con el que
+se registró la galería (sin archivo = "large"). Comparar embeddings de
+modelos distintos sube las distancias (medirlo con eval_encoders.py), así
+que un perfil con otro modelo se rechaza salvo ENCODING_ALLOW_MIXED=1.
+El jitter no afecta la compatibilidad.
+"""
+import os
+import copy
+import json
+import face_recognition
+from gallery_files import gallery_path
+
+GALLERY_META_JSON = gallery_path("gallery_meta.json")
+DEFAULT_MODEL = "large"
+MODELS = ("large", "small")
+
+
+class FaceEncoder:
+    def __init__(self, model=DEFAULT_MODEL, jitters=1):
+        if model not in MODELS:
+            raise ValueError(f"Modelo de landmarks desconocido: {model} (opciones: {', '.join(MODELS)})")
+        self.model = model
+        self.jitters = max(1, int(jitters))
+
+    @property
+    def spec(self):
+        return f"{self.model}:jitters={self.jitters}"
+
+    def encode(self, rgb, boxes):
+        return face_recognition.face_encodings(rgb, boxes, num_jitters=self.jitters, model=self.model)
+
+    def __call__(self, rgb, boxes):
+        return self.encode(rgb, boxes)
+
+
+def make_encoder(spec=DEFAULT_MODEL):
+    """Perfil desde 'large', 'small', 'large:jitters=10'."""
+    model, _, args = (spec or DEFAULT_MODEL).strip().partition(":")
+    kwargs = {}
+    for item in filter(None, args.split(",")):
+        k, _, v = item.partition("=")
+        kwargs[k.strip()] = v.strip()
+    return FaceEncoder(model or DEFAULT_MODEL, **kwargs)
+
+
+def encoder_for(path_name):
+    """Perfil de una ruta ('live', 'register', 'headless') desde ENCODER_<RUTA>."""
+    return make_encoder(os.getenv(f"ENCODER_{path_name.upper()}", DEFAULT_MODEL))
+
+
+def allow_mixed():
+    return os.getenv("ENCODING_ALLOW_MIXED", "0") == "1"
+
+
+_meta_cache = {}          # ruta -> ((mtime_ns, tamaño), meta): check_compatible corre en cada /api/recognize
+
+
+def load_gallery_meta(path=GALLERY_META_JSON):
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        # galerías anteriores a este archivo: siempre se encodearon con "large"
+        return {"landmark_model": DEFAULT_MODEL}
+    key = (st.st_mtime_ns, st.st_size)
+    cached = _meta_cache.get(path)
+    if cached is None or cached[0] != key:
+        with open(path, "r", encoding="utf-8") as f:
+            cached = _meta_cache[path] = (key, json.load(f))
+    return copy.deepcopy(cached[1])
+
+
+def save_gallery_meta(meta, path=GALLERY_META_JSON):
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(meta, f, ensure_ascii=False, indent=2)
+    os.replace(tmp, path)
+
+
+def check_compatible(model, path=GALLERY_META_JSON, mixed=None, gallery_empty=False):
+    """
+    True si `model` coincide con la galería. Si no coincide: ValueError, o
+    aviso y False con ENCODING_ALLOW_MIXED=1. Una galería vacía acepta cualquiera.
+    """
+    if gallery_empty:
+        return True
+    gallery_model = load_gallery_meta(path).get("landmark_model", DEFAULT_MODEL)
+    if gallery_model == model:
+        return True
+    msg = (f"La galería se registró con landmarks '{gallery_model}' y este perfil usa '{model}'; "
+           f"las distancias no son comparables (ENCODING_ALLOW_MIXED=1 para permitirlo)")
+    if mixed if mixed is not None else allow_mixed():
+        print(f"⚠️ {msg}")
+        return False
+    raise ValueError(msg)
+
+
+def record_registration(model, path=GALLERY_META_JSON, gallery_empty=False):
+    """Tras registrar: anota el modelo de la galería (o 'mixed' si se permitió mezclar)."""
+    meta = {} if gallery_empty else load_gallery_meta(path)
+    current = meta.get("landmark_model")
+    if current is None:
+        meta["landmark_model"] = model
+    elif current != model:
+        meta["mixed"] = sorted(set(meta.get("mixed", [current])) | {model})
+    save_gallery_meta(meta, path)
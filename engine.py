@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+"""
+Motor de reconocimiento en su propio proceso, para servir la API con varios
+workers HTTP sin estado (ver frame_bus.py).
+
+El motor es el único que abre la cámara, corre el loop de reconocimiento y
+escribe la galería. Publica frames, resultados y estado en el frame bus y
+atiende start/stop/config/register/status por el canal de control.
+
+    python engine.py --start
+    ENGINE_MODE=worker gunicorn -w 4 -k gthread --threads 16 -b 0.0.0.0:5000 app:app
+
+Los workers arrancan su lector del bus en el primer request, así que no se
+debe usar `--preload` (los hilos no sobreviven al fork).
+"""
+import os
+import time
+import signal
+import argparse
+
+import app as facerec
+from frame_bus import FrameBus, serve_control
+
+FRAME_BUS_SLOTS = int(os.getenv('FRAME_BUS_SLOTS', 4))
+# ranura de frame dimensionada para el mayor modo de la cámara (UXGA)
+FRAME_BUS_MAX_WIDTH = int(os.getenv('FRAME_BUS_MAX_WIDTH', 1600))
+FRAME_BUS_MAX_HEIGHT = int(os.getenv('FRAME_BUS_MAX_HEIGHT', 1200))
+FRAME_BUS_MSG_SLOTS = int(os.getenv('FRAME_BUS_MSG_SLOTS', 512))
+FRAME_BUS_MSG_BYTES = int(os.getenv('FRAME_BUS_MSG_BYTES', 16384))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--start', action='store_true', help="iniciar el reconocimiento al arrancar")
+    args = parser.parse_args()
+
+    if facerec.ENGINE_MODE == 'worker':
+        raise SystemExit("engine.py es el motor: no usar ENGINE_MODE=worker aquí")
+    stream_url = os.getenv('STREAM_URL')
+    if stream_url:
+        facerec.stream_url = stream_url
+
+    bus = FrameBus.create(facerec.FRAME_BUS_NAME, FRAME_BUS_SLOTS, FRAME_BUS_MAX_WIDTH, FRAME_BUS_MAX_HEIGHT,
+                          FRAME_BUS_MSG_SLOTS, FRAME_BUS_MSG_BYTES)
+    facerec.frame_bus = bus
+    listener = serve_control(facerec.ENGINE_CONTROL, facerec.ENGINE_AUTHKEY, facerec.engine_command)
+    size_mb = bus.shm.size / 1e6
+    print(f"🚀 Motor listo: frame bus '{bus.shm.name}' ({size_mb:.0f} MB), control en {facerec.ENGINE_CONTROL}")
+    # el motor es el único que escribe la galería: también es el que sincroniza con los pares
+    facerec.start_gallery_sync()
+
+    stopping = []
+    signal.signal(signal.SIGTERM, lambda *_: stopping.append(True))
+    try:
+        if args.start:
+            body, _ = facerec.start_engine()
+            print(f"📡 {body.get('message') or body.get('error')}")
+        while not stopping:
+            bus.beat()
+            time.sleep(1.0)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        facerec.stop_engine()
+        if facerec.recognition_thread is not None:
+            facerec.recognition_thread.join(timeout=5.0)
+        listener.close()
+        facerec.frame_bus = None
+        bus.close()
+        print("🛑 Motor detenido")
+
+
+if __name__ == '__main__':
+    main()
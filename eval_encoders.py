@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+"""
+Evalúa perfiles de encoding (encoders.py) sobre un conjunto local etiquetado:
+latencia por cara y tasa de aciertos.
+
+Conjunto: una carpeta por persona (el mismo formato que deja el registro en
+capturas_registro/<Nombre>/*.jpg). Cada imagen se detecta una sola vez (cara
+más grande) y se encodea con cada perfil.
+
+Métricas por perfil (dejando cada imagen fuera de la galería):
+- match_rate: el vecino más cercano es la misma persona y está bajo el umbral
+- false_match: el vecino más cercano es otra persona y está bajo el umbral
+- genuine / impostor: distancia media a la misma persona / a otras
+- vs_ref: match_rate consultando con este perfil contra una galería
+  encodeada con el primer perfil (impacto de mezclar modelos; ver
+  ENCODING_ALLOW_MIXED)
+
+Uso:
+    python eval_encoders.py --images capturas_registro \
+        --profiles "large;small;large:jitters=5;small:jitters=5"
+"""
+import os
+import time
+import argparse
+import cv2
+import numpy as np
+
+from detectors import make_detector
+from encoders import make_encoder
+from bench_detectors import IMAGE_EXTS
+
+
+def load_labelled(root, limit_per_person=None):
+    items = []
+    for person in sorted(os.listdir(root)):
+        pdir = os.path.join(root, person)
+        if not os.path.isdir(pdir):
+            continue
+        files = [f for f in sorted(os.listdir(pdir)) if f.lower().endswith(IMAGE_EXTS)]
+        for f in files[:limit_per_person]:
+            items.append((person, os.path.join(pdir, f)))
+    return items
+
+
+def leave_one_out(queries, gallery, labels, thr):
+    """(match_rate, false_match, genuine, impostor) con la imagen excluida de la galería."""
+    labels = np.asarray(labels)
+    d = np.linalg.norm(queries[:, None, :] - gallery[None, :, :], axis=2)
+    np.fill_diagonal(d, np.inf)
+    nn = d.argmin(axis=1)
+    nn_d = d[np.arange(len(d)), nn]
+    same = labels[nn] == labels
+    under = nn_d <= thr
+    same_mask = (labels[:, None] == labels[None, :]) & np.isfinite(d)
+    diff_mask = labels[:, None] != labels[None, :]
+    genuine = float(d[same_mask].mean()) if same_mask.any() else None
+    impostor = float(d[diff_mask].mean()) if diff_mask.any() else None
+    return float((same & under).mean()), float((~same & under).mean()), genuine, impostor
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--images', default="capturas_registro", help="carpeta con una subcarpeta por persona")
+    parser.add_argument('--profiles', default="large;small;large:jitters=5",
+                        help="perfiles separados por ';' (el primero es la referencia)")
+    parser.add_argument('--detector', default="hog")
+    parser.add_argument('--downscale', type=float, default=0.7)
+    parser.add_argument('--threshold', type=float, default=0.6)
+    parser.add_argument('--per-person', type=int, default=20)
+    args = parser.parse_args()
+
+    items = load_labelled(args.images, args.per_person)
+    detector = make_detector(args.detector)
+    faces = []
+    for person, path in items:
+        bgr = cv2.imread(path)
+        if bgr is None:
+            continue
+        small = cv2.resize(bgr, (0, 0), fx=args.downscale, fy=args.downscale)
+        rgb = cv2.cvtColor(small, cv2.COLOR_BGR2RGB)
+        boxes = detector.detect(rgb)
+        if boxes:
+            box = max(boxes, key=lambda b: (b[2] - b[0]) * (b[1] - b[3]))
+            faces.append((person, rgb, box))
+    people = sorted({p for p, _, _ in faces})
+    if len(faces) < 2:
+        raise SystemExit(f"Se necesitan al menos 2 caras en {args.images} (encontradas: {len(faces)})")
+    print(f"{len(faces)} caras de {len(people)} personas, umbral {args.threshold}")
+
+    labels = [p for p, _, _ in faces]
+    ref = None
+    print(f"{'perfil':<22} {'ms/cara':>8} {'match':>7} {'falso':>7} {'genuina':>8} {'impostor':>9} {'vs_ref':>7}")
+    for spec in args.profiles.split(";"):
+        enc = make_encoder(spec)
+        enc.encode(faces[0][1], [faces[0][2]])   # calentamiento
+        vecs, t0 = [], time.perf_counter()
+        for _, rgb, box in faces:
+            vecs.append(enc.encode(rgb, [box])[0])
+        ms = 1000 * (time.perf_counter() - t0) / len(faces)
+        vecs = np.asarray(vecs)
+        if ref is None:
+            ref = vecs
+        match, false, genuine, impostor = leave_one_out(vecs, vecs, labels, args.threshold)
+        vs_ref, _, _, _ = leave_one_out(vecs, ref, labels, args.threshold)
+        fmt = lambda v: f"{v:.3f}" if v is not None else "-"
+        print(f"{enc.spec:<22} {ms:>8.1f} {match:>7.3f} {false:>7.3f} {fmt(genuine):>8} "
+              f"{fmt(impostor):>9} {vs_ref:>7.3f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,133 @@
+# event_bus.py - Canal push (Server-Sent Events) para resultados y estado
+"""
+Cada mensaje se serializa una sola vez (JSON + formato SSE) y el mismo
+objeto bytes se entrega a todos los suscriptores.
+
+- Numeración: cada mensaje lleva `id: <seq>` creciente. Un cliente que se
+  reconecta con `Last-Event-ID` (o `?since=`) recibe lo que se perdió
+  mientras siga en el historial; si no, recibe un evento `reset`.
+- Buffers acotados: cada suscriptor tiene una cola de tamaño fijo. Si un
+  cliente lento la llena se descartan sus mensajes más viejos y se le envía
+  `reset` para que recargue el estado por REST.
+- Heartbeat: comentario `: ping` cuando no hay tráfico, para detectar
+  desconexiones y mantener vivos los proxies.
+"""
+import json
+import threading
+from collections import deque
+
+HISTORY_SIZE = 256
+CLIENT_BUFFER = 64
+HEARTBEAT_SECONDS = 15
+
+
+def format_sse(kind, data, seq=None):
+    """Mensaje SSE listo para enviar."""
+    head = f"id: {seq}\n" if seq is not None else ""
+    return f"{head}event: {kind}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n".encode("utf-8")
+
+
+class Subscriber:
+    def __init__(self, maxlen):
+        self.queue = deque(maxlen=maxlen)
+        self.overflowed = False
+
+    def push(self, msg):
+        if len(self.queue) == self.queue.maxlen:
+            self.overflowed = True
+        self.queue.append(msg)
+
+
+class EventBus:
+    """Difusión de mensajes SSE a N suscriptores con historial para reanudar."""
+
+    def __init__(self, history_size=HISTORY_SIZE, client_buffer=CLIENT_BUFFER):
+        self._cond = threading.Condition()
+        self._history = deque(maxlen=history_size)   # (seq, bytes)
+        self._subs = set()
+        self._client_buffer = client_buffer
+        self.seq = 0
+        self.published = 0
+        self.dropped = 0
+
+    def publish(self, kind, data):
+        with self._cond:
+            self.seq += 1
+            msg = format_sse(kind, data, self.seq)
+            self._history.append((self.seq, msg))
+            for sub in self._subs:
+                sub.push(msg)
+            self.published += 1
+            self._cond.notify_all()
+        return self.seq
+
+    def subscribe(self, since=None):
+        """Nuevo suscriptor; con `since` se reenvía lo posterior a ese seq."""
+        sub = Subscriber(self._client_buffer)
+        with self._cond:
+            if since is not None and since < self.seq:
+                oldest = self._history[0][0] if self._history else self.seq + 1
+                if since + 1 < oldest or self.seq - since > self._client_buffer:
+                    sub.push(format_sse("reset", {"seq": self.seq}))
+                else:
+                    for seq, msg in self._history:
+                        if seq > since:
+                            sub.push(msg)
+            self._subs.add(sub)
+        return sub
+
+    def unsubscribe(self, sub):
+        with self._cond:
+            self._subs.discard(sub)
+
+    def get(self, sub, timeout=HEARTBEAT_SECONDS):
+        """Bloquea hasta tener mensajes; devuelve bytes o None si venció el timeout."""
+        with self._cond:
+            if not sub.queue:
+                self._cond.wait_for(lambda: sub.queue, timeout=timeout)
+            if not sub.queue:
+                return None
+            msgs = list(sub.queue)
+            sub.queue.clear()
+            if sub.overflowed:
+                # se perdieron mensajes: primero recargar estado, luego lo nuevo
+                sub.overflowed = False
+                self.dropped += 1
+                msgs.insert(0, format_sse("reset", {"seq": self.seq}))
+            return b"".join(msgs)
+
+    def history_since(self, last_seq, timeout=0):
+        """
+        (seq actual, [(seq, bytes)] posteriores a `last_seq`), esperando hasta
+        `timeout` si no hay nada nuevo. La lista es None si ya salieron del historial.
+        """
+        with self._cond:
+            if timeout and self.seq <= last_seq:
+                self._cond.wait_for(lambda: self.seq > last_seq, timeout=timeout)
+            if self.seq <= last_seq:
+                return self.seq, []
+            oldest = self._history[0][0] if self._history else self.seq + 1
+            if last_seq + 1 < oldest:
+                return self.seq, None
+            return self.seq, [(seq, msg) for seq, msg in self._history if seq > last_seq]
+
+    def stream(self, since=None, initial=None, heartbeat=HEARTBEAT_SECONDS):
+        """Generador para Response(...): mensaje inicial, pendientes y heartbeats."""
+        sub = self.subscribe(since)
+        try:
+            if initial is not None:
+                yield initial
+            while True:
+                chunk = self.get(sub, timeout=heartbeat)
+                yield chunk if chunk is not None else b": ping\n\n"
+        finally:
+            self.unsubscribe(sub)
+
+    def stats(self):
+        with self._cond:
+            return {
+                "seq": self.seq,
+                "subscribers": len(self._subs),
+                "published": self.published,
+                "client_overflows": self.dropped,
+            }
@@ -0,0 +1,94 @@
+# event_debounce.py - Agrupa resultados por (cámara, identidad) en eventos
+"""
+Una persona frente a la cámara produce un resultado cada pocos frames. En
+vez de enviar webhook + JPEG + JSON por cada uno, se agrupan en visitas:
+
+  arrived        primera vez que se ve a la identidad (o tras haberse ido)
+  still_present  opcional, cada `still_present_interval` segundos
+  left           no se la ve hace `leave_timeout` segundos
+
+Cada evento lleva la mejor confianza de la visita, el tiempo de
+permanencia y el número de detecciones agrupadas.
+"""
+import time
+import threading
+
+
+class EventDebouncer:
+    """Estado de visitas por (cámara, identidad)."""
+
+    def __init__(self, leave_timeout=10.0, still_present_interval=0.0):
+        self.leave_timeout = leave_timeout
+        self.still_present_interval = still_present_interval   # 0 = desactivado
+        self._visits = {}
+        self._lock = threading.Lock()
+        self.observed = 0
+        self.emitted = 0
+
+    def _event(self, kind, camera, visit, now):
+        self.emitted += 1
+        result = dict(visit["best_result"])
+        result.update({
+            "event": kind,
+            "camera": camera,
+            "first_seen": visit["first_seen_iso"],
+            "dwell_seconds": round(now - visit["first_seen"], 1),
+            "best_confidence": visit["best_confidence"],
+            "detections": visit["count"],
+        })
+        return result
+
+    def observe(self, camera, result, now=None):
+        """Registra un resultado; devuelve la lista de eventos a emitir."""
+        now = time.time() if now is None else now
+        key = (camera, result["name"])
+        events = []
+        with self._lock:
+            self.observed += 1
+            visit = self._visits.get(key)
+            if visit is None:
+                visit = {
+                    "first_seen": now,
+                    "first_seen_iso": result.get("timestamp"),
+                    "last_seen": now,
+                    "last_emit": now,
+                    "best_confidence": result["confidence"],
+                    "best_result": result,
+                    "count": 1,
+                }
+                self._visits[key] = visit
+                events.append(self._event("arrived", camera, visit, now))
+                return events
+
+            visit["last_seen"] = now
+            visit["count"] += 1
+            if result["confidence"] > visit["best_confidence"]:
+                visit["best_confidence"] = result["confidence"]
+                visit["best_result"] = result
+            if self.still_present_interval and now - visit["last_emit"] >= self.still_present_interval:
+                visit["last_emit"] = now
+                events.append(self._event("still_present", camera, visit, now))
+        return events
+
+    def sweep(self, now=None):
+        """Cierra las visitas que expiraron; devuelve sus eventos 'left'."""
+        now = time.time() if now is None else now
+        events = []
+        with self._lock:
+            for key in [k for k, v in self._visits.items() if now - v["last_seen"] >= self.leave_timeout]:
+                visit = self._visits.pop(key)
+                # la permanencia termina en la última detección, no en el barrido
+                events.append(self._event("left", key[0], visit, visit["last_seen"]))
+        return events
+
+    def flush(self):
+        """Cierra todas las visitas abiertas (al detener el reconocimiento)."""
+        return self.sweep(now=float("inf"))
+
+    def stats(self):
+        with self._lock:
+            return {
+                "observed": self.observed,
+                "emitted": self.emitted,
+                "open_visits": len(self._visits),
+            }
@@ -0,0 +1,299 @@
+# frame_bus.py - Frames y resultados del motor en memoria compartida para N workers HTTP
+"""
+El motor de reconocimiento (engine.py) corre en su propio proceso y publica
+en un segmento `multiprocessing.shared_memory`:
+
+  frames     anillo de FRAME_BUS_SLOTS ranuras con el frame BGR crudo
+             (h, w, c, timestamp). Los workers copian el último frame con un
+             memcpy; nada pasa por pickle.
+  mensajes   anillo de MSG_SLOTS registros JSON de tamaño fijo: resultados,
+             eventos de visita, estado, detecciones para el overlay, cambios
+             de configuración y de galería. Un worker que arranca tarde
+             reproduce lo que siga en el anillo.
+
+Un solo escritor (el motor). Cada ranura lleva su número de secuencia: se
+pone en 0 antes de escribir y se restaura al terminar, y el lector vuelve a
+comprobarlo después de copiar, así que una ranura pisada a mitad de la
+lectura se descarta en vez de entregar un frame mezclado.
+
+Los comandos (start/stop/config/register/status) van por un canal de control
+aparte (`multiprocessing.connection`, TCP local o socket unix con authkey):
+son pocos y necesitan respuesta.
+"""
+import os
+import json
+import time
+import struct
+import threading
+import numpy as np
+from multiprocessing import shared_memory, resource_tracker
+from multiprocessing.connection import Listener, Client
+
+MAGIC = b"FRMBUS01"
+# magic, ranuras de frame, bytes por frame, ranuras de mensaje, bytes por
+# mensaje, pid del motor, creado, seq de frames, seq de mensajes, heartbeat
+_HEADER = struct.Struct("<8sIIIIIdQQd")
+_FRAME_SEQ_OFF = 36
+_MSG_SEQ_OFF = 44
+_BEAT_OFF = 52
+_HEADER_SIZE = 64
+_SLOT = struct.Struct("<QIIId")      # seq, alto, ancho, canales, timestamp
+_SLOT_HEAD = 32
+_MSG = struct.Struct("<QI")          # seq, largo
+_MSG_HEAD = 16
+STALE_SECONDS = 5.0
+
+
+def _align(n, to=64):
+    return (n + to - 1) // to * to
+
+
+def _attach_shm(name):
+    """Abre un segmento existente sin que el resource_tracker lo borre al salir."""
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)   # Python >= 3.13
+    except TypeError:
+        shm = shared_memory.SharedMemory(name=name)
+        # sin esto el tracker de cada worker haría unlink() del segmento del motor
+        resource_tracker.unregister(shm._name, "shared_memory")
+        return shm
+
+
+class FrameBus:
+    """Anillos de frames y mensajes sobre un segmento de memoria compartida."""
+
+    def __init__(self, shm, owner):
+        self.shm = shm
+        self.owner = owner
+        self.buf = shm.buf
+        (magic, self.slots, self.slot_bytes, self.msg_slots, self.msg_bytes,
+         self.pid, self.created, _, _, _) = _HEADER.unpack_from(self.buf, 0)
+        if magic != MAGIC:
+            raise ValueError(f"El segmento {shm.name} no es un frame bus")
+        self._slot_stride = _align(_SLOT_HEAD + self.slot_bytes)
+        self._msg_base = _HEADER_SIZE + self.slots * self._slot_stride
+        self._msg_stride = _align(_MSG_HEAD + self.msg_bytes)
+        self._lock = threading.Lock()
+        self.frames_written = 0
+        self.frames_read = 0
+        self.torn_reads = 0
+        self.oversize = 0
+        self.messages_dropped = 0
+        self.messages_lost = 0
+
+    # ---- ciclo de vida ----
+
+    @classmethod
+    def create(cls, name, slots=4, max_width=1600, max_height=1200, msg_slots=512, msg_bytes=16384):
+        """Crea el segmento (motor). Uno previo con el mismo nombre se considera huérfano."""
+        slot_bytes = max_width * max_height * 3
+        size = (_HEADER_SIZE + slots * _align(_SLOT_HEAD + slot_bytes)
+                + msg_slots * _align(_MSG_HEAD + msg_bytes))
+        try:
+            old = _attach_shm(name)
+            old.close()
+            old.unlink()
+            print(f"⚠️ Frame bus '{name}' huérfano de una ejecución anterior: recreado")
+        except FileNotFoundError:
+            pass
+        shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+        _HEADER.pack_into(shm.buf, 0, MAGIC, slots, slot_bytes, msg_slots, msg_bytes,
+                          os.getpid(), time.time(), 0, 0, time.time())
+        return cls(shm, owner=True)
+
+    @classmethod
+    def attach(cls, name):
+        """Se conecta a un segmento existente (workers). FileNotFoundError si el motor no corre."""
+        return cls(_attach_shm(name), owner=False)
+
+    def close(self):
+        self.buf = None
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+    # ---- encabezado ----
+
+    def _get_u64(self, off):
+        return struct.unpack_from("<Q", self.buf, off)[0]
+
+    def _set_u64(self, off, value):
+        struct.pack_into("<Q", self.buf, off, value)
+
+    @property
+    def frame_seq(self):
+        return self._get_u64(_FRAME_SEQ_OFF)
+
+    @property
+    def msg_seq(self):
+        return self._get_u64(_MSG_SEQ_OFF)
+
+    def beat(self):
+        struct.pack_into("<d", self.buf, _BEAT_OFF, time.time())
+
+    def heartbeat_age(self):
+        return time.time() - struct.unpack_from("<d", self.buf, _BEAT_OFF)[0]
+
+    def is_stale(self):
+        return self.heartbeat_age() > STALE_SECONDS
+
+    # ---- frames ----
+
+    def _slot_off(self, seq):
+        return _HEADER_SIZE + (seq % self.slots) * self._slot_stride
+
+    def write_frame(self, frame):
+        """Publica un frame BGR uint8. Los que no caben en la ranura se descartan."""
+        if frame.nbytes > self.slot_bytes or frame.dtype != np.uint8:
+            if not self.oversize:
+                print(f"⚠️ Frame {frame.shape} no entra en el frame bus "
+                      f"({self.slot_bytes} bytes por ranura); sube FRAME_BUS_MAX_WIDTH/HEIGHT")
+            self.oversize += 1
+            return False
+        h, w = frame.shape[:2]
+        c = frame.shape[2] if frame.ndim == 3 else 1
+        with self._lock:
+            seq = self.frame_seq + 1
+            off = self._slot_off(seq)
+            self._set_u64(off, 0)       # ranura en escritura
+            dst = np.ndarray((frame.nbytes,), np.uint8, self.buf, off + _SLOT_HEAD)
+            dst[:] = np.ascontiguousarray(frame).reshape(-1)
+            _SLOT.pack_into(self.buf, off, seq, h, w, c, time.time())
+            self._set_u64(_FRAME_SEQ_OFF, seq)
+            self.frames_written += 1
+        return True
+
+    def read_frame(self, after_seq=0):
+        """(seq, timestamp, frame copiado) del último frame si es más nuevo que `after_seq`."""
+        seq = self.frame_seq
+        if seq <= after_seq:
+            return None
+        off = self._slot_off(seq)
+        slot_seq, h, w, c, ts = _SLOT.unpack_from(self.buf, off)
+        if slot_seq != seq:
+            self.torn_reads += 1
+            return None
+        src = np.ndarray((h * w * c,), np.uint8, self.buf, off + _SLOT_HEAD)
+        frame = src.copy().reshape((h, w, c) if c > 1 else (h, w))
+        if self._get_u64(off) != seq:
+            # el motor dio toda la vuelta al anillo mientras copiábamos
+            self.torn_reads += 1
+            return None
+        self.frames_read += 1
+        return seq, ts, frame
+
+    # ---- mensajes ----
+
+    def _msg_off(self, seq):
+        return self._msg_base + (seq % self.msg_slots) * self._msg_stride
+
+    def post(self, kind, data):
+        """Publica un mensaje JSON {kind, data}; los que superan msg_bytes se descartan."""
+        payload = json.dumps({"kind": kind, "data": data}, ensure_ascii=False, default=str).encode("utf-8")
+        if len(payload) > self.msg_bytes:
+            self.messages_dropped += 1
+            print(f"⚠️ Mensaje '{kind}' de {len(payload)} bytes no entra en el frame bus ({self.msg_bytes})")
+            return False
+        with self._lock:
+            seq = self.msg_seq + 1
+            off = self._msg_off(seq)
+            self._set_u64(off, 0)
+            self.buf[off + _MSG_HEAD:off + _MSG_HEAD + len(payload)] = payload
+            _MSG.pack_into(self.buf, off, seq, len(payload))
+            self._set_u64(_MSG_SEQ_OFF, seq)
+        return True
+
+    def read_messages(self, after_seq=0):
+        """(última seq, [(seq, kind, data)]) posteriores a `after_seq` que sigan en el anillo."""
+        head = self.msg_seq
+        if head <= after_seq:
+            return after_seq, []
+        start = max(after_seq + 1, head - self.msg_slots + 1)
+        if after_seq and start > after_seq + 1:
+            self.messages_lost += start - after_seq - 1
+        out = []
+        for seq in range(start, head + 1):
+            off = self._msg_off(seq)
+            slot_seq, length = _MSG.unpack_from(self.buf, off)
+            if slot_seq != seq:
+                self.messages_lost += 1
+                continue
+            raw = bytes(self.buf[off + _MSG_HEAD:off + _MSG_HEAD + length])
+            if self._get_u64(off) != seq:
+                self.messages_lost += 1
+                continue
+            msg = json.loads(raw)
+            out.append((seq, msg["kind"], msg["data"]))
+        return head, out
+
+    def stats(self):
+        return {
+            "name": self.shm.name,
+            "owner": self.owner,
+            "engine_pid": self.pid,
+            "heartbeat_age": round(self.heartbeat_age(), 1),
+            "frame_seq": self.frame_seq,
+            "msg_seq": self.msg_seq,
+            "slots": self.slots,
+            "slot_bytes": self.slot_bytes,
+            "frames_written": self.frames_written,
+            "frames_read": self.frames_read,
+            "torn_reads": self.torn_reads,
+            "oversize": self.oversize,
+            "messages_dropped": self.messages_dropped,
+            "messages_lost": self.messages_lost
+        }
+
+
+# ---- canal de control ----
+
+def parse_address(spec):
+    """'host:puerto' -> tupla TCP; cualquier otra cosa es la ruta de un socket unix."""
+    host, sep, port = spec.rpartition(":")
+    if sep and port.isdigit() and "/" not in spec:
+        return (host or "127.0.0.1", int(port))
+    return spec
+
+
+def serve_control(address, authkey, handler):
+    """
+    Atiende comandos en un hilo: cada conexión envía (cmd, kwargs) y recibe
+    lo que devuelva handler(cmd, kwargs). Devuelve el Listener.
+    """
+    listener = Listener(parse_address(address), authkey=authkey)
+
+    def serve_conn(conn):
+        with conn:
+            try:
+                cmd, kwargs = conn.recv()
+                conn.send(handler(cmd, kwargs))
+            except EOFError:
+                pass
+            except Exception as e:
+                print(f"❌ Error en comando de control: {e}")
+                try:
+                    conn.send(({"error": str(e)}, 500))
+                except OSError:
+                    pass
+
+    def accept_loop():
+        while True:
+            try:
+                conn = listener.accept()
+            except OSError:
+                return      # listener cerrado
+            except Exception as e:
+                # authkey incorrecta o cliente que cortó a mitad del handshake
+                print(f"⚠️ Conexión de control rechazada: {e}")
+                continue
+            threading.Thread(target=serve_conn, args=(conn,), daemon=True).start()
+
+    threading.Thread(target=accept_loop, daemon=True).start()
+    return listener
+
+
+def control_call(address, authkey, cmd, **kwargs):
+    """Envía un comando al motor y devuelve su respuesta. OSError si no hay motor."""
+    with Client(parse_address(address), authkey=authkey) as conn:
+        conn.send((cmd, kwargs))
+        return conn.recv()
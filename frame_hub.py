@@ -0,0 +1,147 @@
+# frame_hub.py - Frame compartido del reconocimiento + overlay anotado
+"""
+El loop de reconocimiento publica aquí cada frame capturado y las últimas
+cajas/nombres detectados. Los visores de /video_feed/annotated no vuelven a
+detectar ni a abrir la cámara: el JPEG anotado se dibuja y codifica una sola
+vez por versión de frame (o de detecciones) y se reparte a todos.
+
+Lo mismo para /api/snapshot: un JPEG por (versión de frame, ancho).
+"""
+import time
+import threading
+from collections import OrderedDict
+import cv2
+
+SNAPSHOT_WIDTH_STEP = 32     # anchos redondeados para acotar las variantes
+SNAPSHOT_MAX_VARIANTS = 8
+
+COLOR_KNOWN = (0, 255, 0)
+COLOR_UNKNOWN = (0, 0, 255)
+COLOR_AMBIGUOUS = (0, 165, 255)
+
+
+def draw_detections(frame, detections):
+    """Dibuja cajas y etiquetas (mismo estilo que recolive.py) sobre `frame`."""
+    for det in detections:
+        box = det["box"]
+        t, r, b, l = box["top"], box["right"], box["bottom"], box["left"]
+        if det["name"] == "Desconocido":
+            color = COLOR_UNKNOWN
+        elif det.get("ambiguous"):
+            color = COLOR_AMBIGUOUS
+        else:
+            color = COLOR_KNOWN
+        cv2.rectangle(frame, (l, t), (r, b), color, 2)
+        text = f"{det['name']} ({det['distance']:.2f})"
+        (w, h), baseline = cv2.getTextSize(text, cv2.FONT_HERSHEY_SIMPLEX, 0.6, 2)
+        y = max(t - 10, h + 10)
+        cv2.rectangle(frame, (l, y - h - baseline), (l + w, y + baseline // 2), color, -1)
+        cv2.putText(frame, text, (l, y), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 0, 0), 2)
+    return frame
+
+
+class FrameHub:
+    """Último frame + últimas detecciones, con JPEG anotado cacheado."""
+
+    def __init__(self, jpeg_quality=80, overlay_ttl=1.0):
+        self.jpeg_quality = jpeg_quality
+        self.overlay_ttl = overlay_ttl     # no dibujar cajas más viejas que esto
+        self._cond = threading.Condition()
+        self._render_lock = threading.Lock()
+        self.frame = None
+        self.version = 0
+        self.frame_time = 0.0
+        self._detections = []
+        self._det_version = 0
+        self._det_time = 0.0
+        self._cache_key = None
+        self._cache_jpeg = None
+        self.renders = 0
+        self.served = 0
+        self._snapshots = OrderedDict()     # ancho -> (versión, jpeg)
+        self._snapshot_lock = threading.Lock()
+        self.snapshot_encodes = 0
+        self.snapshot_served = 0
+
+    def publish_frame(self, frame):
+        """Nuevo frame de la cámara (no se copia: el llamador no debe mutarlo)."""
+        with self._cond:
+            self.frame = frame
+            self.version += 1
+            self.frame_time = time.time()
+            self._cond.notify_all()
+
+    def set_detections(self, detections):
+        """Cajas en coordenadas del frame completo: [{box, name, distance, ambiguous}]."""
+        with self._cond:
+            self._detections = detections
+            self._det_version += 1
+            self._det_time = time.time()
+
+    def wait_frame(self, last_version, timeout=5.0):
+        """Bloquea hasta que haya un frame más nuevo que `last_version`."""
+        with self._cond:
+            self._cond.wait_for(lambda: self.version > last_version, timeout=timeout)
+            return self.version if self.version > last_version else None
+
+    def annotated_jpeg(self):
+        """JPEG del último frame con overlay; se renderiza una vez por versión."""
+        with self._cond:
+            frame = self.frame
+            if frame is None:
+                return None
+            fresh = time.time() - self._det_time <= self.overlay_ttl
+            key = (self.version, self._det_version if fresh else None)
+            detections = self._detections if fresh else []
+        with self._render_lock:
+            # otro visor pudo haberlo renderizado mientras esperábamos el lock
+            if self._cache_key != key:
+                canvas = draw_detections(frame.copy(), detections)
+                ok, buf = cv2.imencode('.jpg', canvas, [cv2.IMWRITE_JPEG_QUALITY, self.jpeg_quality])
+                if ok:
+                    self._cache_key, self._cache_jpeg = key, buf.tobytes()
+                    self.renders += 1
+            self.served += 1
+            return self._cache_jpeg
+
+    def snapshot_width(self, width):
+        """Ancho efectivo del snapshot (None = tamaño original)."""
+        frame = self.frame
+        if not width or frame is None or width >= frame.shape[1]:
+            return None
+        return max(SNAPSHOT_WIDTH_STEP, int(round(width / SNAPSHOT_WIDTH_STEP)) * SNAPSHOT_WIDTH_STEP)
+
+    def snapshot_jpeg(self, width=None):
+        """(versión, frame_time, jpeg) del último frame, codificado como máximo una vez por versión."""
+        with self._cond:
+            frame, version, frame_time = self.frame, self.version, self.frame_time
+        if frame is None:
+            return None, None, None
+        width = self.snapshot_width(width)
+        with self._snapshot_lock:
+            cached = self._snapshots.get(width)
+            if cached is None or cached[0] != version:
+                img = frame
+                if width:
+                    height = max(1, int(frame.shape[0] * width / frame.shape[1]))
+                    img = cv2.resize(frame, (width, height), interpolation=cv2.INTER_AREA)
+                ok, buf = cv2.imencode('.jpg', img, [cv2.IMWRITE_JPEG_QUALITY, self.jpeg_quality])
+                if not ok:
+                    return None, None, None
+                cached = (version, buf.tobytes())
+                self._snapshots[width] = cached
+                self.snapshot_encodes += 1
+                while len(self._snapshots) > SNAPSHOT_MAX_VARIANTS:
+                    self._snapshots.popitem(last=False)
+            self._snapshots.move_to_end(width)
+            self.snapshot_served += 1
+            return version, frame_time, cached[1]
+
+    def stats(self):
+        return {
+            "frame_version": self.version,
+            "annotated_renders": self.renders,
+            "annotated_served": self.served,
+            "snapshot_encodes": self.snapshot_encodes,
+            "snapshot_served": self.snapshot_served,
+        }
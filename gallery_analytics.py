@@ -0,0 +1,269 @@
+#!/usr/bin/env python3
+"""
+Distribuciones de distancias de la galería y calibración del umbral.
+
+Calcula todas las distancias entre filas de encodings.npy, separadas en
+genuinas (misma identidad) e impostoras (identidades distintas), con un
+kernel por bloques:
+
+  - la galería se recorre en bloques de --block filas; cada par de bloques
+    (sólo el triángulo superior) es un GEMM con las normas precalculadas
+    (|a|² - 2ab + |b|²), como GalleryMatcher
+  - cada bloque se reduce ahí mismo a histogramas (bins de BIN_WIDTH) y a
+    mínimos/máximos por fila: la memoria es O(block² por hilo + N), nunca
+    O(N²), así que 100k+ filas entran en RAM
+  - los pares de bloques se reparten en --workers hilos (el GEMM de NumPy
+    suelta el GIL), con pocos bloques en vuelo a la vez
+
+Reporta FMR (impostores bajo el umbral) y FNMR (genuinos sobre el umbral)
+para el umbral actual, el EER y el umbral recomendado para --target-fmr.
+Por identidad calcula el impostor más cercano y su muestra genuina más
+lejana; si el impostor está más cerca que el umbral que va a usar la app
+más --margin, la identidad recibe un umbral propio más estricto. Ese umbral
+base es --threshold (lo que usa app.py por defecto) o, con --use-global, el
+recomendado (para IDENTITY_THRESHOLDS_GLOBAL=1). Subir el umbral de las
+identidades muy separadas (--max-raise, default 0) es opcional: sólo mira a
+los impostores registrados y afloja el match contra gente que no lo está.
+
+Con N pares impostores el FMR más chico que se puede medir es 1/N: si
+--target-fmr es menor, el umbral se calcula para 1/N con un aviso y --write
+se niega a guardar salvo con --force (con pocos impostores el umbral sale
+muy bajo y el FNMR muy alto).
+
+`--write` guarda thresholds.json, que app.py carga al iniciar el
+reconocimiento (IDENTITY_THRESHOLDS): el umbral por identidad se busca por
+nombre sólo para el mejor candidato, sin costo extra en el barrido. El
+umbral global del archivo sólo se aplica con IDENTITY_THRESHOLDS_GLOBAL=1.
+
+Uso:
+  python gallery_analytics.py                      # reporte
+  python gallery_analytics.py --target-fmr 1e-5 --write
+"""
+import os
+import json
+import time
+import argparse
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+
+from compact_gallery import load_gallery, THRESHOLD
+from gallery_files import gallery_path
+
+THRESHOLDS_JSON = gallery_path("thresholds.json")
+BIN_WIDTH = 0.001
+MAX_DIST = 2.0
+BLOCK = 2048
+TARGET_FMR = 1e-4
+MARGIN = 0.05       # distancia mínima entre el umbral de una identidad y su impostor más cercano
+MAX_RAISE = 0.0     # cuánto puede subir el umbral de una identidad muy separada (0 = nunca)
+MIN_THRESHOLD = 0.3
+N_BINS = int(round(MAX_DIST / BIN_WIDTH))
+
+
+def _block_pair(encs, sq, codes, a0, a1, b0, b1):
+    """Histogramas y extremos por fila de un par de bloques (a <= b)."""
+    d = sq[a0:a1, None] - 2.0 * (encs[a0:a1] @ encs[b0:b1].T) + sq[None, b0:b1]
+    np.maximum(d, 0, out=d)
+    np.sqrt(d, out=d)
+    same = codes[a0:a1, None] == codes[None, b0:b1]
+    if a0 == b0:
+        # bloque diagonal: cada par una vez y sin la fila consigo misma
+        upper = np.triu(np.ones(same.shape, dtype=bool), 1)
+        gen_pairs, imp_pairs = d[same & upper], d[~same & upper]
+        np.fill_diagonal(same, False)
+        self_pair = np.eye(len(d), dtype=bool)
+    else:
+        gen_pairs, imp_pairs = d[same], d[~same]
+        self_pair = None
+    bins = lambda x: np.bincount(np.minimum((x / BIN_WIDTH).astype(np.int64), N_BINS - 1), minlength=N_BINS)
+    # impostor más cercano y genuino más lejano de cada fila, en ambos sentidos (la matriz es simétrica)
+    imp = np.where(same if self_pair is None else (same | self_pair), np.inf, d)
+    gen = np.where(same, d, -np.inf)
+    return (a0, a1, b0, b1, bins(gen_pairs), bins(imp_pairs),
+            imp.min(1), imp.min(0), gen.max(1), gen.max(0))
+
+
+def pairwise_stats(encs, labels, block=BLOCK, workers=None, progress=True):
+    """
+    Recorre todos los pares por bloques y devuelve histogramas genuino/impostor
+    y, por fila, la distancia al impostor más cercano y al genuino más lejano.
+    """
+    encs = np.ascontiguousarray(encs, dtype=np.float32)
+    names, codes = np.unique(np.asarray(labels, dtype=object).astype(str), return_inverse=True)
+    sq = (encs * encs).sum(1)
+    n = len(encs)
+    starts = list(range(0, n, block))
+    tasks = [(a, b) for i, a in enumerate(starts) for b in starts[i:]]
+    workers = workers or os.cpu_count() or 1
+
+    hist_gen = np.zeros(N_BINS, dtype=np.int64)
+    hist_imp = np.zeros(N_BINS, dtype=np.int64)
+    nearest_imp = np.full(n, np.inf, dtype=np.float32)
+    farthest_gen = np.full(n, -np.inf, dtype=np.float32)
+
+    def merge(r):
+        a0, a1, b0, b1, hg, hi, imp_a, imp_b, gen_a, gen_b = r
+        hist_gen[:] += hg
+        hist_imp[:] += hi
+        np.minimum(nearest_imp[a0:a1], imp_a, out=nearest_imp[a0:a1])
+        np.minimum(nearest_imp[b0:b1], imp_b, out=nearest_imp[b0:b1])
+        np.maximum(farthest_gen[a0:a1], gen_a, out=farthest_gen[a0:a1])
+        np.maximum(farthest_gen[b0:b1], gen_b, out=farthest_gen[b0:b1])
+
+    t0 = time.time()
+    with ThreadPoolExecutor(workers) as pool:
+        # como mucho 2 bloques en vuelo por hilo: memoria acotada
+        in_flight = []
+        for done, (a, b) in enumerate(tasks, 1):
+            in_flight.append(pool.submit(_block_pair, encs, sq, codes, a, min(a + block, n), b, min(b + block, n)))
+            if len(in_flight) >= 2 * workers:
+                merge(in_flight.pop(0).result())
+            if progress and done % max(1, len(tasks) // 10) == 0:
+                print(f"   {done}/{len(tasks)} bloques ({time.time() - t0:.0f}s)")
+        for f in in_flight:
+            merge(f.result())
+    return {
+        "names": list(names), "codes": codes, "hist_gen": hist_gen, "hist_imp": hist_imp,
+        "nearest_impostor": nearest_imp, "farthest_genuine": farthest_gen,
+        "pairs": int(n * (n - 1) // 2), "seconds": time.time() - t0
+    }
+
+
+def rates(hist_gen, hist_imp, thr):
+    """(FMR, FNMR) con umbral `thr` (match si distancia <= thr)."""
+    k = min(N_BINS, int(np.floor(thr / BIN_WIDTH)) + 1)
+    fmr = hist_imp[:k].sum() / max(1, hist_imp.sum())
+    fnmr = hist_gen[k:].sum() / max(1, hist_gen.sum())
+    return float(fmr), float(fnmr)
+
+
+def threshold_for_fmr(hist_imp, target):
+    """Mayor umbral (resolución BIN_WIDTH) con FMR <= target."""
+    cdf = np.cumsum(hist_imp) / max(1, hist_imp.sum())
+    k = int(np.searchsorted(cdf, target, side="right"))     # bins 0..k-1 dentro del objetivo
+    return round(k * BIN_WIDTH - BIN_WIDTH, 3) if k > 0 else 0.0
+
+
+def min_measurable_fmr(hist_imp):
+    """FMR de un solo par impostor: por debajo de eso no hay resolución."""
+    return 1.0 / max(1, int(hist_imp.sum()))
+
+
+def equal_error(hist_gen, hist_imp):
+    fmr = np.cumsum(hist_imp) / max(1, hist_imp.sum())
+    fnmr = 1.0 - np.cumsum(hist_gen) / max(1, hist_gen.sum())
+    k = int(np.argmin(np.abs(fmr - fnmr)))
+    return round(k * BIN_WIDTH, 3), float((fmr[k] + fnmr[k]) / 2)
+
+
+def per_identity(stats, global_thr, margin=MARGIN, max_raise=MAX_RAISE):
+    """Impostor más cercano / genuino más lejano por identidad y el umbral propio si difiere."""
+    codes = stats["codes"]
+    n_ids = len(stats["names"])
+    nearest = np.full(n_ids, np.inf, dtype=np.float32)
+    farthest = np.full(n_ids, -np.inf, dtype=np.float32)
+    np.minimum.at(nearest, codes, stats["nearest_impostor"])
+    np.maximum.at(farthest, codes, stats["farthest_genuine"])
+    out = {}
+    for i, name in enumerate(stats["names"]):
+        thr = float(np.clip(nearest[i] - margin, MIN_THRESHOLD, global_thr + max_raise))
+        out[name] = {
+            "nearest_impostor": round(float(nearest[i]), 3) if np.isfinite(nearest[i]) else None,
+            "farthest_genuine": round(float(farthest[i]), 3) if np.isfinite(farthest[i]) else None,
+            "threshold": round(thr, 3) if np.isfinite(nearest[i]) else global_thr
+        }
+    return out
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--threshold', type=float, default=THRESHOLD, help="umbral actual a evaluar")
+    parser.add_argument('--target-fmr', type=float, default=TARGET_FMR)
+    parser.add_argument('--margin', type=float, default=MARGIN)
+    parser.add_argument('--max-raise', type=float, default=MAX_RAISE,
+                        help="subida máxima del umbral de identidades muy separadas (afloja contra no registrados)")
+    parser.add_argument('--block', type=int, default=BLOCK)
+    parser.add_argument('--workers', type=int, default=0, help="hilos (0 = todos los núcleos)")
+    parser.add_argument('--write', action='store_true', help=f"guardar {THRESHOLDS_JSON}")
+    parser.add_argument('--use-global', action='store_true',
+                        help="umbrales por identidad contra el global recomendado (IDENTITY_THRESHOLDS_GLOBAL=1)")
+    parser.add_argument('--force', action='store_true',
+                        help="guardar aunque no haya impostores suficientes para --target-fmr")
+    args = parser.parse_args()
+
+    encs, labels = load_gallery()
+    print(f"Galería: {len(encs)} filas, {len(set(labels))} identidades, "
+          f"{len(encs) * (len(encs) - 1) // 2} pares, bloques de {args.block}")
+    stats = pairwise_stats(encs, labels, args.block, args.workers or None)
+    hg, hi = stats["hist_gen"], stats["hist_imp"]
+    print(f"Pares genuinos: {hg.sum()}, impostores: {hi.sum()} ({stats['seconds']:.1f}s, "
+          f"{stats['pairs'] / max(stats['seconds'], 1e-9) / 1e6:.0f} M pares/s)")
+    if not hg.sum() or not hi.sum():
+        raise SystemExit("Hacen falta al menos 2 muestras de una identidad y 2 identidades.")
+
+    centers = (np.arange(N_BINS) + 0.5) * BIN_WIDTH
+    for name, h in (("genuinas", hg), ("impostoras", hi)):
+        cdf = np.cumsum(h) / h.sum()
+        p = {q: centers[np.searchsorted(cdf, q)] for q in (0.01, 0.5, 0.99)}
+        print(f"   {name:<11} p1 {p[0.01]:.3f}  mediana {p[0.5]:.3f}  p99 {p[0.99]:.3f}")
+
+    fmr, fnmr = rates(hg, hi, args.threshold)
+    eer_thr, eer = equal_error(hg, hi)
+    target = args.target_fmr
+    floor = min_measurable_fmr(hi)
+    unresolved = target < floor
+    if unresolved:
+        target = floor
+        print(f"⚠️⚠️ Sólo hay {hi.sum()} pares impostores: el FMR más chico medible es {floor:.1e}, "
+              f"mayor que --target-fmr {args.target_fmr:.0e}. El umbral se calcula para {floor:.1e} "
+              f"y NO es confiable; hacen falta ~{int(10 / args.target_fmr)} pares impostores "
+              f"(más identidades registradas)")
+    rec = threshold_for_fmr(hi, target)
+    rec_fmr, rec_fnmr = rates(hg, hi, rec)
+    print(f"Umbral actual {args.threshold:.3f}: FMR {fmr:.2e}  FNMR {fnmr:.2%}")
+    print(f"EER {eer:.2%} en {eer_thr:.3f}")
+    print(f"Recomendado para FMR <= {target:.1e}: {rec:.3f} (FMR {rec_fmr:.2e}  FNMR {rec_fnmr:.2%})")
+
+    # los umbrales propios se comparan con el umbral que la app va a usar de verdad
+    base = rec if args.use_global else args.threshold
+    ids = per_identity(stats, base, args.margin, args.max_raise)
+    overrides = {name: v["threshold"] for name, v in ids.items() if abs(v["threshold"] - base) >= BIN_WIDTH}
+    stricter = sorted((v["threshold"], name) for name, v in ids.items() if v["threshold"] < base)
+    print(f"Identidades con umbral propio respecto de {base:.3f}"
+          f"{' (global recomendado)' if args.use_global else ''}: {len(overrides)} ({len(stricter)} más estrictas)")
+    for thr, name in stricter[:15]:
+        v = ids[name]
+        print(f"   {name}: {thr:.3f} (impostor más cercano {v['nearest_impostor']}, "
+              f"genuino más lejano {v['farthest_genuine']})")
+    spread = [name for name, v in ids.items() if v["farthest_genuine"] is not None
+              and v["farthest_genuine"] > v["threshold"]]
+    if spread:
+        print(f"⚠️ {len(spread)} identidades tienen muestras más lejanas entre sí que su umbral "
+              f"(revisar registros): {', '.join(spread[:10])}")
+
+    if not args.write:
+        print(f"(usa --write para guardar {THRESHOLDS_JSON})")
+        return
+    if unresolved and not args.force:
+        raise SystemExit(f"❌ No se guarda {THRESHOLDS_JSON}: pocos pares impostores para "
+                         f"--target-fmr {args.target_fmr:.0e} (--force para guardarlo igual)")
+    out = {
+        "generated": datetime.now().isoformat(),
+        "rows": len(encs),
+        "target_fmr": target,
+        "impostor_pairs": int(hi.sum()),
+        "global": rec,
+        "base": base,
+        "eer": {"threshold": eer_thr, "rate": round(eer, 5)},
+        "per_identity": overrides
+    }
+    tmp = THRESHOLDS_JSON + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(out, f, ensure_ascii=False, indent=2)
+    os.replace(tmp, THRESHOLDS_JSON)
+    print(f"✅ {THRESHOLDS_JSON} guardado ({len(overrides)} umbrales por identidad)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,124 @@
+# gallery_files.py - Archivos de la galería: rutas, bloqueo entre procesos y escritura atómica
+"""
+Todos los que escriben encodings.npy / labels.json (app.py, register_*.py,
+append_embeddings.py, compact_gallery.py) pasan por aquí:
+
+- Los archivos viven en GALLERY_DIR (default: directorio actual). En Docker
+  se monta el directorio, no los archivos sueltos: un rename sobre un
+  archivo montado falla con EBUSY.
+- Se escriben en un temporal del mismo directorio y se reemplazan con
+  os.replace: un servidor que tiene encodings.npy mapeado en memoria (modos
+  float16/int8, shards) sigue leyendo el archivo viejo en vez de ver cómo se
+  trunca bajo sus pies (SIGBUS).
+- Leer-modificar-escribir se hace con `gallery_file_lock()`, un flock sobre
+  GALLERY_DIR/.gallery.lock, para que un script y el servidor no se pisen.
+- Cada escritura se anota en el log de cambios del nodo (gallery_log.py),
+  también la de los scripts: si no, sus filas nunca llegan a los pares.
+"""
+import os
+import json
+from contextlib import contextmanager
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:     # Windows: sin bloqueo entre procesos
+    fcntl = None
+
+GALLERY_DIR = os.getenv('GALLERY_DIR', '')
+GALLERY_NODE_ID = os.getenv('GALLERY_NODE_ID', '')
+GALLERY_SHARED_DIR = os.getenv('GALLERY_SHARED_DIR', '')
+
+
+def gallery_path(name):
+    """Ruta de un archivo de la galería dentro de GALLERY_DIR."""
+    return os.path.join(GALLERY_DIR, name)
+
+
+ENCODINGS_NPY = gallery_path("encodings.npy")
+LABELS_JSON = gallery_path("labels.json")
+LOCK_FILE = gallery_path(".gallery.lock")
+GALLERY_NODE_JSON = gallery_path("gallery_node.json")
+GALLERY_LOG_JSONL = gallery_path("gallery_log.jsonl")
+
+
+@contextmanager
+def gallery_file_lock():
+    """Bloqueo exclusivo entre procesos para leer-modificar-escribir la galería."""
+    if fcntl is None:
+        yield
+        return
+    os.makedirs(GALLERY_DIR or ".", exist_ok=True)
+    with open(LOCK_FILE, "a") as f:
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+
+def load_gallery_files(npy=ENCODINGS_NPY, labels_path=LABELS_JSON):
+    """(encodings float32 (N, 128), labels); galería vacía si no existe."""
+    if not os.path.exists(npy) or not os.path.exists(labels_path):
+        return np.zeros((0, 128), dtype=np.float32), []
+    encs = np.load(npy).astype(np.float32).reshape(-1, 128)
+    with open(labels_path, "r", encoding="utf-8") as f:
+        labels = json.load(f)
+    return encs, labels
+
+
+def _replace(path, write):
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "wb") as f:
+        write(f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+def save_gallery(encs, labels, npy=ENCODINGS_NPY, labels_path=LABELS_JSON):
+    """Guardar encodings/labels con reemplazo atómico (no rompe mmaps abiertos)."""
+    os.makedirs(os.path.dirname(npy) or ".", exist_ok=True)
+    _replace(npy, lambda f: np.save(f, np.asarray(encs)))
+    data = json.dumps(labels, ensure_ascii=False, indent=2).encode("utf-8")
+    _replace(labels_path, lambda f: f.write(data))
+
+
+def open_gallery_node(owner=True):
+    """
+    (estado del nodo, ChangeLog) con el log en GALLERY_SHARED_DIR/<nodo>.jsonl
+    si hay directorio compartido. Sólo el dueño de la galería (app inline,
+    engine.py, scripts) crea gallery_node.json; con owner=False devuelve
+    None mientras no exista.
+    """
+    from gallery_log import ChangeLog, load_node_state, create_node_state
+    if owner:
+        state = create_node_state(GALLERY_NODE_JSON, GALLERY_NODE_ID)
+    elif os.path.exists(GALLERY_NODE_JSON):
+        state = load_node_state(GALLERY_NODE_JSON)
+    else:
+        return None
+    log = ChangeLog(os.path.join(GALLERY_SHARED_DIR, f"{state['node']}.jsonl")
+                    if GALLERY_SHARED_DIR else GALLERY_LOG_JSONL)
+    return state, log
+
+
+def append_rows(name, enc_list, landmark_model):
+    """
+    Agregar muestras de `name` a la galería (bajo el bloqueo, con el chequeo
+    de modelo de gallery_meta.json) -> (filas, etiquetas) en total.
+    """
+    # encoders importa face_recognition: sólo hace falta al escribir
+    from encoders import check_compatible, record_registration
+    from gallery_log import insert_change
+    enc_new = np.vstack([np.asarray(e, dtype=np.float32).reshape(1, -1) for e in enc_list])
+    with gallery_file_lock():
+        state, log = open_gallery_node()
+        encs, labels = load_gallery_files()
+        check_compatible(landmark_model, gallery_empty=not labels)
+        encs = np.vstack([encs, enc_new])
+        labels = labels + [name] * len(enc_new)
+        save_gallery(encs, labels)
+        log.append([insert_change(name, enc, landmark_model, state["node"]) for enc in enc_new])
+        record_registration(landmark_model, gallery_empty=len(labels) == len(enc_new))
+    return encs.shape[0], len(labels)
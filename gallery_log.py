@@ -0,0 +1,326 @@
+# gallery_log.py - Log de cambios versionado de la galería y sincronización entre nodos
+"""
+Cada nodo tiene su propio encodings.npy / labels.json. Para que un registro
+hecho en un nodo llegue a los demás sin copiar los archivos enteros:
+
+- Cada fila de la galería tiene un id derivado de su contenido (nombre +
+  bytes del encoding): dos nodos que parten de la misma galería asignan los
+  mismos ids sin coordinarse, y las galerías anteriores a este log no
+  necesitan migración.
+- Cada nodo escribe un log append-only (JSONL) de `insert` / `delete` con
+  versión local monótona (1, 2, 3...). Los cambios que llegan de otro nodo
+  se aplican y se vuelven a anotar en el log local conservando `origin`,
+  así un nodo sirve de relevo para los que no ven al nodo de origen.
+- Aplicar es idempotente: un insert con un id ya presente o borrado (lápida)
+  se ignora, y un delete deja la lápida aunque el insert todavía no haya
+  llegado. Con eso el conjunto de ids converge sin importar el orden ni el
+  camino por el que llegan los cambios, y el eco termina (lo ya aplicado no
+  se vuelve a anotar).
+- Un nodo sigue a cada par con un cursor (última versión aplicada de ese
+  par) y sólo pide "cambios desde V": por HTTP (`GET /api/gallery/changes`)
+  o leyendo `<dir>/<nodo>.jsonl` de un directorio compartido, donde cada
+  nodo guarda su propio log.
+"""
+import os
+import json
+import uuid
+import base64
+import socket
+import hashlib
+import threading
+from datetime import datetime
+import numpy as np
+import requests
+
+CHANGES_LIMIT = 500         # cambios por pedido a un par
+APPLY_BATCH = 5000          # cambios acumulados por aplicación (cada una reescribe la galería)
+
+
+def row_id(name, enc):
+    """Id de una fila: hash de nombre + encoding float32."""
+    h = hashlib.blake2b(digest_size=12)
+    h.update(str(name).encode("utf-8"))
+    h.update(b"\0")
+    h.update(np.asarray(enc, dtype=np.float32).tobytes())
+    return h.hexdigest()
+
+
+def row_ids(encs, labels):
+    return [row_id(name, enc) for name, enc in zip(labels, np.asarray(encs, dtype=np.float32))]
+
+
+def ids_digest(ids):
+    """Huella del conjunto de ids: dos nodos convergieron si coincide."""
+    h = hashlib.blake2b(digest_size=8)
+    for i in sorted(set(ids)):
+        h.update(i.encode())
+    return h.hexdigest()
+
+
+def encode_vec(enc):
+    return base64.b64encode(np.asarray(enc, dtype="<f4").tobytes()).decode("ascii")
+
+
+def decode_vec(data):
+    return np.frombuffer(base64.b64decode(data), dtype="<f4").astype(np.float32)
+
+
+def insert_change(name, enc, model, origin):
+    return {"op": "insert", "id": row_id(name, enc), "name": name, "enc": encode_vec(enc),
+            "model": model, "origin": origin, "ts": datetime.now().isoformat()}
+
+
+def delete_change(rid, name, origin):
+    return {"op": "delete", "id": rid, "name": name, "origin": origin, "ts": datetime.now().isoformat()}
+
+
+class ChangeLog:
+    """
+    Log JSONL con versión = número de línea. Lo puede leer otro proceso
+    mientras se escribe: sólo se consideran las líneas completas.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._offsets = []          # offset de la línea de cada versión (v = índice + 1)
+        self._read_to = 0
+        self.deleted = set()        # lápidas
+        self.refresh()
+
+    @property
+    def version(self):
+        return len(self._offsets)
+
+    def refresh(self):
+        """Incorpora las líneas completas escritas desde la última lectura."""
+        with self._lock:
+            self._refresh()
+
+    def _refresh(self):
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, "rb") as f:
+            f.seek(self._read_to)
+            data = f.read()
+        pos = 0
+        while True:
+            end = data.find(b"\n", pos)
+            if end == -1:
+                break       # línea a medio escribir: se lee la próxima vez
+            line = data[pos:end]
+            if line.strip():
+                change = json.loads(line)
+                self._offsets.append(self._read_to + pos)
+                if change["op"] == "delete":
+                    self.deleted.add(change["id"])
+            pos = end + 1
+        self._read_to += pos
+
+    def append(self, changes):
+        """
+        Anota cambios con versiones nuevas; devuelve los cambios con `v`.
+        Otros procesos (scripts de registro) anotan en el mismo log: llamar
+        con gallery_file_lock para que las versiones no se repitan.
+        """
+        if not changes:
+            return []
+        with self._lock:
+            self._refresh()     # líneas que otro proceso agregó desde la última lectura
+            out = []
+            lines = []
+            for change in changes:
+                change = dict(change, v=len(self._offsets) + len(out) + 1)
+                out.append(change)
+                lines.append(json.dumps(change, ensure_ascii=False).encode("utf-8") + b"\n")
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            with open(self.path, "ab") as f:
+                start = f.tell()
+                f.write(b"".join(lines))
+                f.flush()
+                os.fsync(f.fileno())
+            for line, change in zip(lines, out):
+                self._offsets.append(start)
+                start += len(line)
+                if change["op"] == "delete":
+                    self.deleted.add(change["id"])
+            self._read_to = start
+            return out
+
+    def since(self, version, limit=CHANGES_LIMIT):
+        """Cambios con v > `version` (hasta `limit`)."""
+        self.refresh()
+        with self._lock:
+            if version >= len(self._offsets):
+                return []
+            start = self._offsets[max(0, version)]
+            end = self._offsets[version + limit] if version + limit < len(self._offsets) else self._read_to
+        with open(self.path, "rb") as f:
+            f.seek(start)
+            data = f.read(end - start)
+        return [json.loads(line) for line in data.splitlines() if line.strip()]
+
+
+def load_node_state(path, node_id=None):
+    """{"node": id, "cursors": {par: {"node": id_par, "version": v}}}; el id se genera una vez."""
+    state = {}
+    if os.path.exists(path):
+        with open(path, "r", encoding="utf-8") as f:
+            state = json.load(f)
+    if node_id:
+        state["node"] = node_id
+    state.setdefault("node", f"{socket.gethostname()}-{uuid.uuid4().hex[:6]}")
+    state.setdefault("cursors", {})
+    return state
+
+
+def create_node_state(path, node_id=None):
+    """
+    Estado del nodo, creando el archivo si no existe. La creación es atómica
+    (link sin reemplazo): si varios procesos arrancan a la vez todos se quedan
+    con el id del primero que lo escribió.
+    """
+    if os.path.exists(path):
+        state = load_node_state(path)
+        if not node_id or state["node"] == node_id:
+            return state
+    state = load_node_state(path, node_id)
+    if node_id:
+        save_node_state(path, state)
+        return state
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(state, f, ensure_ascii=False, indent=2)
+    try:
+        os.link(tmp, path)
+    except FileExistsError:
+        state = load_node_state(path)
+    finally:
+        os.remove(tmp)
+    return state
+
+
+def save_node_state(path, state):
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(state, f, ensure_ascii=False, indent=2)
+    os.replace(tmp, path)
+
+
+class GallerySync:
+    """
+    Hilo que trae cambios de los pares cada `interval` segundos y los pasa a
+    `apply_fn(changes) -> cantidad aplicada`. Pares: URLs de la API y/o los
+    logs de los demás nodos en `shared_dir`.
+    """
+
+    def __init__(self, log, state, state_path, apply_fn, peers=(), shared_dir=None, interval=5.0,
+                 timeout=5.0):
+        self.log = log
+        self.state = state
+        self.state_path = state_path
+        self.apply_fn = apply_fn
+        self.peers = [p.rstrip("/") for p in peers if p]
+        self.shared_dir = shared_dir
+        self.interval = interval
+        self.timeout = timeout
+        self._session = requests.Session()
+        self._peer_logs = {}
+        self._stop = threading.Event()
+        self._thread = None
+        self.pulls = 0
+        self.received = 0
+        self.applied = 0
+        self.peer_status = {}
+
+    @property
+    def node(self):
+        return self.state["node"]
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.pull_all()
+            self._stop.wait(self.interval)
+
+    def _sources(self):
+        """[(clave del par, función since(v) -> (nodo, cambios))]"""
+        sources = [(url, lambda v, url=url: self._fetch_http(url, v)) for url in self.peers]
+        if self.shared_dir and os.path.isdir(self.shared_dir):
+            for name in sorted(os.listdir(self.shared_dir)):
+                node = name[:-len(".jsonl")] if name.endswith(".jsonl") else None
+                if node is None or node == self.node:
+                    continue
+                path = os.path.join(self.shared_dir, name)
+                sources.append((path, lambda v, node=node, path=path: (node, self._peer_log(path).since(v))))
+        return sources
+
+    def _fetch_http(self, url, version):
+        r = self._session.get(f"{url}/api/gallery/changes", params={"since": version, "limit": CHANGES_LIMIT},
+                              timeout=self.timeout)
+        r.raise_for_status()
+        body = r.json()
+        return body["node"], body["changes"]
+
+    def _peer_log(self, path):
+        if path not in self._peer_logs:
+            self._peer_logs[path] = ChangeLog(path)
+        return self._peer_logs[path]
+
+    def pull_all(self):
+        """Una ronda contra todos los pares; devuelve los cambios aplicados."""
+        applied = 0
+        for key, since in self._sources():
+            cursor = self.state["cursors"].get(key, {"node": None, "version": 0})
+            status = self.peer_status.setdefault(key, {})
+            try:
+                # páginas de CHANGES_LIMIT acumuladas hasta APPLY_BATCH: ponerse al día
+                # con un log largo reescribe la galería pocas veces, no una por página
+                batch, version, more = [], cursor["version"], True
+                while more:
+                    node, changes = since(version)
+                    if node != cursor["node"]:
+                        if cursor["node"] is not None:
+                            # el par es otro nodo (se reinstaló): releer su log desde el principio
+                            print(f"⚠️ Par {key}: nodo {cursor['node']} -> {node}, se relee su log")
+                            cursor = {"node": node, "version": 0}
+                            batch, version = [], 0
+                            continue
+                        cursor = {"node": node, "version": 0}
+                    if node == self.node:
+                        break   # este mismo nodo configurado como par
+                    self.pulls += 1
+                    batch.extend(changes)
+                    if changes:
+                        version = changes[-1]["v"]
+                    more = len(changes) == CHANGES_LIMIT
+                    if batch and (len(batch) >= APPLY_BATCH or not more):
+                        self.received += len(batch)
+                        n = self.apply_fn(batch)
+                        applied += n
+                        self.applied += n
+                        cursor = {"node": node, "version": version}
+                        self.state["cursors"][key] = cursor
+                        save_node_state(self.state_path, self.state)
+                        batch = []
+                status.update(node=cursor["node"], version=cursor["version"], error=None,
+                              last_ok=datetime.now().isoformat())
+            except (OSError, ValueError, KeyError, requests.RequestException) as e:
+                status["error"] = str(e)
+        return applied
+
+    def stats(self):
+        return {
+            "node": self.node,
+            "version": self.log.version,
+            "pulls": self.pulls,
+            "received": self.received,
+            "applied": self.applied,
+            "peers": self.peer_status
+        }
@@ -0,0 +1,134 @@
+# gallery_quant.py - Galería compacta (int8 / float16) con rerank exacto
+"""
+Representación compacta de la galería de encodings:
+
+- int8:    cada fila se guarda como q (int8) y una escala por fila
+           (fila ≈ escala * q). 128 bytes/fila en vez de 512.
+- float16: 256 bytes/fila.
+
+El barrido se hace sobre la versión compacta por bloques (cada bloque se
+convierte a float32 dentro de caché, nunca la matriz entera) y los
+`rerank` mejores candidatos se recalculan con la precisión completa,
+leída de `encodings.npy` mapeado en memoria (sólo se tocan esas filas).
+"""
+import numpy as np
+
+BLOCK_ROWS = 16384
+
+
+def quantize(encs: np.ndarray, mode="int8"):
+    """Devuelve (datos compactos, escalas por fila o None)."""
+    encs = np.asarray(encs, dtype=np.float32).reshape(-1, encs.shape[-1])
+    if mode == "float16":
+        return encs.astype(np.float16), None
+    if mode != "int8":
+        raise ValueError(f"Modo de galería no soportado: {mode}")
+    scales = np.abs(encs).max(axis=1) / 127.0
+    scales[scales == 0] = 1.0
+    q = np.rint(encs / scales[:, None]).astype(np.int8)
+    return q, scales.astype(np.float32)
+
+
+class QuantizedGallery:
+    """Galería compacta con búsqueda aproximada + rerank exacto."""
+
+    def __init__(self, full: np.ndarray, mode="int8", rerank=16):
+        # `full` suele ser np.load(..., mmap_mode="r"): no se copia a RAM
+        self.mode = mode
+        self.rerank = rerank
+        self._full = full
+        self._tail = np.zeros((0, full.shape[1]), dtype=np.float32)  # altas posteriores
+        self._data, self._scales = self._quantize_blocks(full)
+        self._sq_norms = self._compute_sq_norms(self._data, self._scales)
+
+    @property
+    def ntotal(self):
+        return len(self._data)
+
+    def nbytes(self):
+        """Memoria residente de la versión compacta."""
+        extra = self._scales.nbytes if self._scales is not None else 0
+        return self._data.nbytes + extra + self._sq_norms.nbytes + self._tail.nbytes
+
+    def _quantize_blocks(self, full):
+        parts, scales = [], []
+        for s in range(0, len(full), BLOCK_ROWS):
+            q, sc = quantize(np.asarray(full[s:s + BLOCK_ROWS]), self.mode)
+            parts.append(q)
+            if sc is not None:
+                scales.append(sc)
+        dtype = np.int8 if self.mode == "int8" else np.float16
+        data = np.concatenate(parts) if parts else np.zeros((0, full.shape[1]), dtype=dtype)
+        if self.mode != "int8":
+            return data, None
+        return data, (np.concatenate(scales) if scales else np.zeros(0, dtype=np.float32))
+
+    @staticmethod
+    def _block_f32(data, scales, s, e):
+        block = data[s:e].astype(np.float32)
+        if scales is not None:
+            block *= scales[s:e, None]
+        return block
+
+    def _compute_sq_norms(self, data, scales):
+        out = np.empty(len(data), dtype=np.float32)
+        for s in range(0, len(data), BLOCK_ROWS):
+            block = self._block_f32(data, scales, s, s + BLOCK_ROWS)
+            out[s:s + BLOCK_ROWS] = (block * block).sum(1)
+        return out
+
+    def add(self, encs: np.ndarray, ids=None):
+        """Inserción incremental (registro); la precisión completa queda en RAM."""
+        encs = np.asarray(encs, dtype=np.float32).reshape(-1, self._data.shape[1])
+        q, sc = quantize(encs, self.mode)
+        self._data = np.concatenate([self._data, q])
+        if sc is not None:
+            self._scales = np.concatenate([self._scales, sc])
+        self._sq_norms = np.concatenate([self._sq_norms, self._compute_sq_norms(q, sc)])
+        self._tail = np.vstack([self._tail, encs])
+
+    def _full_rows(self, ids):
+        n_mm = len(self._full)
+        rows = np.empty((len(ids), self._data.shape[1]), dtype=np.float32)
+        in_mm = ids < n_mm
+        if in_mm.any():
+            # np.sort: lectura secuencial de las páginas del mmap
+            order = np.argsort(ids[in_mm])
+            rows_mm = np.asarray(self._full[ids[in_mm][order]], dtype=np.float32)
+            rows[np.nonzero(in_mm)[0][order]] = rows_mm
+        if (~in_mm).any():
+            rows[~in_mm] = self._tail[ids[~in_mm] - n_mm]
+        return rows
+
+    def candidates(self, query: np.ndarray, k):
+        """Ids de los k mejores según la versión compacta (sin ordenar)."""
+        q = np.asarray(query, dtype=np.float32).ravel()
+        approx = np.empty(self.ntotal, dtype=np.float32)
+        for s in range(0, self.ntotal, BLOCK_ROWS):
+            e = s + BLOCK_ROWS
+            block = self._data[s:e].astype(np.float32)
+            dots = block @ q
+            if self._scales is not None:
+                dots *= self._scales[s:e]
+            approx[s:e] = self._sq_norms[s:e] - 2.0 * dots
+        k = min(k, self.ntotal)
+        if k >= self.ntotal:
+            return np.arange(self.ntotal)
+        return np.argpartition(approx, k - 1)[:k]
+
+    def search_k(self, query: np.ndarray, k):
+        """Los k mejores tras el rerank exacto -> (ids, distancias) ordenados."""
+        if self.ntotal == 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        q = np.asarray(query, dtype=np.float32).ravel()
+        cand = self.candidates(q, max(self.rerank, k))
+        dists = np.linalg.norm(self._full_rows(cand) - q, axis=1)
+        order = np.argsort(dists)[:k]
+        return cand[order], dists[order]
+
+    def search(self, query: np.ndarray):
+        """Devuelve (id, distancia exacta) del vecino más cercano."""
+        if self.ntotal == 0:
+            return -1, float("inf")
+        ids, dists = self.search_k(query, 1)
+        return int(ids[0]), float(dists[0])
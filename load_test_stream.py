@@ -0,0 +1,215 @@
+#!/usr/bin/env python3
+"""
+Prueba de carga de /video_feed: servidor con hilos de Flask vs servidor
+asyncio (stream_server.py) con N visores concurrentes.
+
+Levanta `app.py` como subproceso con FLASK_PORT y ASYNC_STREAM_PORT
+apuntando a una cámara MJPEG sintética local (o a `--source`), conecta
+`--clients` visores a cada modo durante `--duration` segundos y reporta:
+
+  fps/cliente   media y percentil 5 (los visores más lentos)
+  gap p95       percentil 95 del tiempo entre frames recibidos (ms)
+  cpu           % de CPU del proceso servidor durante la prueba
+  ms cpu/frame  CPU del servidor por frame entregado
+  hilos         máximo de hilos del servidor (/proc)
+
+Uso:
+    python load_test_stream.py --clients 50 --duration 15
+    python load_test_stream.py --clients 200 --modes async --source http://192.168.1.50:81/stream
+"""
+import os
+import sys
+import time
+import socket
+import asyncio
+import argparse
+import threading
+import subprocess
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import cv2
+import numpy as np
+
+BOUNDARY = b"--frame"
+
+
+def synthetic_camera(port, fps, width, height):
+    """Cámara MJPEG falsa en 127.0.0.1:port con un gradiente que se desplaza."""
+    base = np.tile(np.linspace(0, 255, width, dtype=np.uint8), (height, 1))
+    frames = []
+    for i in range(30):
+        img = np.dstack([np.roll(base, i * 8, axis=1), base, np.full_like(base, i * 8)])
+        frames.append(cv2.imencode('.jpg', img, [cv2.IMWRITE_JPEG_QUALITY, 80])[1].tobytes())
+
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def do_GET(self):
+            self.send_response(200)
+            self.send_header('Content-Type', 'multipart/x-mixed-replace; boundary=frame')
+            self.end_headers()
+            i = 0
+            try:
+                while True:
+                    jpg = frames[i % len(frames)]
+                    self.wfile.write(b"--frame\r\nContent-Type: image/jpeg\r\nContent-Length: %d\r\n\r\n"
+                                     % len(jpg) + jpg + b"\r\n")
+                    i += 1
+                    time.sleep(1.0 / fps)
+            except (ConnectionError, OSError):
+                pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", port), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def wait_port(port, timeout=60):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=1).close()
+            return True
+        except OSError:
+            time.sleep(0.3)
+    return False
+
+
+def proc_cpu_seconds(pid):
+    with open(f"/proc/{pid}/stat") as f:
+        fields = f.read().rsplit(")", 1)[1].split()
+    return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+
+
+def proc_threads(pid):
+    with open(f"/proc/{pid}/status") as f:
+        for line in f:
+            if line.startswith("Threads:"):
+                return int(line.split()[1])
+    return 0
+
+
+async def viewer(port, path, stop_at, gaps):
+    """Cuenta partes MJPEG recibidas; guarda los intervalos entre frames."""
+    try:
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    except OSError:
+        return 0
+    writer.write(f"GET {path} HTTP/1.1\r\nHost: localhost\r\n\r\n".encode())
+    frames, tail, last = 0, b"", None
+    try:
+        while time.time() < stop_at:
+            try:
+                chunk = await asyncio.wait_for(reader.read(65536), timeout=max(0.1, stop_at - time.time()))
+            except asyncio.TimeoutError:
+                break
+            if not chunk:
+                break
+            data = tail + chunk
+            n = data.count(BOUNDARY)
+            if n:
+                now = time.perf_counter()
+                if last is not None:
+                    gaps.append(now - last)
+                last = now
+                frames += n
+            tail = data[-len(BOUNDARY):]
+    finally:
+        writer.close()
+    return max(0, frames - 1)      # la primera parte llega con el retraso de conexión
+
+
+async def run_viewers(port, path, clients, duration):
+    gaps = []
+    stop_at = time.time() + duration
+    counts = await asyncio.gather(*(viewer(port, path, stop_at, gaps) for _ in range(clients)))
+    return counts, gaps
+
+
+def measure(name, pid, port, path, clients, duration):
+    peak = [proc_threads(pid)]
+    done = threading.Event()
+
+    def sample():
+        while not done.wait(0.5):
+            peak[0] = max(peak[0], proc_threads(pid))
+
+    threading.Thread(target=sample, daemon=True).start()
+    cpu0, t0 = proc_cpu_seconds(pid), time.time()
+    counts, gaps = asyncio.run(run_viewers(port, path, clients, duration))
+    cpu, elapsed = proc_cpu_seconds(pid) - cpu0, time.time() - t0
+    done.set()
+    fps = np.asarray(counts) / duration
+    delivered = max(1, int(np.sum(counts)))
+    return {
+        "mode": name,
+        "fps_mean": float(fps.mean()),
+        "fps_p5": float(np.percentile(fps, 5)),
+        "gap_p95_ms": float(np.percentile(gaps, 95) * 1000) if gaps else float("nan"),
+        "cpu_pct": 100 * cpu / elapsed,
+        "cpu_ms_per_frame": 1000 * cpu / delivered,
+        "threads": peak[0],
+        "connected": int(np.count_nonzero(counts)),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--clients', type=int, default=50)
+    parser.add_argument('--duration', type=float, default=15)
+    parser.add_argument('--modes', default="threaded,async")
+    parser.add_argument('--path', default="/video_feed")
+    parser.add_argument('--source', default=None, help="URL MJPEG real; por defecto una cámara sintética local")
+    parser.add_argument('--fps', type=float, default=15, help="fps de la cámara sintética")
+    parser.add_argument('--size', default="640x480", help="resolución de la cámara sintética")
+    args = parser.parse_args()
+
+    source = args.source
+    if source is None:
+        w, h = (int(v) for v in args.size.split("x"))
+        cam_port = free_port()
+        synthetic_camera(cam_port, args.fps, w, h)
+        source = f"http://127.0.0.1:{cam_port}/stream"
+    flask_port, async_port = free_port(), free_port()
+    env = dict(os.environ, FLASK_PORT=str(flask_port), ASYNC_STREAM_PORT=str(async_port),
+               ENGINE_MODE="inline")
+    server = subprocess.Popen([sys.executable, "app.py"], env=env,
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        if not (wait_port(flask_port) and wait_port(async_port)):
+            raise SystemExit("El servidor no levantó")
+        # la URL del stream se configura igual que desde el dashboard
+        req = urllib.request.Request(f"http://127.0.0.1:{flask_port}/api/config", method="PUT",
+                                     data=f'{{"stream_url": "{source}"}}'.encode(),
+                                     headers={"Content-Type": "application/json"})
+        urllib.request.urlopen(req, timeout=10).read()
+
+        print(f"{args.clients} visores x {args.duration:.0f}s en {args.path}, fuente {source}, "
+              f"{os.cpu_count()} CPUs")
+        print(f"{'modo':<10} {'fps/cli':>8} {'fps p5':>7} {'gap p95':>8} {'cpu %':>6} "
+              f"{'ms cpu/frame':>13} {'hilos':>6} {'conectados':>11}")
+        ports = {"threaded": flask_port, "async": async_port}
+        for mode in args.modes.split(","):
+            # precalentar la conexión a la cámara y dejar que se cierren las anteriores
+            asyncio.run(run_viewers(ports[mode], args.path, 1, 2))
+            time.sleep(1)
+            r = measure(mode, server.pid, ports[mode], args.path, args.clients, args.duration)
+            print(f"{r['mode']:<10} {r['fps_mean']:>8.1f} {r['fps_p5']:>7.1f} {r['gap_p95_ms']:>8.0f} "
+                  f"{r['cpu_pct']:>6.0f} {r['cpu_ms_per_frame']:>13.2f} {r['threads']:>6} "
+                  f"{r['connected']:>11}")
+            time.sleep(2)
+    finally:
+        server.terminate()
+        server.wait(timeout=10)
+
+
+if __name__ == '__main__':
+    main()
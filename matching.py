@@ -0,0 +1,183 @@
+# matching.py - Top-k por identidad con margen de ambigüedad
+"""
+Matcher vectorizado: todas las caras de un frame contra toda la galería en
+una sola pasada, deduplicando filas por identidad (varias muestras de la
+misma persona cuentan como un solo candidato) y usando argpartition en vez
+de ordenar la galería completa.
+"""
+import numpy as np
+
+UNKNOWN = "Desconocido"
+
+
+class GalleryMatcher:
+    """
+    Precalcula el agrupamiento por identidad de una galería (N,128).
+
+    `append()` agrega filas sin rehacer el agrupamiento: las filas nuevas van
+    al final como tramos propios (una identidad puede quedar en varios tramos
+    y se reduce en dos pasos) y se escriben en un buffer con capacidad de
+    sobra compartido con el matcher anterior, que sigue viendo sólo sus filas.
+    """
+
+    def __init__(self, known_encs: np.ndarray, labels: list, copy=True):
+        encs = np.asarray(known_encs, dtype=np.float32)
+        if encs.ndim == 1:
+            encs = encs.reshape(1, -1)
+        names, codes = np.unique(np.asarray(labels, dtype=object).astype(str), return_inverse=True)
+        codes = codes.reshape(-1)
+        self.identities = list(names)
+        self._index = {name: i for i, name in enumerate(self.identities)}
+        if copy:
+            # filas reordenadas para que cada identidad sea un tramo contiguo
+            perm = np.argsort(codes, kind="stable")
+            self.encs = np.ascontiguousarray(encs[perm])
+            seg_ids = np.arange(len(names))
+            seg_starts = np.searchsorted(codes[perm], seg_ids)
+        else:
+            # filas en el orden recibido (p.ej. un rango de encodings.npy mapeado en memoria,
+            # sin copia privada): un tramo por cada racha de filas de la misma identidad
+            self.encs = encs
+            seg_starts = np.flatnonzero(np.diff(codes, prepend=-1)) if len(codes) else np.zeros(0, dtype=np.int64)
+            seg_ids = codes[seg_starts]
+        self.sq_norms = np.einsum("ij,ij->i", self.encs, self.encs)
+        self._store = {"encs": self.encs, "sq": self.sq_norms, "used": len(self.encs)}
+        self._set_segments(seg_ids, seg_starts)
+
+    def _set_segments(self, seg_ids, seg_starts):
+        """Tramos de filas contiguas (inicio, identidad); si no es un tramo por identidad en orden se reduce dos veces."""
+        self.seg_ids = seg_ids
+        self.seg_starts = seg_starts
+        if len(seg_ids) == len(self.identities) and np.array_equal(seg_ids, np.arange(len(seg_ids))):
+            self.seg_order = None
+        else:
+            self.seg_order = np.argsort(seg_ids, kind="stable")
+            self.id_seg_starts = np.searchsorted(seg_ids[self.seg_order], np.arange(len(self.identities)))
+
+    def __len__(self):
+        return len(self.encs)
+
+    def identity_distances(self, unknown_encs: np.ndarray):
+        """Distancia mínima de cada cara (F) a cada identidad -> (F, n_ids)."""
+        q = np.asarray(unknown_encs, dtype=np.float32).reshape(-1, self.encs.shape[1])
+        d = (q * q).sum(1)[:, None] - 2.0 * (q @ self.encs.T) + self.sq_norms[None, :]
+        np.maximum(d, 0, out=d)
+        per_id = np.minimum.reduceat(d, self.seg_starts, axis=1)
+        if self.seg_order is not None:
+            per_id = np.minimum.reduceat(per_id[:, self.seg_order], self.id_seg_starts, axis=1)
+        return np.sqrt(per_id)
+
+    def row_labels(self):
+        """Etiqueta de cada fila en el orden interno."""
+        lengths = np.diff(np.append(self.seg_starts, len(self.encs)))
+        return [self.identities[i] for i, n in zip(self.seg_ids, lengths) for _ in range(n)]
+
+    def append(self, new_encs: np.ndarray, new_labels: list):
+        """Matcher nuevo con las filas agregadas (este no cambia); O(filas nuevas) amortizado."""
+        rows = np.asarray(new_encs, dtype=np.float32).reshape(-1, self.encs.shape[1])
+        if len(rows) == 0:
+            return self
+        n, m = len(self.encs), len(rows)
+        if len(self.seg_starts) + m > 2 * len(self.identities) + 64 and len(self.seg_starts) > len(self.identities):
+            # demasiado fragmentado: reagrupar todo
+            return GalleryMatcher(np.vstack([self.encs, rows]), self.row_labels() + list(new_labels))
+        names, codes = np.unique(np.asarray(new_labels, dtype=object).astype(str), return_inverse=True)
+        perm = np.argsort(codes, kind="stable")
+        rows = rows[perm]
+
+        store = self._store
+        if store["used"] != n or len(store["encs"]) < n + m:
+            # otro matcher ya escribió después de nuestras filas, o no hay lugar: buffer nuevo
+            cap = max(2 * (n + m), 1024)
+            buf = np.empty((cap, self.encs.shape[1]), dtype=np.float32)
+            sq = np.empty(cap, dtype=np.float32)
+            buf[:n], sq[:n] = self.encs, self.sq_norms
+            store = {"encs": buf, "sq": sq, "used": n}
+        store["encs"][n:n + m] = rows
+        store["sq"][n:n + m] = (rows * rows).sum(1)
+        store["used"] = n + m
+
+        out = GalleryMatcher.__new__(GalleryMatcher)
+        out.identities = list(self.identities)
+        out._index = dict(self._index)
+        for name in names:
+            if name not in out._index:
+                out._index[name] = len(out.identities)
+                out.identities.append(name)
+        out.encs = store["encs"][:n + m]
+        out.sq_norms = store["sq"][:n + m]
+        out._store = store
+        new_starts = n + np.searchsorted(codes[perm], np.arange(len(names)))
+        out._set_segments(np.concatenate([self.seg_ids, [out._index[name] for name in names]]).astype(np.int64),
+                          np.concatenate([self.seg_starts, new_starts]).astype(np.int64))
+        return out
+
+    def top_k(self, unknown_encs: np.ndarray, k=3):
+        """
+        Para cada cara devuelve (candidatos, margen):
+          candidatos = [(nombre, distancia), ...] ordenados, hasta k identidades
+          margen = distancia(2ª identidad) - distancia(1ª) o None si hay una sola
+        """
+        if len(self.encs) == 0:
+            return [([], None) for _ in range(len(np.atleast_2d(unknown_encs)))]
+        dists = self.identity_distances(unknown_encs)
+        n_ids = dists.shape[1]
+        kk = min(max(k, 2), n_ids)   # al menos 2 para calcular el margen
+        if kk < n_ids:
+            part = np.argpartition(dists, kk - 1, axis=1)[:, :kk]
+        else:
+            part = np.broadcast_to(np.arange(n_ids), dists.shape)
+        part_d = np.take_along_axis(dists, part, axis=1)
+        order = np.argsort(part_d, axis=1)
+        top_ids = np.take_along_axis(part, order, axis=1)
+        top_d = np.take_along_axis(part_d, order, axis=1)
+
+        out = []
+        for ids_row, d_row in zip(top_ids, top_d):
+            cands = [(self.identities[i], float(d)) for i, d in zip(ids_row[:k], d_row[:k])]
+            margin = float(d_row[1] - d_row[0]) if len(d_row) > 1 else None
+            out.append((cands, margin))
+        return out
+
+
+def identity_candidates(ids, dists, labels, k=3):
+    """
+    (candidatos, margen) como GalleryMatcher.top_k a partir de filas vecinas
+    ya ordenadas (índice IVF o compacto): la mejor distancia de cada identidad
+    entre esas filas. Si todas son de la misma identidad el margen es None.
+    """
+    best = {}
+    for i, d in zip(ids, dists):
+        if i >= 0:
+            best.setdefault(labels[int(i)], float(d))
+    ranked = list(best.items())      # las filas ya vienen ordenadas por distancia
+    margin = ranked[1][1] - ranked[0][1] if len(ranked) > 1 else None
+    return ranked[:k], margin
+
+
+def describe_match(candidates, margin, thr, ambiguity_margin, thresholds=None, allow_raise=False, partial=False):
+    """
+    Campos de resultado (name, distance, candidates, margin, ambiguous, partial).
+    `partial`: la galería no se consultó completa (shard caído); el match se
+    marca ambiguo porque la identidad correcta pudo no estar entre los candidatos.
+    `thresholds`: umbral propio por identidad (gallery_analytics.py); sólo se
+    consulta para el mejor candidato, el barrido no cambia. Sin `allow_raise`
+    sólo puede hacer el match más estricto que `thr`.
+    """
+    if not candidates:
+        return {"name": UNKNOWN, "distance": 1.0, "candidates": [], "margin": None, "ambiguous": False,
+                "partial": partial}
+    best_name, best_dist = candidates[0]
+    if thresholds:
+        own = thresholds.get(best_name, thr)
+        thr = own if allow_raise else min(thr, own)
+    name = best_name if best_dist <= thr else UNKNOWN
+    return {
+        "name": name,
+        "distance": best_dist,
+        "candidates": [{"name": n, "distance": round(d, 3)} for n, d in candidates],
+        "margin": round(margin, 3) if margin is not None else None,
+        # sólo es ambiguo si hubo match y la 2ª identidad está demasiado cerca o faltó parte de la galería
+        "ambiguous": name != UNKNOWN and (partial or (margin is not None and margin < ambiguity_margin)),
+        "partial": partial,
+    }
@@ -0,0 +1,173 @@
+# mjpeg_variants.py - Variantes de /video_feed (fps, ancho, calidad) con codificación compartida
+"""
+Cada visor de /video_feed puede pedir `?fps=&width=&quality=`. Los parámetros
+se normalizan (ancho en múltiplos de SNAPSHOT_WIDTH_STEP, calidad y fps
+acotados) para que visores parecidos caigan en la misma variante.
+
+Por variante:
+- el frame se reduce y codifica como máximo una vez por frame de origen, y
+  el mismo JPEG se entrega a todos sus visores;
+- el fps se respeta a nivel de variante: un frame de origen que llega antes
+  de 1/fps desde la última emisión se descarta (para todos sus visores, así
+  que siguen compartiendo el mismo JPEG);
+- se cuentan frames y bytes enviados para reportar el ancho de banda.
+
+Las variantes se cuentan por suscriptor y se eliminan (con su JPEG en
+caché) cuando se va el último.
+"""
+import time
+import threading
+from collections import deque
+import cv2
+
+from frame_hub import SNAPSHOT_WIDTH_STEP
+
+DEFAULT_QUALITY = 95        # el default de cv2.imencode: lo que se enviaba antes
+MIN_QUALITY, MAX_QUALITY = 10, 95
+MIN_WIDTH = 64
+MAX_FPS = 30.0
+RATE_WINDOW = 10            # segundos para el ancho de banda reportado
+
+
+def variant_key(width=None, quality=None, fps=None):
+    """(ancho o None, calidad, fps o None) normalizados desde los query params."""
+    if width:
+        width = max(MIN_WIDTH, int(round(width / SNAPSHOT_WIDTH_STEP)) * SNAPSHOT_WIDTH_STEP)
+    quality = min(MAX_QUALITY, max(MIN_QUALITY, int(quality))) if quality else DEFAULT_QUALITY
+    if fps:
+        fps = round(min(MAX_FPS, max(0.1, float(fps))), 1)
+    return (width or None, quality, fps or None)
+
+
+def parse_variant(args):
+    """Clave de variante desde query params (str); valores inválidos se ignoran."""
+    def num(name, cast):
+        try:
+            return cast(args.get(name)) if args.get(name) else None
+        except ValueError:
+            return None
+    return variant_key(num("width", int), num("quality", int), num("fps", float))
+
+
+def variant_name(key):
+    width, quality, fps = key
+    return f"{f'w{width}' if width else 'full'}-q{quality}-{fps or 'all'}fps"
+
+
+class Variant:
+    def __init__(self, key):
+        self.width, self.quality, self.fps = key
+        self.lock = threading.Lock()
+        self.subscribers = 0
+        self.source = None          # frame de origen del JPEG en caché
+        self.dropped_source = None  # último frame descartado por fps (se cuenta una vez)
+        self.jpeg = None
+        self.emitted_at = 0.0
+        self.encodes = 0
+        self.skipped = 0
+        self.frames_sent = 0
+        self.bytes_sent = 0
+        self._buckets = deque()     # [segundo, bytes]
+
+    def encode(self, frame):
+        img = frame
+        if self.width and self.width < frame.shape[1]:
+            height = max(1, int(frame.shape[0] * self.width / frame.shape[1]))
+            img = cv2.resize(frame, (self.width, height), interpolation=cv2.INTER_AREA)
+        ok, buf = cv2.imencode('.jpg', img, [cv2.IMWRITE_JPEG_QUALITY, self.quality])
+        return buf.tobytes() if ok else None
+
+    def rate(self, now):
+        """Bytes/s de los últimos RATE_WINDOW segundos completos."""
+        second = int(now)
+        total = sum(b for s, b in self._buckets if second - RATE_WINDOW <= s < second)
+        return total / RATE_WINDOW
+
+
+class VariantCache:
+    """Variantes activas de un feed MJPEG (una instancia por fuente)."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._variants = {}
+        self.evicted = 0
+
+    def subscribe(self, key):
+        with self._lock:
+            variant = self._variants.get(key)
+            if variant is None:
+                variant = self._variants[key] = Variant(key)
+            variant.subscribers += 1
+            return variant
+
+    def unsubscribe(self, key):
+        with self._lock:
+            variant = self._variants.get(key)
+            if variant is None:
+                return
+            variant.subscribers -= 1
+            if variant.subscribers <= 0:
+                # último visor: se libera la variante y su JPEG
+                del self._variants[key]
+                self.evicted += 1
+
+    def active(self):
+        with self._lock:
+            return list(self._variants.items())
+
+    def jpeg(self, key, frame, now=None):
+        """
+        JPEG de `frame` para la variante, o None si el frame se descarta por fps.
+        Los frames de origen son compartidos y no se mutan: se reconocen por identidad.
+        """
+        with self._lock:
+            variant = self._variants.get(key)
+        if variant is None:
+            return None
+        now = time.time() if now is None else now
+        with variant.lock:
+            if frame is variant.source:
+                return variant.jpeg
+            if variant.fps and now - variant.emitted_at < 1.0 / variant.fps:
+                if frame is not variant.dropped_source:
+                    variant.dropped_source = frame
+                    variant.skipped += 1
+                return None
+            jpeg = variant.encode(frame)
+            if jpeg is None:
+                return None
+            variant.source, variant.jpeg, variant.emitted_at = frame, jpeg, now
+            variant.encodes += 1
+            return jpeg
+
+    def sent(self, key, nbytes, now=None):
+        """Registra un envío a un visor (para frames y bytes por variante)."""
+        with self._lock:
+            variant = self._variants.get(key)
+        if variant is None:
+            return
+        second = int(time.time() if now is None else now)
+        with variant.lock:
+            variant.frames_sent += 1
+            variant.bytes_sent += nbytes
+            if variant._buckets and variant._buckets[-1][0] == second:
+                variant._buckets[-1][1] += nbytes
+            else:
+                variant._buckets.append([second, nbytes])
+                while variant._buckets[0][0] < second - RATE_WINDOW:
+                    variant._buckets.popleft()
+
+    def stats(self):
+        now = time.time()
+        variants = {}
+        for key, v in self.active():
+            variants[variant_name(key)] = {
+                "subscribers": v.subscribers,
+                "encodes": v.encodes,
+                "skipped_for_fps": v.skipped,
+                "frames_sent": v.frames_sent,
+                "bytes_sent": v.bytes_sent,
+                "kbps": round(v.rate(now) * 8 / 1000, 1),
+                "avg_frame_kb": round(v.bytes_sent / v.frames_sent / 1024, 1) if v.frames_sent else None
+            }
+        return {"variants": variants, "evicted": self.evicted}
@@ -6,11 +6,13 @@ os.environ["OPENCV_VIDEOIO_PRIORITY_MSMF"] = "0"   # preferir FFmpeg sobre MSMF
 import cv2
 import json
 import time
-import urllib.request
 import numpy as np
-import face_recognition
 from pathlib import Path
-from urllib.parse import urlparse, urlunparse
+
+# Escalera FFmpeg -> ?dummy=1 -> :81 -> MJPEG manual, con reconexión automática
+from stream_manager import open_stream
+from detectors import make_detector
+from encoders import encoder_for, check_compatible
 
 # === Fuente de video ===
 # STREAM_URL = "http://192.168.107.116/stream"     # ejemplo
@@ -25,84 +27,9 @@ THRESHOLD = 0.6
 
 # Para acelerar
 DOWNSCALE = 0.5
+DETECTOR = make_detector(os.getenv("DETECTOR", "hog"))  # hog, haar, haar+hog, dnn:path=... (detectors.py)
+ENCODER = encoder_for("live")   # ENCODER_LIVE: large | small, :jitters=N (encoders.py)
 
-# ---------- PARCHE: lector MJPEG manual como fallback -----------
-def mjpeg_frames(url, chunk_size=1024, timeout=5):
-    req = urllib.request.urlopen(url, timeout=timeout)
-    buf = b""
-    while True:
-        chunk = req.read(chunk_size)
-        if not chunk:
-            break
-        buf += chunk
-        a = buf.find(b"\xff\xd8")   # inicio JPEG
-        b = buf.find(b"\xff\xd9")   # fin JPEG
-        if a != -1 and b != -1 and b > a:
-            jpg = buf[a:b+2]
-            buf = buf[b+2:]
-            frame = cv2.imdecode(np.frombuffer(jpg, np.uint8), cv2.IMREAD_COLOR)
-            if frame is not None:
-                yield frame
-
-class StreamWrapper:
-    """Imita cap.read() de OpenCV usando el generador MJPEG."""
-    def __init__(self, url):
-        self._gen = mjpeg_frames(url)
-    def read(self):
-        try:
-            frame = next(self._gen)
-            return True, frame
-        except StopIteration:
-            return False, None
-
-def open_stream_with_fallback(url):
-    """
-    Intenta abrir el stream en este orden:
-      1) OpenCV+FFmpeg con URL tal cual
-      2) OpenCV+FFmpeg con ?dummy=1
-      3) OpenCV+FFmpeg probando puerto :81 si no estaba
-      4) Lector MJPEG manual (StreamWrapper)
-    Devuelve (cap, usado_wrapper: bool)
-    """
-    print(f"Intentando abrir stream con FFmpeg: {url}")
-    cap = cv2.VideoCapture(url, cv2.CAP_FFMPEG)
-
-    def _is_open(c): return hasattr(c, "isOpened") and c.isOpened()
-
-    if not _is_open(cap):
-        alt = url + ("&dummy=1" if "?" in url else "?dummy=1")
-        print(f"Reintentando con dummy param: {alt}")
-        cap = cv2.VideoCapture(alt, cv2.CAP_FFMPEG)
-
-    # Si la URL no especifica puerto, prueba con :81 (típico en CameraWebServer)
-    if not _is_open(cap):
-        try:
-            pr = urlparse(url)
-            host_has_port = (":" in pr.netloc.split("@")[-1])
-            if not host_has_port:
-                netloc = pr.netloc + ":81"
-                url81 = urlunparse((pr.scheme, netloc, pr.path, pr.params, pr.query, pr.fragment))
-                print(f"Reintentando en puerto :81 -> {url81}")
-                cap = cv2.VideoCapture(url81, cv2.CAP_FFMPEG)
-                if not _is_open(cap):
-                    alt81 = url81 + ("&dummy=1" if "?" in url81 else "?dummy=1")
-                    print(f"Reintentando :81 con dummy -> {alt81}")
-                    cap = cv2.VideoCapture(alt81, cv2.CAP_FFMPEG)
-        except Exception:
-            pass
-
-    if not _is_open(cap):
-        print("⚠️ OpenCV no abrió el stream. Activando lector MJPEG manual…")
-        return StreamWrapper(url), True
-
-    ok, test_frame = cap.read()
-    if not ok or test_frame is None:
-        print("⚠️ OpenCV abrió pero no llega ningún frame. Usando lector MJPEG manual…")
-        return StreamWrapper(url), True
-
-    print("✅ Stream inicializado con OpenCV+FFmpeg")
-    return cap, False
-# ---------------------------------------------------------------
 
 def load_encodings():
     if not Path(ENCODINGS_NPY).exists() or not Path(LABELS_JSON).exists():
@@ -130,9 +57,10 @@ def best_match(unknown_enc: np.ndarray, known_encs: np.ndarray, labels: list, th
 
 def main():
     known_encs, labels = load_encodings()
+    check_compatible(ENCODER.model)   # la galería debe usar el mismo modelo de landmarks
     print(f"✅ Encodings cargados: {len(labels)} personas")
 
-    cap, used_wrapper = open_stream_with_fallback(STREAM_URL)
+    cap = open_stream(STREAM_URL)
 
     fps_smooth = None
     t0 = time.time()
@@ -140,16 +68,18 @@ def main():
     while True:
         ok, frame = cap.read()
         if not ok or frame is None:
-            print("⚠️ Frame no válido; saliendo…")
-            break
+            print("⚠️ Sin frames; esperando reconexión…")
+            if cv2.waitKey(1) & 0xFF == 27:  # ESC para salir
+                break
+            continue
 
         # Redimensionar para acelerar
         small = cv2.resize(frame, (0, 0), fx=DOWNSCALE, fy=DOWNSCALE)
         rgb_small = cv2.cvtColor(small, cv2.COLOR_BGR2RGB)
 
         # Detectar y encodear
-        boxes = face_recognition.face_locations(rgb_small, model="hog")
-        encs = face_recognition.face_encodings(rgb_small, boxes)
+        boxes = DETECTOR.detect(rgb_small)
+        encs = ENCODER.encode(rgb_small, boxes)
 
         # Escalar cajas a tamaño original
         boxes_scaled = []
@@ -183,8 +113,7 @@ def main():
         if cv2.waitKey(1) & 0xFF == 27:  # ESC para salir
             break
 
-    if hasattr(cap, "release"):
-        cap.release()
+    cap.release()
     cv2.destroyAllWindows()
 
 if __name__ == "__main__":
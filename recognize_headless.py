@@ -3,6 +3,7 @@
 Recognize a face from an image (base64) against stored encodings.
 Uses face_recognition library. Returns JSON with result.
 """
+import os
 import sys
 import json
 import base64
@@ -10,10 +11,14 @@ import numpy as np
 from pathlib import Path
 from io import BytesIO
 import cv2
+from matching import GalleryMatcher, describe_match, UNKNOWN
+from embedding_cache import EmbeddingCache
+from gallery_files import ENCODINGS_NPY, LABELS_JSON
 
-# Try importing face_recognition; if not available, show helpful error
+# detectors/encoders need face_recognition; if not available, show helpful error
 try:
-    import face_recognition
+    from detectors import make_detector
+    from encoders import encoder_for, check_compatible
 except ImportError as e:
     print(json.dumps({
         "ok": False,
@@ -22,9 +27,17 @@ except ImportError as e:
     }))
     sys.exit(1)
 
-ENCODINGS_NPY = "encodings.npy"
-LABELS_JSON = "labels.json"
 THRESHOLD = 0.6
+TOP_K = 3
+AMBIGUITY_MARGIN = float(os.getenv('AMBIGUITY_MARGIN', 0.05))
+DETECTOR_SPEC = os.getenv('DETECTOR', 'hog')   # ver detectors.py
+ENCODER = encoder_for('headless')               # ENCODER_HEADLESS, ver encoders.py
+
+# Caché en disco de cajas + encodings por hash de la imagen: la misma captura
+# enviada varias veces (reintento, confirmación, auditoría) no se vuelve a
+# detectar/encodear. El matching contra la galería se rehace siempre.
+CACHE_DIR = os.getenv('EMBEDDING_CACHE_DIR', '.embedding_cache')
+CACHE_MAX = int(os.getenv('EMBEDDING_CACHE_SIZE', 256))
 
 def load_encodings():
     if not Path(ENCODINGS_NPY).exists() or not Path(LABELS_JSON).exists():
@@ -45,39 +58,35 @@ def load_encodings():
     
     return encs, labels
 
-def best_match(unknown_enc: np.ndarray, known_encs: np.ndarray, labels: list, thr=THRESHOLD):
-    """Return (name, distance) or (None, 1.0) if no match."""
-    if len(known_encs) == 0:
-        return None, 1.0
-    dists = np.linalg.norm(known_encs - unknown_enc.astype(np.float32), axis=1)
-    idx = int(np.argmin(dists))
-    name = labels[idx]
-    dist = float(dists[idx])
-    if dist <= thr:
-        return name, dist
-    return None, dist
-
 def recognize_from_base64(image_base64: str):
     """Decode base64 image and recognize face."""
     try:
         # Decode base64
         img_data = base64.b64decode(image_base64.split(',')[1] if ',' in image_base64 else image_base64)
-        nparr = np.frombuffer(img_data, np.uint8)
-        img = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
         
-        if img is None:
-            return {"ok": False, "message": "Could not decode image", "recognized": False}
+        def decode(raw):
+            return cv2.imdecode(np.frombuffer(raw, np.uint8), cv2.IMREAD_COLOR)
+        
+        def detect_and_encode(img):
+            # Convert BGR to RGB, detect faces and encode them
+            img_rgb = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+            boxes = make_detector(DETECTOR_SPEC).detect(img_rgb)
+            return boxes, ENCODER.encode(img_rgb, boxes)
         
-        # Convert BGR to RGB
-        img_rgb = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+        if CACHE_MAX > 0:
+            cache = EmbeddingCache(CACHE_MAX, path=CACHE_DIR)
+            boxes, encs, img, cached = cache.lookup(img_data, decode, detect_and_encode, params=f"{DETECTOR_SPEC}|{ENCODER.spec}")
+        else:
+            img = decode(img_data)
+            boxes, encs = detect_and_encode(img) if img is not None else (None, None)
+            cached = False
+        
+        if boxes is None:
+            return {"ok": False, "message": "Could not decode image", "recognized": False}
         
-        # Detect faces
-        boxes = face_recognition.face_locations(img_rgb, model="hog")
         if not boxes:
-            return {"ok": False, "message": "No face detected", "recognized": False}
+            return {"ok": False, "message": "No face detected", "recognized": False, "cached": cached}
         
-        # Encode the largest face
-        encs = face_recognition.face_encodings(img_rgb, boxes)
         if not encs:
             return {"ok": False, "message": "Could not encode face", "recognized": False}
         
@@ -85,24 +94,38 @@ def recognize_from_base64(image_base64: str):
         known_encs, labels = load_encodings()
         if known_encs is None:
             return {"ok": False, "message": "No encodings loaded", "recognized": False}
+        try:
+            check_compatible(ENCODER.model)
+        except ValueError as e:
+            return {"ok": False, "message": str(e), "recognized": False}
         
-        # Match
-        name, distance = best_match(encs[0], known_encs, labels, THRESHOLD)
+        # Match: un solo barrido top-k por identidad (mejor candidato + margen para ambigüedad)
+        match = describe_match(*GalleryMatcher(known_encs, labels).top_k(encs[0], TOP_K)[0],
+                               THRESHOLD, AMBIGUITY_MARGIN)
+        distance = match["distance"]
         
-        if name:
+        if match["name"] != UNKNOWN:
             return {
                 "ok": True,
                 "recognized": True,
-                "clientName": name,
+                "clientName": match["name"],
                 "confidence": float(1.0 - distance),
-                "distance": distance
+                "distance": distance,
+                "candidates": match["candidates"],
+                "margin": match["margin"],
+                "ambiguous": match["ambiguous"],
+                "cached": cached
             }
         else:
             return {
                 "ok": True,
                 "recognized": False,
                 "message": "Face not recognized",
-                "distance": distance
+                "distance": distance,
+                "candidates": match["candidates"],
+                "margin": match["margin"],
+                "ambiguous": False,
+                "cached": cached
             }
     except Exception as e:
         import traceback
@@ -1,10 +1,14 @@
 # reconocer_en_vivo.py
+import os
 import cv2
 import json
 import time
 import numpy as np
-import face_recognition
 from pathlib import Path
+from stream_manager import open_stream
+from detectors import make_detector
+from encoders import encoder_for, check_compatible
+from gallery_files import ENCODINGS_NPY, LABELS_JSON
 
 # === Fuente de video ===
 # 1) Stream directo de tu ESP32-CAM (LAN):
@@ -17,14 +21,14 @@ from pathlib import Path
 STREAM_URL = "http://192.168.122.116:81/stream"
 
 # === Archivos de embeddings ===
-ENCODINGS_NPY = "encodings.npy"
-LABELS_JSON   = "labels.json"
 
 # Umbral de decisión (distancia euclídea). 0.6–0.62 suele ser razonable.
 THRESHOLD = 0.6
 
 # Para acelerar: redimensionar frame antes de detectar/encodear (0.5 = mitad)
 DOWNSCALE = 0.5
+DETECTOR = make_detector(os.getenv("DETECTOR", "hog"))  # hog, haar, haar+hog, dnn:path=... (detectors.py)
+ENCODER = encoder_for("live")   # ENCODER_LIVE: large | small, :jitters=N (encoders.py)
 
 def load_encodings():
     if not Path(ENCODINGS_NPY).exists() or not Path(LABELS_JSON).exists():
@@ -54,11 +58,11 @@ def best_match(unknown_enc: np.ndarray, known_encs: np.ndarray, labels: list, th
 
 def main():
     known_encs, labels = load_encodings()
+    check_compatible(ENCODER.model)   # la galería debe usar el mismo modelo de landmarks
     print(f"✅ Encodings cargados: {len(labels)} personas")
 
-    cap = cv2.VideoCapture(STREAM_URL)
-    if not cap.isOpened():
-        raise RuntimeError("No se pudo abrir el stream (revisa la URL y conectividad).")
+    # Conexión con reintentos automáticos (si el ESP32 pierde Wi-Fi se reconecta)
+    cap = open_stream(STREAM_URL)
 
     fps_smooth = None
     t0 = time.time()
@@ -66,15 +70,18 @@ def main():
     while True:
         ok, frame = cap.read()
         if not ok:
-            break
+            print("⚠️ Sin frames; esperando reconexión…")
+            if cv2.waitKey(1) & 0xFF == 27:  # ESC para salir
+                break
+            continue
 
         # Redimensionar para acelerar
         small = cv2.resize(frame, (0, 0), fx=DOWNSCALE, fy=DOWNSCALE)
         rgb_small = cv2.cvtColor(small, cv2.COLOR_BGR2RGB)
 
         # Detectar y encodear
-        boxes = face_recognition.face_locations(rgb_small, model="hog")
-        encs = face_recognition.face_encodings(rgb_small, boxes)
+        boxes = DETECTOR.detect(rgb_small)
+        encs = ENCODER.encode(rgb_small, boxes)
 
         # Escalar cajas a tamaño original
         boxes_scaled = []
@@ -4,51 +4,53 @@ import time
 import json
 import cv2
 import numpy as np
-import face_recognition
-import requests
 from pathlib import Path
+from stream_manager import open_stream
+from detectors import make_detector
+from encoders import encoder_for, check_compatible
+from gallery_files import append_rows, ENCODINGS_NPY, LABELS_JSON
+from camera_control import CameraControl
+from burst_register import grab_burst, score_frames, select_diverse
 
 # === Configuración de cámara ===
 STREAM_URL = "http://192.168.122.116:81/stream"
 
-# Endpoints del flash (ajústalos a tu firmware/CameraWebServer si aplica)
-FLASH_ON_URL  = "http://192.168.122.116/control?var=led_intensity&val=255"
-FLASH_OFF_URL = "http://192.168.122.116/control?var=led_intensity&val=0"
+# Endpoint /control del flash (ajústalo a tu firmware/CameraWebServer si aplica)
+CONTROL_URL = "http://192.168.122.116/control"
+camera = CameraControl(CONTROL_URL)   # sesión persistente: sin handshake por cada flash
 
 # === Almacenamiento ===
 SAVE_IMAGES = False
 IMAGES_DIR = "capturas_registro"  # se creará <IMAGES_DIR>/<Nombre>/
-ENCODINGS_NPY = "encodings.npy"   # matriz (N,128) acumulada
-LABELS_JSON   = "labels.json"     # lista de N nombres alineados
 
 # === Parámetros del registro ===
 N_SAMPLES = 3            # cuántos embeddings por persona
 MAX_TRIES_PER_SAMPLE = 8 # reintentos si no detecta rostro
 DOWNSCALE_DETECT = 0.7   # acelerar detección (0.5-0.8 razonable)
+DETECTOR = make_detector(os.getenv("DETECTOR", "hog"))  # hog, haar, haar+hog, dnn:path=... (detectors.py)
+ENCODER = encoder_for("register")   # ENCODER_REGISTER, p.ej. "large:jitters=10" (encoders.py)
 DELAY_FLASH = 0.15       # segundo(s) de flash antes de capturar
+BURST_MODE = True        # ráfaga + puntuación en paralelo en vez de muestra por muestra
+BURST_FRAMES = 12
 
 def ensure_dirs():
     os.makedirs(IMAGES_DIR, exist_ok=True)
 
 def flash(on=True):
-    try:
-        url = FLASH_ON_URL if on else FLASH_OFF_URL
-        requests.get(url, timeout=0.7)
-    except Exception:
-        # si no hay endpoint/firmware compatible, simplemente ignora
-        pass
+    # si no hay endpoint/firmware compatible, simplemente ignora
+    camera.flash(on)
 
 def detect_largest_face_and_encode(frame_bgr):
     """Devuelve (encoding(128,), box) o (None, None) si falla."""
     # downscale para detectar más rápido
     small = cv2.resize(frame_bgr, (0, 0), fx=DOWNSCALE_DETECT, fy=DOWNSCALE_DETECT)
     rgb_small = cv2.cvtColor(small, cv2.COLOR_BGR2RGB)
-    boxes = face_recognition.face_locations(rgb_small, model="hog")
+    boxes = DETECTOR.detect(rgb_small)
     if not boxes:
         return None, None
     # ordena por área y toma la más grande
     boxes = sorted(boxes, key=lambda b: (b[2]-b[0])*(b[1]-b[3]), reverse=True)
-    encs = face_recognition.face_encodings(rgb_small, [boxes[0]])
+    encs = ENCODER.encode(rgb_small, [boxes[0]])
     if not encs:
         return None, None
     # escala la caja a tamaño original (opcional si quieres dibujar)
@@ -58,31 +60,16 @@ def detect_largest_face_and_encode(frame_bgr):
     return encs[0], box_full
 
 def append_to_master(enc_list, name):
-    """Agrega 1..k encodings de 'name' a (ENCODINGS_NPY, LABELS_JSON)."""
-    # cargar existentes si hay
-    if Path(ENCODINGS_NPY).exists():
-        enc_master = np.load(ENCODINGS_NPY)
-        if enc_master.ndim == 1:  # corner case si hay 1 solo
-            enc_master = enc_master.reshape(1, -1)
-        labels = json.loads(Path(LABELS_JSON).read_text(encoding="utf-8"))
-    else:
-        enc_master = np.zeros((0, 128), dtype=np.float32)
-        labels = []
-    # apilar
-    enc_new = np.vstack([e.astype(np.float32) for e in enc_list])
-    enc_all = np.vstack([enc_master, enc_new]) if enc_master.size else enc_new
-    labels += [name] * len(enc_list)
-    # guardar
-    np.save(ENCODINGS_NPY, enc_all)
-    Path(LABELS_JSON).write_text(json.dumps(labels, ensure_ascii=False, indent=2), encoding="utf-8")
-    return enc_all.shape[0], len(labels)
+    """Agrega 1..k encodings de 'name' a la galería (gallery_files.py: bloqueo + escritura atómica)."""
+    return append_rows(name, enc_list, ENCODER.model)
 
 def main():
     ensure_dirs()
+    if Path(LABELS_JSON).exists():
+        check_compatible(ENCODER.model)
     print("✅ Listo. Presiona 'R' para registrar a una persona (3 capturas). ESC para salir.")
-    cap = cv2.VideoCapture(STREAM_URL)
-    if not cap.isOpened():
-        raise RuntimeError("No se pudo abrir el stream. Revisa la IP/puertos.")
+    # Conexión con reintentos automáticos (si el ESP32 pierde Wi-Fi se reconecta)
+    cap = open_stream(STREAM_URL)
 
     registering = False
     name = None
@@ -93,7 +80,10 @@ def main():
     while True:
         ok, frame = cap.read()
         if not ok:
-            break
+            print("⚠️ Sin frames; esperando reconexión…")
+            if cv2.waitKey(1) & 0xFF == 27:  # ESC
+                break
+            continue
 
         # Dibujo de guía (opcional): detecta solo para mostrar recuadro
         enc_preview, box = detect_largest_face_and_encode(frame)
@@ -130,8 +120,29 @@ def main():
             collected = []
             print(f"--> Registrando a {name} (se capturarán {N_SAMPLES} embeddings)")
 
+        # ráfaga: las N mejores y distintas de una sola pasada
+        if registering and BURST_MODE:
+            flash(True)
+            time.sleep(DELAY_FLASH)
+            frames = grab_burst(cap, BURST_FRAMES)
+            flash(False)
+            cands = score_frames(frames, downscale=DOWNSCALE_DETECT, encoder_spec=ENCODER.spec)
+            chosen = select_diverse(cands, N_SAMPLES)
+            print(f"   Ráfaga: {len(frames)} frames, {len(cands)} con rostro, {len(chosen)} elegidos")
+            if len(chosen) < N_SAMPLES:
+                print("   ❌ No hubo suficientes muestras buenas. Intenta de nuevo con R (mira a la cámara y muévete un poco).")
+                registering = False
+                continue
+            for i, c in enumerate(chosen, 1):
+                collected.append(c["encoding"])
+                if SAVE_IMAGES:
+                    filename = f"{name}_{i:02d}.jpg"
+                    cv2.imwrite(os.path.join(person_dir, filename), frames[c["index"]])
+                    print(f"📸 Guardada: {filename} (calidad {c['quality']:.2f})")
+            sample_count = len(collected)
+
         # ciclo de captura de 3 muestras
-        if registering:
+        if registering and not BURST_MODE:
             # por cada muestra, ilumina/lee/reintenta hasta MAX_TRIES_PER_SAMPLE
             got = False
             tries = 0
@@ -162,18 +173,18 @@ def main():
                 registering = False  # resetea el flujo para que el usuario presione R otra vez
                 continue
 
-            # ¿ya completó las N_SAMPLES?
-            if sample_count >= N_SAMPLES:
-                # Append a los maestros
-                total_rows, total_labels = append_to_master(collected, name)
-                print(f"✅ Registro completado para {name}.")
-                print(f"   Se agregaron {N_SAMPLES} embeddings. Total en {ENCODINGS_NPY}: {total_rows}")
-                # reset
-                registering = False
-                name = None
-                person_dir = None
-                sample_count = 0
-                collected = []
+        # ¿ya completó las N_SAMPLES?
+        if registering and sample_count >= N_SAMPLES:
+            # Append a los maestros
+            total_rows, total_labels = append_to_master(collected, name)
+            print(f"✅ Registro completado para {name}.")
+            print(f"   Se agregaron {N_SAMPLES} embeddings. Total en {ENCODINGS_NPY}: {total_rows}")
+            # reset
+            registering = False
+            name = None
+            person_dir = None
+            sample_count = 0
+            collected = []
 
     cap.release()
     cv2.destroyAllWindows()
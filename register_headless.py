@@ -4,21 +4,27 @@ import time
 import json
 import cv2
 import numpy as np
-import face_recognition
 import argparse
 from pathlib import Path
+from stream_manager import open_stream
+from detectors import make_detector
+from encoders import encoder_for, check_compatible
+from gallery_files import append_rows, LABELS_JSON
+from burst_register import grab_burst, score_frames, select_diverse, BURST_FRAMES
 
 # Simple headless registration script for integration with web UI.
-# Usage: python register_headless.py --name "Nombre" --samples 3
+# Usage: python register_headless.py --name "Nombre" --samples 3 [--mode burst|sequential]
 
 STREAM_URL = "http://192.168.122.116:81/stream"
-ENCODINGS_NPY = "encodings.npy"
-LABELS_JSON = "labels.json"
 IMAGES_DIR = "capturas_registro"
 
 N_SAMPLES = 3
 MAX_TRIES_PER_SAMPLE = 8
 DOWNSCALE_DETECT = 0.7
+DETECTOR = make_detector(os.getenv("DETECTOR", "hog"))  # hog, haar, haar+hog, dnn:path=... (detectors.py)
+ENCODER = encoder_for("register")   # ENCODER_REGISTER, p.ej. "large:jitters=10" (encoders.py)
+CONNECT_TIMEOUT = 20.0
+MAX_BURSTS = 3           # ráfagas antes de fallar en modo burst
 
 def ensure_dirs():
     os.makedirs(IMAGES_DIR, exist_ok=True)
@@ -26,11 +32,11 @@ def ensure_dirs():
 def detect_largest_face_and_encode(frame_bgr):
     small = cv2.resize(frame_bgr, (0, 0), fx=DOWNSCALE_DETECT, fy=DOWNSCALE_DETECT)
     rgb_small = cv2.cvtColor(small, cv2.COLOR_BGR2RGB)
-    boxes = face_recognition.face_locations(rgb_small, model="hog")
+    boxes = DETECTOR.detect(rgb_small)
     if not boxes:
         return None, None
     boxes = sorted(boxes, key=lambda b: (b[2]-b[0])*(b[1]-b[3]), reverse=True)
-    encs = face_recognition.face_encodings(rgb_small, [boxes[0]])
+    encs = ENCODER.encode(rgb_small, [boxes[0]])
     if not encs:
         return None, None
     (t, r, b, l) = boxes[0]
@@ -38,40 +44,10 @@ def detect_largest_face_and_encode(frame_bgr):
     return encs[0], box_full
 
 def append_to_master(enc_list, name):
-    if Path(ENCODINGS_NPY).exists():
-        enc_master = np.load(ENCODINGS_NPY)
-        if enc_master.ndim == 1:
-            enc_master = enc_master.reshape(1, -1)
-        labels = json.loads(Path(LABELS_JSON).read_text(encoding="utf-8"))
-    else:
-        enc_master = np.zeros((0, 128), dtype=np.float32)
-        labels = []
-    enc_new = np.vstack([e.astype(np.float32) for e in enc_list])
-    enc_all = np.vstack([enc_master, enc_new]) if enc_master.size else enc_new
-    labels += [name] * len(enc_list)
-    np.save(ENCODINGS_NPY, enc_all)
-    Path(LABELS_JSON).write_text(json.dumps(labels, ensure_ascii=False, indent=2), encoding="utf-8")
-    return enc_all.shape[0], len(labels)
-
-def main():
-    parser = argparse.ArgumentParser()
-    parser.add_argument('--name', required=True)
-    parser.add_argument('--samples', type=int, default=N_SAMPLES)
-    args = parser.parse_args()
-
-    ensure_dirs()
-    name = args.name
-    samples = args.samples
-    print(f"Starting headless registration for: {name} ({samples} samples)")
-
-    cap = cv2.VideoCapture(STREAM_URL)
-    if not cap.isOpened():
-        print("ERROR: No se pudo abrir el stream. Revisa la URL/Conectividad.")
-        raise SystemExit(1)
-
-    person_dir = os.path.join(IMAGES_DIR, name)
-    os.makedirs(person_dir, exist_ok=True)
+    return append_rows(name, enc_list, ENCODER.model)
 
+def capture_sequential(cap, name, samples, person_dir):
+    """Primer frame con cara por muestra, con reintentos (modo anterior)."""
     collected = []
     sample_count = 0
 
@@ -82,7 +58,6 @@ def main():
             tries += 1
             ok, frame = cap.read()
             if not ok:
-                time.sleep(0.2)
                 continue
             enc, box = detect_largest_face_and_encode(frame)
             if enc is not None:
@@ -96,9 +71,80 @@ def main():
                 print(f"No face detected (try {tries}/{MAX_TRIES_PER_SAMPLE}), retrying...")
 
         if not got:
-            print("Failed to capture a valid face for this sample. Exiting with failure.")
-            cap.release()
-            raise SystemExit(2)
+            return None
+    return collected
+
+def capture_burst(cap, name, samples, person_dir, burst_frames, workers):
+    """Ráfagas de frames puntuadas en paralelo; se guardan las mejores y más diversas."""
+    cands, frames = [], []
+    for burst in range(1, MAX_BURSTS + 1):
+        t0 = time.time()
+        new_frames = grab_burst(cap, burst_frames)
+        new_cands = score_frames(new_frames, workers=workers, downscale=DOWNSCALE_DETECT,
+                                 encoder_spec=ENCODER.spec)
+        for c in new_cands:
+            c["index"] += len(frames)
+        frames += new_frames
+        cands += new_cands
+        chosen = select_diverse(cands, samples)
+        print(f"Burst {burst}: {len(new_frames)} frames, {len(new_cands)} with face, "
+              f"{len(chosen)}/{samples} usable ({time.time() - t0:.1f}s)")
+        if len(chosen) >= samples:
+            break
+    else:
+        return None
+
+    collected = []
+    for i, c in enumerate(chosen, 1):
+        filename = f"{name}_{i:02d}.jpg"
+        cv2.imwrite(os.path.join(person_dir, filename), frames[c["index"]])
+        collected.append(c["encoding"])
+        print(f"Captured sample {i}/{samples}: {filename} (quality {c['quality']:.2f}, "
+              f"{c['face_px']}px, sharpness {c['sharpness']:.0f}, yaw {c['yaw']:.2f})")
+    return collected
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--name', required=True)
+    parser.add_argument('--samples', type=int, default=N_SAMPLES)
+    parser.add_argument('--mode', choices=['burst', 'sequential'], default='burst')
+    parser.add_argument('--burst-frames', type=int, default=BURST_FRAMES)
+    parser.add_argument('--workers', type=int, default=None, help='procesos para puntuar (default: CPUs)')
+    args = parser.parse_args()
+
+    ensure_dirs()
+    name = args.name
+    samples = args.samples
+    print(f"Starting headless registration for: {name} ({samples} samples, {args.mode}, encoder {ENCODER.spec})")
+
+    # Validar antes de capturar: no tiene sentido tomar muestras que no se pueden guardar
+    if Path(LABELS_JSON).exists():
+        try:
+            check_compatible(ENCODER.model)
+        except ValueError as e:
+            print(f"ERROR: {e}")
+            raise SystemExit(3)
+
+    cap = open_stream(STREAM_URL)
+    # Esperar la primera conexión (el gestor prueba FFmpeg, :81, MJPEG manual...)
+    ok, _ = cap.read(timeout=CONNECT_TIMEOUT)
+    if not ok:
+        print("ERROR: No se pudo abrir el stream. Revisa la URL/Conectividad.")
+        cap.release()
+        raise SystemExit(1)
+
+    person_dir = os.path.join(IMAGES_DIR, name)
+    os.makedirs(person_dir, exist_ok=True)
+
+    if args.mode == 'burst':
+        collected = capture_burst(cap, name, samples, person_dir, args.burst_frames, args.workers)
+    else:
+        collected = capture_sequential(cap, name, samples, person_dir)
+
+    if collected is None:
+        print("Failed to capture a valid face for this sample. Exiting with failure.")
+        cap.release()
+        raise SystemExit(2)
 
     # Append encodings
     total_rows, total_labels = append_to_master(collected, name)
@@ -0,0 +1,141 @@
+# scale_tuner.py - Escala de detección aprendida por cámara
+"""
+HOG de dlib (face_locations con upsample=1) no encuentra caras de menos de
+~40 px en la imagen que recibe. Con un DOWNSCALE global, una cámara cercana
+gasta tiempo en píxeles que no necesita y una lejana pierde caras.
+
+ScaleTuner observa el tamaño (en px del frame completo) de las caras que
+ve cada cámara y elige la escala más chica de SCALES que mantiene el
+percentil bajo de tamaños por encima del mínimo de HOG:
+
+- nivel grueso: escala para el percentil 10 de tamaños (con la mediana se
+  perdía la mitad más chica de las caras en cada frame)
+- nivel fino: la escala base, si es mayor que la gruesa (así las caras que
+  el nivel grueso ya no ve siguen apareciendo en la estadística). Sólo se
+  usa en frames donde el nivel grueso no encontró nada, y como máximo 1 de
+  cada `fine_every`. Si ambos niveles coinciden no hay pirámide.
+
+Mientras no haya suficientes muestras se usa la escala base.
+
+Si la cámara cambia de resolución (camera_control.py), los tamaños se
+normalizan al ancho del primer frame visto y la escala se corrige por
+`ancho_referencia / ancho_actual`.
+"""
+import time
+from collections import deque
+import numpy as np
+
+SCALES = (1.0, 0.75, 0.5, 0.4, 0.33, 0.25)
+MIN_FACE_PX = 40        # mínimo de HOG con upsample=1
+MARGIN = 1.25
+PERCENTILE = 10         # percentil de tamaños que debe seguir detectándose
+
+
+class ScaleTuner:
+    def __init__(self, base_scale=0.5, min_face_px=MIN_FACE_PX, margin=MARGIN,
+                 window=200, min_samples=30, fine_every=3, scales=SCALES):
+        self.base_scale = base_scale
+        self.min_face_px = min_face_px
+        self.margin = margin
+        self.min_samples = min_samples
+        self.fine_every = fine_every
+        self.scales = sorted(scales, reverse=True)
+        self.sizes = deque(maxlen=window)
+        self.coarse_scale = base_scale
+        self.fine_scale = base_scale
+        self._empty_streak = 0
+        self.median_px = None
+        self.ref_width = None
+        # métricas: píxeles procesados y tiempo de detección
+        self.frames = 0
+        self.fine_runs = 0
+        self.pixel_ratio_sum = 0.0
+        self.detect_seconds = 0.0
+
+    def _scale_for(self, face_px):
+        """Escala más chica que deja `face_px` por encima del mínimo de HOG."""
+        need = self.min_face_px * self.margin
+        best = self.scales[0]
+        for s in self.scales:
+            if face_px * s >= need:
+                best = s
+        return best
+
+    def _retune(self):
+        if len(self.sizes) < self.min_samples:
+            return
+        sizes = np.asarray(self.sizes)
+        self.median_px = float(np.percentile(sizes, 50))
+        self.coarse_scale = self._scale_for(float(np.percentile(sizes, PERCENTILE)))
+        self.fine_scale = max(self.coarse_scale, self.base_scale)
+
+    @property
+    def pyramid(self):
+        return self.fine_scale > self.coarse_scale
+
+    def want_fine(self):
+        """¿Correr el nivel fino en este frame (el grueso no encontró caras)?"""
+        if not self.pyramid:
+            return False
+        self._empty_streak += 1
+        return self._empty_streak % self.fine_every == 0
+
+    def observe(self, boxes, scale, seconds, fine=False, factor=1.0):
+        """Registra las cajas (coordenadas a `scale`) y el costo de detección."""
+        self.frames += 1
+        self.fine_runs += int(fine)
+        self.detect_seconds += seconds
+        if boxes:
+            self._empty_streak = 0
+        for (t, r, b, l) in boxes:
+            self.sizes.append(max(b - t, r - l) / scale * factor)
+        self._retune()
+
+    def account(self, scale, factor=1.0):
+        """Píxeles procesados relativos a la escala base (para el reporte)."""
+        self.pixel_ratio_sum += (scale / (self.base_scale * factor)) ** 2
+
+    def _factor(self, frame_width):
+        """Ancho de referencia / ancho actual (1.0 si no se informa el ancho)."""
+        if not frame_width:
+            return 1.0
+        if self.ref_width is None:
+            self.ref_width = frame_width
+        return self.ref_width / frame_width
+
+    def detect(self, detect_fn, prepare_fn, frame_width=None):
+        """
+        Corre la detección con la escala elegida.
+        `prepare_fn(scale)` devuelve la imagen RGB reducida;
+        `detect_fn(img)` devuelve cajas. Devuelve (cajas, escala, imagen).
+        """
+        t0 = time.perf_counter()
+        factor = self._factor(frame_width)
+        scale = min(1.0, self.coarse_scale * factor)
+        img = prepare_fn(scale)
+        boxes = detect_fn(img)
+        self.account(scale, factor)
+        fine = False
+        if not boxes and self.want_fine():
+            scale = min(1.0, self.fine_scale * factor)
+            img = prepare_fn(scale)
+            boxes = detect_fn(img)
+            self.account(scale, factor)
+            fine = True
+        self.observe(boxes, scale, time.perf_counter() - t0, fine, factor)
+        return boxes, scale, img
+
+    def stats(self):
+        frames = max(self.frames, 1)
+        return {
+            "base_scale": self.base_scale,
+            "scale": self.coarse_scale,
+            "fine_scale": self.fine_scale if self.pyramid else None,
+            "samples": len(self.sizes),
+            "median_face_px": round(self.median_px, 1) if self.median_px is not None else None,
+            "frames": self.frames,
+            "fine_runs": self.fine_runs,
+            # >1 = menos píxeles que con la escala base
+            "est_speedup": round(frames / self.pixel_ratio_sum, 2) if self.pixel_ratio_sum else 1.0,
+            "avg_detect_ms": round(1000 * self.detect_seconds / frames, 1),
+        }
@@ -0,0 +1,368 @@
+# shard_matcher.py - Matching scatter-gather sobre la galería repartida en procesos
+"""
+Con galerías de millones de filas un solo proceso que recorre todo es el
+cuello de botella y además carga toda la galería en su memoria. Aquí la
+galería se parte en S rangos contiguos de filas de encodings.npy y cada
+shard es un proceso que mapea su rango del archivo en memoria y arma su
+GalleryMatcher sobre ese rango sin copiarlo (sólo 1/S de la galería por
+proceso, en la caché de páginas compartida).
+
+- Scatter-gather: la consulta (todas las caras del frame) se envía a todos
+  los shards a la vez por su socket y cada uno devuelve su top-max(k, 2)
+  de identidades. La fusión toma el mínimo por identidad: es exacta, porque
+  una identidad del top-k global está en el top-k del shard donde tiene su
+  fila más cercana.
+- Shards locales (`workers=S`, lanzados aquí como `python shard_matcher.py
+  serve` en un socket unix: no importan app.py ni los modelos de dlib) o
+  remotos en la misma máquina (`addresses=[...]`, levantados con
+  `python shard_matcher.py serve --address <host:puerto|socket>`), a los
+  que se les indica qué rango del archivo cargar.
+- Fallos: un shard que no responde en `timeout` (`load_timeout` al cargar
+  su rango) o que cortó la conexión se
+  marca caído y la consulta se responde con los demás (`partial_queries`
+  en stats). Un hilo reconecta y, si el proceso local murió, lo relanza y
+  le vuelve a cargar su rango.
+- Registros: las filas nuevas van al final del archivo, así que sólo el
+  último shard recarga su rango extendido (hasta que crece más de
+  REBALANCE_FACTOR veces su parte y se reparte de nuevo); un borrado
+  recarga todos.
+
+Mide el rendimiento contra un solo proceso con `python bench_shards.py`.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import threading
+import subprocess
+from multiprocessing.connection import Listener, Client, wait
+import numpy as np
+
+from matching import GalleryMatcher
+from frame_bus import parse_address
+
+RECONNECT_INTERVAL = 1.0
+LOAD_TIMEOUT = 60.0         # segundos para que un shard cargue su rango
+REBALANCE_FACTOR = 1.5      # el último shard crece hasta 1.5x su parte antes de repartir de nuevo
+
+
+# ---------- proceso de un shard ----------
+
+class ShardState:
+    def __init__(self):
+        self.matcher = None
+        self.range = (0, 0)
+        self.queries = 0
+        self.faces = 0
+        self.busy_seconds = 0.0
+
+    def handle(self, cmd, kwargs):
+        if cmd == "top_k":
+            t0 = time.perf_counter()
+            matcher = self.matcher
+            q = kwargs["queries"]
+            out = matcher.top_k(q, kwargs["k"]) if matcher is not None and len(matcher) else [
+                ([], None) for _ in range(len(q))]
+            self.queries += 1
+            self.faces += len(q)
+            self.busy_seconds += time.perf_counter() - t0
+            return [cands for cands, _ in out]
+        if cmd == "load":
+            start, end = kwargs["start"], kwargs["end"]
+            encs = np.load(kwargs["encodings"], mmap_mode="r")[start:end]
+            with open(kwargs["labels"], "r", encoding="utf-8") as f:
+                labels = json.load(f)[start:end]
+            # sobre el rango mapeado, sin copia privada (la galería se reemplaza con os.replace, así que
+            # el archivo mapeado no cambia); se reemplaza de una vez (las consultas siguen con la anterior)
+            self.matcher = GalleryMatcher(encs, labels, copy=False) if end > start else None
+            self.range = (start, end)
+            return {"rows": end - start}
+        if cmd == "stats":
+            return {"pid": os.getpid(), "range": list(self.range),
+                    "rows": len(self.matcher) if self.matcher is not None else 0,
+                    "mb": round(self.matcher.encs.nbytes / 1e6, 1) if self.matcher is not None else 0.0,
+                    "queries": self.queries, "faces": self.faces,
+                    "busy_seconds": round(self.busy_seconds, 3)}
+        if cmd == "ping":
+            return "pong"
+        raise ValueError(f"Comando desconocido: {cmd}")
+
+
+def serve_shard(address, authkey):
+    """Atiende un shard: una conexión persistente por cliente, un hilo por conexión."""
+    state = ShardState()
+    listener = Listener(parse_address(address), authkey=authkey)
+
+    def serve_conn(conn):
+        with conn:
+            while True:
+                try:
+                    cmd, kwargs = conn.recv()
+                except (EOFError, OSError):
+                    return
+                try:
+                    reply = (True, state.handle(cmd, kwargs))
+                except Exception as e:
+                    reply = (False, str(e))
+                try:
+                    conn.send(reply)
+                except OSError:
+                    return
+
+    while True:
+        try:
+            conn = listener.accept()
+        except OSError:
+            return
+        except Exception as e:
+            print(f"⚠️ Conexión al shard rechazada: {e}")
+            continue
+        threading.Thread(target=serve_conn, args=(conn,), daemon=True).start()
+
+
+# ---------- coordinador ----------
+
+class Shard:
+    def __init__(self, address, process=None):
+        self.address = address
+        self.process = process      # None: shard remoto (no se relanza desde aquí)
+        self.conn = None
+        self.range = (0, 0)
+        self.up = False
+        self.failures = 0
+        self.restarts = 0
+        self.last_error = None
+
+
+class ShardedMatcher:
+    """Misma interfaz que GalleryMatcher (top_k / len) con la galería repartida en shards."""
+
+    def __init__(self, workers=0, addresses=(), authkey=b"facerec-shards", timeout=2.0, load_timeout=LOAD_TIMEOUT):
+        self.authkey = authkey
+        self.timeout = timeout
+        self.load_timeout = load_timeout
+        self._tmpdir = None
+        self.shards = []
+        for i in range(workers):
+            if self._tmpdir is None:
+                self._tmpdir = tempfile.mkdtemp(prefix="facerec_shards_")
+            shard = Shard(os.path.join(self._tmpdir, f"shard{i}.sock"))
+            self._spawn(shard)
+            self.shards.append(shard)
+        self.shards += [Shard(a) for a in addresses]
+        self._lock = threading.Lock()       # una consulta a la vez por conexión
+        self._files = None                  # (encodings.npy, labels.json)
+        self.rows = 0
+        self.queries = 0
+        self.partial_queries = 0
+        self._stop = threading.Event()
+        for shard in self.shards:
+            self._connect(shard)
+        self._monitor = threading.Thread(target=self._monitor_loop, daemon=True)
+        self._monitor.start()
+
+    def __len__(self):
+        return self.rows
+
+    # ---- procesos y conexiones ----
+
+    def _spawn(self, shard):
+        if os.path.exists(shard.address):
+            os.unlink(shard.address)
+        env = dict(os.environ, SHARD_AUTHKEY=self.authkey.decode())
+        shard.process = subprocess.Popen([sys.executable, os.path.abspath(__file__), "serve",
+                                          "--address", shard.address], env=env, stdout=subprocess.DEVNULL)
+        # listo cuando aparece el socket
+        deadline = time.monotonic() + 30
+        while not os.path.exists(shard.address) and shard.process.poll() is None and time.monotonic() < deadline:
+            time.sleep(0.02)
+
+    def _call(self, shard, cmd, **kwargs):
+        shard.conn.send((cmd, kwargs))
+        # cargar un rango puede tardar; el resto tiene que responder en `timeout`.
+        # Con tope: se llama con self._lock tomado y un shard colgado frenaría todas las consultas
+        timeout = self.load_timeout if cmd == "load" else self.timeout
+        if not shard.conn.poll(timeout):
+            raise TimeoutError(f"sin respuesta en {timeout}s")
+        ok, value = shard.conn.recv()
+        if not ok:
+            raise RuntimeError(value)
+        return value
+
+    def _connect(self, shard):
+        try:
+            shard.conn = Client(parse_address(shard.address), authkey=self.authkey)
+            if self._files is not None and shard.range[1] > shard.range[0]:
+                self._load(shard, *shard.range)
+            shard.up = True
+            shard.last_error = None
+        except (OSError, EOFError, RuntimeError) as e:
+            shard.last_error = str(e)
+            shard.up = False
+            if shard.conn is not None:
+                # una respuesta tardía a la carga desincronizaría la conexión
+                shard.conn.close()
+                shard.conn = None
+        return shard.up
+
+    def _fail(self, shard, error):
+        """Descarta la conexión (una respuesta tardía la desincronizaría)."""
+        shard.up = False
+        shard.failures += 1
+        shard.last_error = str(error)
+        if shard.conn is not None:
+            shard.conn.close()
+            shard.conn = None
+        print(f"⚠️ Shard {shard.address} caído: {error}")
+
+    def _monitor_loop(self):
+        while not self._stop.wait(RECONNECT_INTERVAL):
+            for shard in self.shards:
+                if shard.up:
+                    continue
+                if shard.process is not None and shard.process.poll() is not None:
+                    # relanzar fuera del lock: las consultas siguen con los demás shards
+                    self._spawn(shard)
+                    shard.restarts += 1
+                with self._lock:
+                    if self._connect(shard):
+                        print(f"✅ Shard {shard.address} recuperado ({shard.range[1] - shard.range[0]} filas)")
+
+    def close(self):
+        self._stop.set()
+        with self._lock:
+            for shard in self.shards:
+                if shard.conn is not None:
+                    shard.conn.close()
+                if shard.process is not None:
+                    shard.process.terminate()
+                    shard.process.wait(5)
+        if self._tmpdir is not None:
+            for name in os.listdir(self._tmpdir):
+                os.unlink(os.path.join(self._tmpdir, name))
+            os.rmdir(self._tmpdir)
+
+    # ---- galería ----
+
+    def _load(self, shard, start, end):
+        self._call(shard, "load", encodings=self._files[0], labels=self._files[1], start=start, end=end)
+
+    def load(self, encodings_path, labels_path, rows):
+        """Reparte las `rows` filas del archivo en rangos contiguos y las carga en cada shard."""
+        with self._lock:
+            self._files = (os.path.abspath(encodings_path), os.path.abspath(labels_path))
+            bounds = np.linspace(0, rows, len(self.shards) + 1).astype(int)
+            for shard, start, end in zip(self.shards, bounds[:-1], bounds[1:]):
+                shard.range = (int(start), int(end))
+                if shard.up:
+                    try:
+                        self._load(shard, *shard.range)
+                    except (OSError, EOFError, RuntimeError, TimeoutError) as e:
+                        self._fail(shard, e)
+            self.rows = rows
+        return self
+
+    def extend(self, rows):
+        """Filas agregadas al final del archivo: sólo el último shard recarga su rango."""
+        if rows - self.shards[-1].range[0] > REBALANCE_FACTOR * rows / len(self.shards):
+            return self.load(self._files[0], self._files[1], rows)
+        with self._lock:
+            shard = self.shards[-1]
+            shard.range = (shard.range[0], rows)
+            if shard.up:
+                try:
+                    self._load(shard, *shard.range)
+                except (OSError, EOFError, RuntimeError, TimeoutError) as e:
+                    self._fail(shard, e)
+            self.rows = rows
+        return self
+
+    # ---- consultas ----
+
+    def top_k(self, unknown_encs, k=3):
+        """
+        Scatter a todos los shards vivos, gather y fusión exacta del top-k por
+        identidad -> [(candidatos, margen, parcial)]. `parcial`: faltó algún
+        shard y el resultado puede no ser el de la galería completa.
+        """
+        q = np.ascontiguousarray(np.asarray(unknown_encs, dtype=np.float32).reshape(-1, 128))
+        kk = max(k, 2)
+        with self._lock:
+            sent = []
+            for shard in self.shards:
+                if not shard.up:
+                    continue
+                try:
+                    shard.conn.send(("top_k", {"queries": q, "k": kk}))
+                    sent.append(shard)
+                except OSError as e:
+                    self._fail(shard, e)
+            replies = []
+            pending = {shard.conn: shard for shard in sent}
+            deadline = time.monotonic() + self.timeout
+            while pending:
+                ready = wait(list(pending), max(0.0, deadline - time.monotonic()))
+                if not ready:
+                    break
+                for conn in ready:
+                    shard = pending.pop(conn)
+                    try:
+                        ok, value = conn.recv()
+                        if not ok:
+                            raise RuntimeError(value)
+                        replies.append(value)
+                    except (OSError, EOFError, RuntimeError) as e:
+                        self._fail(shard, e)
+            for shard in pending.values():
+                self._fail(shard, TimeoutError(f"sin respuesta en {self.timeout}s"))
+            self.queries += 1
+            partial = len(replies) < len(self.shards)
+            if partial:
+                self.partial_queries += 1
+
+        out = []
+        for i in range(len(q)):
+            best = {}
+            for reply in replies:
+                for name, d in reply[i]:
+                    if d < best.get(name, np.inf):
+                        best[name] = d
+            ranked = sorted(best.items(), key=lambda item: item[1])
+            margin = ranked[1][1] - ranked[0][1] if len(ranked) > 1 else None
+            out.append((ranked[:k], margin, partial))
+        return out
+
+    def stats(self):
+        shards = []
+        for shard in self.shards:
+            info = {"address": shard.address, "up": shard.up, "range": list(shard.range),
+                    "failures": shard.failures, "restarts": shard.restarts, "error": shard.last_error}
+            if shard.up:
+                with self._lock:
+                    try:
+                        info.update(self._call(shard, "stats"))
+                    except (OSError, EOFError, RuntimeError, TimeoutError) as e:
+                        self._fail(shard, e)
+                        info["up"] = False
+            shards.append(info)
+        return {"rows": self.rows, "queries": self.queries, "partial_queries": self.partial_queries,
+                "shards": shards}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Shard de galería para SHARD_ADDRESSES")
+    parser.add_argument('command', choices=["serve"])
+    parser.add_argument('--address', required=True, help="host:puerto o ruta de socket unix")
+    parser.add_argument('--authkey', default=os.getenv('SHARD_AUTHKEY', 'facerec-shards'))
+    args = parser.parse_args()
+    print(f"🧩 Shard de galería en {args.address} (pid {os.getpid()})")
+    try:
+        serve_shard(args.address, args.authkey.encode())
+    except KeyboardInterrupt:
+        sys.exit(0)
+
+
+if __name__ == '__main__':
+    main()
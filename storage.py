@@ -0,0 +1,347 @@
+# storage.py - Ciclo de vida de captured_frames/ y recognition_results/
+"""
+Los frames y resultados se guardaban en un directorio plano cada uno, sin
+límite: con semanas de uso los listados y los backups se vuelven lentos y
+el disco se llena.
+
+- Layout por cámara y fecha: `<dir>/<camera>/<AAAA-MM-DD>/<archivo>`
+  (`camera/date`), sólo por fecha (`date`) o plano como antes (`flat`).
+- Escritura en un hilo propio con cola acotada: el loop de reconocimiento
+  sólo encola la referencia al frame (los frames del gestor de stream no se
+  modifican, no hace falta copiarlos). Si el disco no da abasto la cola se
+  llena y se descarta la escritura (se cuenta) en vez de frenar el loop.
+  Cada archivo se escribe en `.tmp` y se renombra: backups y limpieza nunca
+  ven archivos a medias.
+- Miniaturas: con `thumbnails` se guarda el recorte de la cara (con margen)
+  en vez del frame completo; el recorte y la codificación son del hilo de
+  escritura.
+- Limpieza en otro hilo, cada `sweep_seconds` (o antes si lo escrito supera
+  el tope): borra lo más viejo que `max_days` y luego, si el directorio pasa
+  de `max_mb`, los archivos menos usados primero (último acceso o
+  modificación, lo más reciente de los dos) hasta quedar en el 90 %.
+- Migración: los archivos sueltos en la raíz (layout plano anterior) se
+  mueven a su carpeta de fecha, tomada del nombre (`..._AAAAMMDD_HHMMSS...`)
+  o de la fecha de modificación. Corre sola en la primera limpieza, o a mano:
+
+    python storage.py migrate --camera default [--dry-run]
+"""
+import os
+import re
+import time
+import queue
+import argparse
+import threading
+from datetime import datetime
+import cv2
+
+LAYOUTS = ("camera/date", "date", "flat")
+STAMP_RE = re.compile(r"(\d{8})_\d{6}")
+EVICT_TARGET = 0.9          # tras pasar el tope de tamaño, bajar hasta el 90 %
+THUMB_MARGIN = 0.25         # margen alrededor de la caja, relativo a su tamaño
+THUMB_QUALITY = 90
+
+
+def shard_dir(root, layout, camera, when):
+    """Carpeta de un archivo según el layout (`when` es un datetime)."""
+    if layout == "flat":
+        return root
+    day = when.strftime('%Y-%m-%d')
+    if layout == "date":
+        return os.path.join(root, day)
+    return os.path.join(root, safe_name(camera), day)
+
+
+def safe_name(name):
+    return re.sub(r"[^\w.-]", "_", str(name)) or "_"
+
+
+def file_date(name, path=None):
+    """Fecha de un archivo del layout anterior: la del nombre o la de modificación."""
+    m = STAMP_RE.search(name)
+    if m:
+        try:
+            return datetime.strptime(m.group(1), '%Y%m%d')
+        except ValueError:
+            pass
+    return datetime.fromtimestamp(os.path.getmtime(path)) if path else datetime.now()
+
+
+def face_thumbnail(frame, box, size):
+    """Recorte de la cara con margen, reducido a `size` px de lado mayor."""
+    h, w = frame.shape[:2]
+    top, right, bottom, left = box["top"], box["right"], box["bottom"], box["left"]
+    mx, my = int((right - left) * THUMB_MARGIN), int((bottom - top) * THUMB_MARGIN)
+    crop = frame[max(0, top - my):min(h, bottom + my), max(0, left - mx):min(w, right + mx)]
+    if crop.size == 0:
+        return None
+    scale = size / max(crop.shape[:2])
+    if scale < 1.0:
+        crop = cv2.resize(crop, (max(1, int(crop.shape[1] * scale)), max(1, int(crop.shape[0] * scale))),
+                          interpolation=cv2.INTER_AREA)
+    return crop
+
+
+class Store:
+    """Un directorio gestionado con sus topes (0 = sin tope)."""
+
+    def __init__(self, root, layout="camera/date", max_mb=0, max_days=0):
+        if layout not in LAYOUTS:
+            raise ValueError(f"Layout desconocido: {layout} (opciones: {', '.join(LAYOUTS)})")
+        self.root = root
+        self.layout = layout
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        self.max_days = max_days
+        self.files = 0
+        self.bytes = 0
+        self.written_since_sweep = 0
+        self.evicted_age = 0
+        self.evicted_size = 0
+        self.migrated = 0
+        os.makedirs(root, exist_ok=True)
+
+    def path(self, filename, camera, when):
+        return os.path.join(shard_dir(self.root, self.layout, camera, when), filename)
+
+    def scan(self):
+        """[(ruta, tamaño, mtime, último uso)] de todo el árbol (sin .tmp)."""
+        entries = []
+        for dirpath, _, names in os.walk(self.root):
+            for name in names:
+                if name.endswith(".tmp"):
+                    continue
+                path = os.path.join(dirpath, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue    # borrado o movido mientras se recorría
+                entries.append((path, st.st_size, st.st_mtime, max(st.st_atime, st.st_mtime)))
+        return entries
+
+    def migrate(self, camera, dry_run=False):
+        """Mueve los archivos sueltos de la raíz a su carpeta; devuelve [(origen, destino)]."""
+        if self.layout == "flat":
+            return []
+        moves = []
+        with os.scandir(self.root) as it:
+            for entry in it:
+                if not entry.is_file() or entry.name.endswith(".tmp"):
+                    continue
+                dest = self.path(entry.name, camera, file_date(entry.name, entry.path))
+                moves.append((entry.path, dest))
+        if not dry_run:
+            for src, dest in moves:
+                os.makedirs(os.path.dirname(dest), exist_ok=True)
+                os.replace(src, dest)
+            self.migrated += len(moves)
+        return moves
+
+    def stats(self):
+        return {
+            "root": self.root,
+            "layout": self.layout,
+            "files": self.files,
+            "mb": round(self.bytes / 1e6, 1),
+            "max_mb": round(self.max_bytes / 1024 / 1024, 1) if self.max_bytes else None,
+            "max_days": self.max_days or None,
+            "evicted_age": self.evicted_age,
+            "evicted_size": self.evicted_size,
+            "migrated": self.migrated
+        }
+
+
+class StorageLifecycle:
+    """Escritura en segundo plano, topes por directorio y migración del layout plano."""
+
+    def __init__(self, stores, camera="default", thumbnails=False, thumbnail_size=160,
+                 sweep_seconds=300.0, queue_size=64):
+        self.stores = stores                # {"frames": Store, "results": Store}
+        self.camera = camera
+        self.thumbnails = thumbnails
+        self.thumbnail_size = thumbnail_size
+        self.sweep_seconds = sweep_seconds
+        self._queue = queue.Queue(queue_size)
+        self._fs_lock = threading.Lock()    # crear carpeta + escribir vs. borrar carpetas vacías
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._threads = []
+        self.writes = 0
+        self.dropped = 0
+        self.errors = 0
+        self.sweeps = 0
+        self.last_sweep_seconds = None
+
+    def start(self):
+        for target in (self._writer, self._janitor):
+            thread = threading.Thread(target=target, daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self, timeout=None):
+        """Termina de escribir lo encolado y detiene la limpieza."""
+        self._stop.set()
+        self._wake.set()
+        self._queue.put(None)
+        for thread in self._threads:
+            thread.join(timeout)
+
+    # ---- escritura (llamado desde el loop: sólo encola) ----
+
+    def _submit(self, store, filename, when, encode):
+        try:
+            self._queue.put_nowait((store, filename, when, encode))
+            return True
+        except queue.Full:
+            self.dropped += 1
+            return False
+
+    def save_frame(self, filename, frame, box=None, when=None):
+        """JPEG del frame (o de la cara en `box` con miniaturas)."""
+        def encode():
+            img = frame
+            if self.thumbnails and box is not None:
+                img = face_thumbnail(frame, box, self.thumbnail_size)
+                if img is None:
+                    img = frame
+            ok, buf = cv2.imencode('.jpg', img, [cv2.IMWRITE_JPEG_QUALITY, THUMB_QUALITY]
+                                   if img is not frame else [])
+            return buf.tobytes() if ok else None
+        return self._submit("frames", filename, when or datetime.now(), encode)
+
+    def save_json(self, filename, text, when=None):
+        return self._submit("results", filename, when or datetime.now(), lambda: text.encode("utf-8"))
+
+    def _writer(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            name, filename, when, encode = item
+            store = self.stores[name]
+            path = store.path(filename, self.camera, when)
+            try:
+                data = encode()
+                if data is None:
+                    raise ValueError("no se pudo codificar")
+                with self._fs_lock:
+                    os.makedirs(os.path.dirname(path), exist_ok=True)
+                    with open(path + ".tmp", "wb") as f:
+                        f.write(data)
+                    os.replace(path + ".tmp", path)
+            except (OSError, ValueError) as e:
+                self.errors += 1
+                print(f"❌ Error guardando {path}: {e}")
+                continue
+            self.writes += 1
+            store.files += 1
+            store.bytes += len(data)
+            store.written_since_sweep += len(data)
+            if store.max_bytes and store.bytes > store.max_bytes:
+                self._wake.set()    # adelantar la limpieza
+
+    # ---- limpieza ----
+
+    def _janitor(self):
+        first = True
+        while not self._stop.is_set():
+            try:
+                self.sweep(migrate=first)
+            except OSError as e:
+                print(f"⚠️ Error en la limpieza de almacenamiento: {e}")
+            first = False
+            self._wake.wait(self.sweep_seconds)
+            self._wake.clear()
+
+    def sweep(self, migrate=False):
+        """Una pasada: migración (opcional), tope de antigüedad y tope de tamaño."""
+        t0 = time.time()
+        for store in self.stores.values():
+            if migrate:
+                moved = store.migrate(self.camera)
+                if moved:
+                    print(f"🗂️ {len(moved)} archivos de {store.root}/ movidos al layout {store.layout}")
+            self._sweep_store(store, t0)
+        self.sweeps += 1
+        self.last_sweep_seconds = round(time.time() - t0, 3)
+
+    def _sweep_store(self, store, now):
+        store.written_since_sweep = 0
+        entries = store.scan()
+        keep = []
+        for entry in entries:
+            if store.max_days and now - entry[2] > store.max_days * 86400:
+                if self._remove(entry[0]):
+                    store.evicted_age += 1
+                    continue
+            keep.append(entry)
+        total = sum(e[1] for e in keep)
+        if store.max_bytes and total > store.max_bytes:
+            # menos usados primero
+            keep.sort(key=lambda e: e[3])
+            target = store.max_bytes * EVICT_TARGET
+            done = 0
+            for path, size, _, _ in keep:
+                if total <= target:
+                    break
+                # si ya no estaba, igual deja de contar
+                if self._remove(path):
+                    store.evicted_size += 1
+                total -= size
+                done += 1
+            keep = keep[done:]
+        # lo escrito durante el recorrido se suma en el próximo
+        store.files, store.bytes = len(keep), total + store.written_since_sweep
+        self._prune_dirs(store.root)
+
+    def _remove(self, path):
+        try:
+            os.remove(path)
+            return True
+        except FileNotFoundError:
+            return False
+
+    def _prune_dirs(self, root):
+        """Borra carpetas de fecha/cámara vacías (nunca la raíz)."""
+        with self._fs_lock:
+            for dirpath, dirnames, filenames in os.walk(root, topdown=False):
+                if dirpath != root and not dirnames and not filenames:
+                    try:
+                        os.rmdir(dirpath)
+                    except OSError:
+                        pass
+
+    def stats(self):
+        return {
+            "camera": self.camera,
+            "thumbnails": self.thumbnails,
+            "queued": self._queue.qsize(),
+            "writes": self.writes,
+            "dropped_writes": self.dropped,
+            "errors": self.errors,
+            "sweeps": self.sweeps,
+            "last_sweep_seconds": self.last_sweep_seconds,
+            **{name: store.stats() for name, store in self.stores.items()}
+        }
+
+
+def main():
+    import app as facerec
+    parser = argparse.ArgumentParser(description="Migra captured_frames/ y recognition_results/ al layout por carpetas")
+    parser.add_argument('command', choices=["migrate"])
+    parser.add_argument('--camera', default=facerec.CAMERA_ID, help="cámara a la que asignar los archivos sueltos")
+    parser.add_argument('--layout', default=facerec.STORAGE_LAYOUT, choices=LAYOUTS)
+    parser.add_argument('--dry-run', action='store_true', help="sólo listar lo que se movería")
+    args = parser.parse_args()
+
+    for root in (facerec.FRAMES_DIR, facerec.RESULTS_DIR):
+        store = Store(root, args.layout)
+        moves = store.migrate(args.camera, dry_run=args.dry_run)
+        for src, dest in moves[:5]:
+            print(f"  {src} -> {dest}")
+        if len(moves) > 5:
+            print(f"  ... y {len(moves) - 5} más")
+        print(f"{'🔎' if args.dry_run else '✅'} {root}/: {len(moves)} archivos "
+              f"{'a mover' if args.dry_run else 'movidos'}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,472 @@
+# stream_manager.py - Conexión compartida al stream del ESP32-CAM
+"""
+Un hilo por cámara mantiene la conexión y publica el último frame; todos
+los consumidores (reconocimiento, /video_feed, scripts) leen de ahí en vez
+de abrir cada uno su propio cv2.VideoCapture.
+
+- Escalera de conexión (antes sólo en prueba_recon.py): FFmpeg con la URL,
+  con ?dummy=1, en el puerto :81 y finalmente el lector MJPEG manual (con
+  FRAME_DEDUP activo el lector manual va primero). La estrategia que
+  funcionó se recuerda por cámara y se prueba primero.
+- Detección de cortes por timeout: FFmpeg abre/lee con timeout y el lector
+  manual usa timeout de socket, así que un ESP32 que pierde Wi-Fi corta la
+  lectura en vez de colgarla.
+- Reconexión con backoff exponencial y jitter, sin busy-loops.
+- Estado expuesto: connecting / connected / reconnecting / stopped, número
+  de reconexiones y tiempo hasta recuperar la última caída.
+- Frames repetidos (el ESP32 reenvía el mismo JPEG si el sensor se traba o
+  la escena está quieta): se descartan antes de publicarlos, y con el
+  lector MJPEG antes de decodificarlos (ver FrameDedup / FRAME_DEDUP).
+
+Uso en scripts (reemplaza cv2.VideoCapture):
+    cap = open_stream(STREAM_URL)
+    ok, frame = cap.read()          # espera el siguiente frame (timeout)
+    cap.release()
+"""
+import os
+import time
+import random
+import hashlib
+import threading
+import urllib.request
+from urllib.parse import urlparse, urlunparse
+import numpy as np
+import cv2
+
+OPEN_TIMEOUT_MS = 5000
+READ_TIMEOUT_MS = 5000
+BACKOFF_BASE = 0.5
+BACKOFF_MAX = 30.0
+READ_TIMEOUT = 5.0       # espera de un consumidor antes de devolver (False, None)
+MAX_JPEG_BYTES = 4 * 1024 * 1024    # sin un JPEG completo en este tamaño no es un stream MJPEG
+
+# off | bytes (JPEG idéntico byte a byte) | thumb (además, miniatura casi igual)
+FRAME_DEDUP = os.getenv('FRAME_DEDUP', 'bytes')
+FRAME_DEDUP_THRESHOLD = float(os.getenv('FRAME_DEDUP_THRESHOLD', 1.5))   # dif. media de la miniatura (0-255)
+FRAME_DEDUP_MAX_SKIP = float(os.getenv('FRAME_DEDUP_MAX_SKIP', 1.0))     # seg. máx. sin publicar un frame
+THUMB_SIZE = (16, 12)
+
+
+class FrameDedup:
+    """
+    Decide si un frame repite al último publicado.
+
+    - bytes: huella blake2b del JPEG (lector MJPEG) o comparación exacta del
+      frame decodificado (FFmpeg, que no expone el JPEG)
+    - thumb: además, miniatura gris de 16x12 con diferencia media menor a
+      `threshold`. Con el lector MJPEG la miniatura sale de una decodificación
+      reducida 1/8 (IMREAD_REDUCED_GRAYSCALE_8), mucho más barata que la completa
+
+    Se compara contra el último frame *publicado* (una deriva lenta no se
+    acumula) y al menos cada `max_skip_seconds` se publica uno igual, para
+    que el debounce de eventos no dé por ida a alguien que sigue quieto.
+    """
+
+    def __init__(self, mode="bytes", threshold=1.5, max_skip_seconds=1.0):
+        self.mode = mode
+        self.threshold = threshold
+        self.max_skip_seconds = max_skip_seconds
+        self._digest = None
+        self._frame = None
+        self._thumb = None
+        self._last_pass = 0.0
+        self.checked = 0
+        self.byte_duplicates = 0
+        self.visual_duplicates = 0
+        self.skipped_before_decode = 0
+        self.forced = 0
+        self._decode_ms = None
+
+    @staticmethod
+    def _thumbnail(gray):
+        return cv2.resize(gray, THUMB_SIZE, interpolation=cv2.INTER_AREA).astype(np.int16)
+
+    def _similar(self, thumb):
+        return (thumb is not None and self._thumb is not None
+                and float(np.abs(thumb - self._thumb).mean()) < self.threshold)
+
+    def _decide(self, kind, now):
+        """True = descartar. Registra el frame como publicado si no se descarta."""
+        if kind is not None and now - self._last_pass < self.max_skip_seconds:
+            if kind == "bytes":
+                self.byte_duplicates += 1
+            else:
+                self.visual_duplicates += 1
+            return True
+        if kind is not None:
+            self.forced += 1
+        self._last_pass = now
+        return False
+
+    def skip_jpeg(self, jpg):
+        """Lector MJPEG: decidir con los bytes, antes de decodificar."""
+        self.checked += 1
+        digest = hashlib.blake2b(jpg, digest_size=8).digest()
+        kind, thumb = None, None
+        if digest == self._digest:
+            kind = "bytes"
+        elif self.mode == "thumb":
+            small = cv2.imdecode(np.frombuffer(jpg, np.uint8), cv2.IMREAD_REDUCED_GRAYSCALE_8)
+            thumb = self._thumbnail(small) if small is not None else None
+            kind = "visual" if self._similar(thumb) else None
+        if self._decide(kind, time.monotonic()):
+            self.skipped_before_decode += 1
+            return True
+        self._digest = digest
+        if thumb is not None:
+            self._thumb = thumb
+        return False
+
+    def skip_frame(self, frame):
+        """FFmpeg: frame ya decodificado; evita publicarlo (y todo lo de después)."""
+        self.checked += 1
+        kind, thumb, last = None, None, self._frame
+        # muestra espaciada primero: descarta la mayoría de los frames distintos sin recorrerlos enteros
+        if (last is not None and last.shape == frame.shape
+                and np.array_equal(last[::16, ::16], frame[::16, ::16]) and np.array_equal(last, frame)):
+            kind = "bytes"
+        elif self.mode == "thumb":
+            thumb = self._thumbnail(cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY))
+            kind = "visual" if self._similar(thumb) else None
+        if self._decide(kind, time.monotonic()):
+            return True
+        self._frame = frame
+        if thumb is not None:
+            self._thumb = thumb
+        return False
+
+    def decoded(self, ms):
+        """Tiempo de una decodificación completa (para estimar lo ahorrado)."""
+        self._decode_ms = ms if self._decode_ms is None else 0.9 * self._decode_ms + 0.1 * ms
+
+    def stats(self):
+        skipped = self.byte_duplicates + self.visual_duplicates
+        return {
+            "mode": self.mode,
+            "checked": self.checked,
+            "byte_duplicates": self.byte_duplicates,
+            "visual_duplicates": self.visual_duplicates,
+            "forced_keyframes": self.forced,
+            "skip_rate": round(skipped / self.checked, 3) if self.checked else None,
+            "skipped_before_decode": self.skipped_before_decode,
+            "decode_ms_avoided": (round(self.skipped_before_decode * self._decode_ms, 1)
+                                  if self._decode_ms is not None else None)
+        }
+
+
+# ---------- lector MJPEG manual como fallback -----------
+def mjpeg_jpegs(url, chunk_size=4096, timeout=5):
+    """JPEGs crudos del stream multipart, sin decodificar."""
+    req = urllib.request.urlopen(url, timeout=timeout)
+    buf = b""
+    try:
+        while True:
+            chunk = req.read(chunk_size)
+            if not chunk:
+                break
+            buf += chunk
+            a = buf.find(b"\xff\xd8")   # inicio JPEG
+            b = buf.find(b"\xff\xd9", a + 2) if a != -1 else -1   # fin JPEG
+            if a != -1 and b != -1:
+                jpg = buf[a:b+2]
+                buf = buf[b+2:]
+                yield jpg
+            elif len(buf) > MAX_JPEG_BYTES:
+                # p.ej. H.264 por HTTP: con el lector manual primero (FRAME_DEDUP) hay que soltarlo
+                raise ValueError(f"{url}: no es un stream MJPEG")
+    finally:
+        req.close()
+
+
+def mjpeg_frames(url, chunk_size=4096, timeout=5):
+    for jpg in mjpeg_jpegs(url, chunk_size, timeout):
+        frame = cv2.imdecode(np.frombuffer(jpg, np.uint8), cv2.IMREAD_COLOR)
+        if frame is not None:
+            yield frame
+
+
+class StreamWrapper:
+    """Imita cap.read() de OpenCV usando el generador MJPEG."""
+    def __init__(self, url, timeout=READ_TIMEOUT_MS / 1000, dedup=None):
+        self._gen = mjpeg_jpegs(url, timeout=timeout)
+        self.dedup = dedup
+        self.last_jpeg = None   # bytes tal como llegaron de la cámara
+    def isOpened(self):
+        return True
+    def read(self):
+        try:
+            while True:
+                jpg = next(self._gen)
+                # repetido: ni se decodifica
+                if self.dedup is not None and self.dedup.skip_jpeg(jpg):
+                    continue
+                t0 = time.perf_counter()
+                frame = cv2.imdecode(np.frombuffer(jpg, np.uint8), cv2.IMREAD_COLOR)
+                if frame is None:
+                    continue
+                if self.dedup is not None:
+                    self.dedup.decoded(1000 * (time.perf_counter() - t0))
+                self.last_jpeg = jpg
+                return True, frame
+        except (StopIteration, OSError, ValueError):
+            return False, None
+    def release(self):
+        self._gen.close()
+
+
+def _with_dummy(url):
+    return url + ("&dummy=1" if "?" in url else "?dummy=1")
+
+
+def _with_port_81(url):
+    pr = urlparse(url)
+    if ":" in pr.netloc.split("@")[-1]:
+        return None
+    return urlunparse((pr.scheme, pr.netloc + ":81", pr.path, pr.params, pr.query, pr.fragment))
+
+
+def _open_ffmpeg(url):
+    params = [cv2.CAP_PROP_OPEN_TIMEOUT_MSEC, OPEN_TIMEOUT_MS,
+              cv2.CAP_PROP_READ_TIMEOUT_MSEC, READ_TIMEOUT_MS]
+    return cv2.VideoCapture(url, cv2.CAP_FFMPEG, params)
+
+
+def connection_strategies(url, dedup=None):
+    """Escalera de (nombre, función que abre) para una URL."""
+    strategies = [
+        ("ffmpeg", lambda: _open_ffmpeg(url)),
+        ("ffmpeg_dummy", lambda: _open_ffmpeg(_with_dummy(url))),
+    ]
+    # Si la URL no especifica puerto, prueba con :81 (típico en CameraWebServer)
+    url81 = _with_port_81(url) if url.startswith("http") else None
+    if url81:
+        strategies += [
+            ("ffmpeg_81", lambda: _open_ffmpeg(url81)),
+            ("ffmpeg_81_dummy", lambda: _open_ffmpeg(_with_dummy(url81))),
+        ]
+    if url.startswith("http"):
+        mjpeg = ("mjpeg", lambda: StreamWrapper(url, dedup=dedup))
+        # con dedup el lector manual descarta repetidos antes de decodificarlos: va primero
+        if dedup is not None:
+            strategies.insert(0, mjpeg)
+        else:
+            strategies.append(mjpeg)
+    return strategies
+
+
+class CameraStream:
+    """Conexión a una cámara mantenida por un hilo, con el último frame publicado."""
+
+    # estrategia que funcionó por URL (sobrevive a reconexiones y reinicios del loop)
+    _strategy_cache = {}
+
+    def __init__(self, url, backoff_base=BACKOFF_BASE, backoff_max=BACKOFF_MAX):
+        self.url = url
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self._cond = threading.Condition()
+        self._stop = threading.Event()
+        self._thread = None
+        self.frame = None
+        self.jpeg = None        # JPEG original del frame (sólo con el lector MJPEG)
+        self.version = 0
+        self.state = "stopped"
+        self.strategy = None
+        self.refs = 0
+        self.reconnects = 0
+        self.failed_attempts = 0
+        self.last_frame_time = None
+        self.disconnected_at = None
+        self.last_recover_seconds = None
+        self.dedup = (FrameDedup(FRAME_DEDUP, FRAME_DEDUP_THRESHOLD, FRAME_DEDUP_MAX_SKIP)
+                      if FRAME_DEDUP != "off" else None)
+
+    # ---------- ciclo de vida ----------
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self.state = "connecting"
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        with self._cond:
+            self.state = "stopped"
+            self._cond.notify_all()
+
+    # ---------- conexión ----------
+    def _open(self):
+        """Prueba la estrategia recordada primero y luego la escalera completa."""
+        strategies = connection_strategies(self.url, self.dedup)
+        remembered = self._strategy_cache.get(self.url)
+        strategies.sort(key=lambda s: s[0] != remembered)
+        for name, opener in strategies:
+            if self._stop.is_set():
+                return None, None, None
+            try:
+                cap = opener()
+                if not cap.isOpened():
+                    cap.release()
+                    continue
+                ok, frame = cap.read()
+                if ok and frame is not None:
+                    return cap, name, frame
+                cap.release()
+            except Exception as e:
+                print(f"⚠️ {self.url} [{name}]: {e}")
+        return None, None, None
+
+    def _publish(self, frame, jpeg=None):
+        with self._cond:
+            self.frame = frame
+            self.jpeg = jpeg
+            self.version += 1
+            self.last_frame_time = time.time()
+            self._cond.notify_all()
+
+    def _run(self):
+        attempt = 0
+        while not self._stop.is_set():
+            cap, name, first = self._open()
+            if cap is None:
+                attempt += 1
+                self.failed_attempts += 1
+                # backoff exponencial con jitter (evita que todas las cámaras reintenten juntas)
+                delay = min(self.backoff_max, self.backoff_base * 2 ** (attempt - 1))
+                delay *= random.uniform(0.5, 1.0)
+                self.state = "reconnecting"
+                self._stop.wait(delay)
+                continue
+
+            attempt = 0
+            self._strategy_cache[self.url] = name
+            self.strategy = name
+            if self.disconnected_at is not None:
+                self.last_recover_seconds = round(time.time() - self.disconnected_at, 2)
+                self.reconnects += 1
+                print(f"✅ Stream recuperado en {self.last_recover_seconds}s ({name}): {self.url}")
+            else:
+                print(f"✅ Stream conectado ({name}): {self.url}")
+            self.disconnected_at = None
+            self.state = "connected"
+            self._publish(first, getattr(cap, "last_jpeg", None))
+
+            while not self._stop.is_set():
+                try:
+                    ok, frame = cap.read()
+                except Exception:
+                    ok, frame = False, None
+                if not ok or frame is None:
+                    break
+                # el lector MJPEG ya descartó los repetidos antes de decodificar
+                if (self.dedup is not None and not isinstance(cap, StreamWrapper)
+                        and self.dedup.skip_frame(frame)):
+                    continue
+                self._publish(frame, getattr(cap, "last_jpeg", None))
+            try:
+                cap.release()
+            except Exception:
+                pass
+
+            if not self._stop.is_set():
+                print(f"⚠️ Stream caído, reconectando: {self.url}")
+                self.disconnected_at = self.last_frame_time or time.time()
+                self.state = "reconnecting"
+
+    # ---------- consumo ----------
+    def wait_frame(self, last_version, timeout=READ_TIMEOUT):
+        """(versión, frame) más nuevo que `last_version`, o (None, None) si vence el timeout."""
+        with self._cond:
+            self._cond.wait_for(lambda: self.version > last_version or self._stop.is_set(), timeout=timeout)
+            if self.version > last_version:
+                return self.version, self.frame
+            return None, None
+
+    def wait_packet(self, last_version, timeout=READ_TIMEOUT):
+        """Como wait_frame, más el JPEG original (o None) y la hora de llegada."""
+        with self._cond:
+            self._cond.wait_for(lambda: self.version > last_version or self._stop.is_set(), timeout=timeout)
+            if self.version > last_version:
+                return self.version, self.frame, self.jpeg, self.last_frame_time
+            return None, None, None, None
+
+    def stats(self):
+        now = time.time()
+        return {
+            "url": self.url,
+            "state": self.state,
+            "strategy": self.strategy,
+            "consumers": self.refs,
+            "frames": self.version,
+            "reconnects": self.reconnects,
+            "failed_attempts": self.failed_attempts,
+            "last_frame_age": round(now - self.last_frame_time, 2) if self.last_frame_time else None,
+            "down_for": round(now - self.disconnected_at, 2) if self.disconnected_at else None,
+            "last_recover_seconds": self.last_recover_seconds,
+            "dedup": self.dedup.stats() if self.dedup is not None else None,
+        }
+
+
+class StreamReader:
+    """Vista tipo cv2.VideoCapture sobre un CameraStream compartido."""
+
+    def __init__(self, stream):
+        self.stream = stream
+        self._version = 0
+        self._released = False
+
+    def isOpened(self):
+        return not self._released
+
+    def read(self, timeout=READ_TIMEOUT):
+        """Siguiente frame nuevo; (False, None) si no llega ninguno en `timeout`."""
+        version, frame = self.stream.wait_frame(self._version, timeout)
+        if version is None:
+            return False, None
+        self._version = version
+        return True, frame
+
+    def read_packet(self, timeout=READ_TIMEOUT):
+        """(ok, frame, jpeg original o None, timestamp) del siguiente frame nuevo."""
+        version, frame, jpeg, ts = self.stream.wait_packet(self._version, timeout)
+        if version is None:
+            return False, None, None, None
+        self._version = version
+        return True, frame, jpeg, ts
+
+    def release(self):
+        if not self._released:
+            self._released = True
+            release_stream(self.stream)
+
+
+_streams = {}
+_streams_lock = threading.Lock()
+
+
+def open_stream(url):
+    """Lector sobre la conexión compartida a `url` (la crea si hace falta)."""
+    with _streams_lock:
+        stream = _streams.get(url)
+        if stream is None:
+            stream = CameraStream(url)
+            _streams[url] = stream
+        stream.refs += 1
+        stream.start()
+    return StreamReader(stream)
+
+
+def release_stream(stream):
+    """Cierra la conexión cuando se va el último lector."""
+    with _streams_lock:
+        stream.refs -= 1
+        if stream.refs <= 0:
+            stream.stop()
+            _streams.pop(stream.url, None)
+
+
+def streams_stats():
+    with _streams_lock:
+        return [s.stats() for s in _streams.values()]
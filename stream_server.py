@@ -0,0 +1,301 @@
+# stream_server.py - Servidor asyncio para los endpoints de streaming con muchos visores
+"""
+El servidor de Flask ocupa un hilo por conexión abierta: con decenas de
+visores de /video_feed o /api/events los hilos (y en /video_feed un
+imencode por visor) son el límite.
+
+Aquí un solo event loop atiende:
+
+  /video_feed             MJPEG de la cámara (o del motor en modo worker)
+  /video_feed/annotated   MJPEG con cajas/nombres (frame_hub)
+  /api/events             SSE (event_bus), con Last-Event-ID / ?since=
+
+Cada fuente tiene un hilo productor que se arranca con el primer cliente y
+termina con el último: codifica el JPEG una sola vez por frame y variante
+de /video_feed (`?fps=&width=&quality=`, ver mjpeg_variants.py) o toma cada
+mensaje del bus, y lo entrega al loop, que lo reparte a las colas de los
+clientes. Las colas son acotadas:
+
+- MJPEG: FRAME_QUEUE partes; un cliente lento pierde frames viejos, nunca
+  acumula retraso.
+- SSE: CLIENT_BUFFER mensajes; si se llena se vacía y se envía `reset`
+  (misma semántica que EventBus.stream).
+
+Un cliente que no lee en WRITE_TIMEOUT se desconecta. El resto de la API
+sigue en Flask; ver ASYNC_STREAM_PORT en app.py.
+
+Uso con workers (ENGINE_MODE=worker), como proceso aparte:
+    ENGINE_MODE=worker python stream_server.py --port 5001
+"""
+import asyncio
+import argparse
+import threading
+from urllib.parse import urlsplit, parse_qs
+
+from event_bus import format_sse, CLIENT_BUFFER, HEARTBEAT_SECONDS
+from mjpeg_variants import VariantCache, parse_variant
+
+FRAME_QUEUE = 2
+WRITE_TIMEOUT = 10.0
+HEADER_TIMEOUT = 10.0
+MAX_HEADER = 16384
+
+MJPEG_HEADERS = (b"HTTP/1.1 200 OK\r\n"
+                 b"Content-Type: multipart/x-mixed-replace; boundary=frame\r\n"
+                 b"Cache-Control: no-cache\r\n"
+                 b"Access-Control-Allow-Origin: *\r\n"
+                 b"Connection: close\r\n\r\n")
+SSE_HEADERS = (b"HTTP/1.1 200 OK\r\n"
+               b"Content-Type: text/event-stream\r\n"
+               b"Cache-Control: no-cache\r\n"
+               b"X-Accel-Buffering: no\r\n"
+               b"Access-Control-Allow-Origin: *\r\n"
+               b"Connection: close\r\n\r\n")
+NOT_FOUND = (b"HTTP/1.1 404 Not Found\r\n"
+             b"Content-Type: application/json\r\n"
+             b"Content-Length: 23\r\n"
+             b"Connection: close\r\n\r\n"
+             b'{"error": "Not found"}\n')
+
+
+def mjpeg_part(jpeg):
+    return b"--frame\r\nContent-Type: image/jpeg\r\n\r\n" + jpeg + b"\r\n"
+
+
+class StreamClient:
+    def __init__(self, kind, maxsize, last_seq=0, variant=None):
+        self.kind = kind
+        self.variant = variant
+        self.queue = asyncio.Queue(maxsize)
+        self.last_seq = last_seq
+        self.dropped = 0
+
+
+class StreamServer:
+    """Reparte MJPEG y SSE desde un solo event loop."""
+
+    def __init__(self, frame_hub, event_bus, status_fn=None, open_camera=None,
+                 variants=None, client_buffer=CLIENT_BUFFER):
+        self.frame_hub = frame_hub
+        self.event_bus = event_bus
+        self.status_fn = status_fn          # -> {"status": ..., "stats": ...} para el evento inicial
+        self.open_camera = open_camera      # None: /video_feed sale de frame_hub
+        self.variants = variants if variants is not None else VariantCache()
+        self.client_buffer = client_buffer
+        self.loop = None
+        self.clients = {"raw": set(), "annotated": set(), "events": set()}
+        self._pumps = {}
+        self._pump_lock = threading.Lock()
+        self.connections = 0
+        self.frames_published = 0
+        self.parts_sent = 0
+        self.frames_dropped = 0
+        self.sse_resets = 0
+
+    # ---- productores (hilos) -> event loop ----
+
+    def _ensure_pump(self, kind, start_seq=0):
+        with self._pump_lock:
+            if kind in self._pumps:
+                return
+            target = {"raw": self._raw_pump, "annotated": self._annotated_pump,
+                      "events": self._events_pump}[kind]
+            thread = threading.Thread(target=target, args=(start_seq,), daemon=True)
+            self._pumps[kind] = thread
+            thread.start()
+
+    def _keep_running(self, kind):
+        """El productor termina cuando no quedan clientes de su tipo."""
+        with self._pump_lock:
+            if self.clients[kind]:
+                return True
+            del self._pumps[kind]
+            return False
+
+    def _publish(self, kind, payload, seq=None, variant=None):
+        self.loop.call_soon_threadsafe(self._fan, kind, payload, seq, variant)
+
+    def _fan(self, kind, payload, seq=None, variant=None):
+        for client in list(self.clients[kind]):
+            if client.variant != variant:
+                continue
+            if seq is not None:
+                if seq <= client.last_seq:
+                    continue     # ya enviado en el backlog de la conexión
+                client.last_seq = seq
+            if client.queue.full():
+                client.dropped += 1
+                if kind == "events":
+                    # cliente lento: descartar lo pendiente y pedirle que recargue por REST
+                    while not client.queue.empty():
+                        client.queue.get_nowait()
+                    client.queue.put_nowait(format_sse("reset", {"seq": seq}))
+                    self.sse_resets += 1
+                else:
+                    client.queue.get_nowait()
+                    self.frames_dropped += 1
+            client.queue.put_nowait(payload)
+
+    def _raw_pump(self, _):
+        cap = self.open_camera() if self.open_camera is not None else None
+        version = 0
+        try:
+            while self._keep_running("raw"):
+                if cap is not None:
+                    ok, frame = cap.read()
+                    if not ok:
+                        continue
+                else:
+                    new_version = self.frame_hub.wait_frame(version, timeout=1.0)
+                    if new_version is None:
+                        continue
+                    version = new_version
+                    frame = self.frame_hub.frame
+                # sólo las variantes con visores; None = descartado por su fps
+                for key in {c.variant for c in list(self.clients["raw"])}:
+                    jpeg = self.variants.jpeg(key, frame)
+                    if jpeg is not None:
+                        self.frames_published += 1
+                        self._publish("raw", mjpeg_part(jpeg), variant=key)
+        finally:
+            if cap is not None:
+                cap.release()
+
+    def _annotated_pump(self, _):
+        version = 0
+        while self._keep_running("annotated"):
+            new_version = self.frame_hub.wait_frame(version, timeout=1.0)
+            if new_version is None:
+                continue
+            version = new_version
+            jpeg = self.frame_hub.annotated_jpeg()
+            if jpeg is not None:
+                self._publish("annotated", mjpeg_part(jpeg))
+
+    def _events_pump(self, start_seq):
+        last = start_seq
+        while self._keep_running("events"):
+            seq, msgs = self.event_bus.history_since(last, timeout=1.0)
+            if msgs is None:
+                # este hilo se atrasó más que el historial del bus
+                self._publish("events", format_sse("reset", {"seq": seq}), seq)
+                last = seq
+                continue
+            for msg_seq, msg in msgs:
+                self._publish("events", msg, msg_seq)
+                last = msg_seq
+
+    # ---- conexiones ----
+
+    async def _stream(self, writer, client, headers, heartbeat=None):
+        if client.variant is not None:
+            self.variants.subscribe(client.variant)
+        self.clients[client.kind].add(client)
+        self._ensure_pump(client.kind, client.last_seq)
+        try:
+            writer.write(headers)
+            while True:
+                try:
+                    item = await asyncio.wait_for(client.queue.get(), heartbeat)
+                except asyncio.TimeoutError:
+                    item = b": ping\n\n"
+                writer.write(item)
+                await asyncio.wait_for(writer.drain(), WRITE_TIMEOUT)
+                self.parts_sent += 1
+                if client.variant is not None:
+                    self.variants.sent(client.variant, len(item))
+        finally:
+            self.clients[client.kind].discard(client)
+            if client.variant is not None:
+                self.variants.unsubscribe(client.variant)
+
+    async def _events(self, writer, headers, query):
+        since = headers.get("last-event-id") or (query.get("since") or [None])[0]
+        try:
+            since = int(since) if since is not None else None
+        except ValueError:
+            since = None
+        seq, backlog = self.event_bus.history_since(since if since is not None else self.event_bus.seq)
+        client = StreamClient("events", self.client_buffer, last_seq=seq)
+        # al conectarse el cliente recibe el estado completo sin esperar cambios
+        if self.status_fn is not None:
+            client.queue.put_nowait(format_sse("status", self.status_fn(), None))
+        if backlog is None or len(backlog) >= self.client_buffer:
+            client.queue.put_nowait(format_sse("reset", {"seq": seq}))
+        else:
+            for _, msg in backlog:
+                client.queue.put_nowait(msg)
+        await self._stream(writer, client, SSE_HEADERS, heartbeat=HEARTBEAT_SECONDS)
+
+    async def _handle(self, reader, writer):
+        self.connections += 1
+        try:
+            head = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), HEADER_TIMEOUT)
+            lines = head.decode("latin-1").split("\r\n")
+            method, target = (lines[0].split(" ") + ["", ""])[:2]
+            headers = {}
+            for line in lines[1:]:
+                key, _, value = line.partition(":")
+                if key:
+                    headers[key.strip().lower()] = value.strip()
+            url = urlsplit(target)
+            query = parse_qs(url.query)
+            if method != "GET":
+                writer.write(NOT_FOUND)
+            elif url.path == "/video_feed":
+                key = parse_variant({k: v[0] for k, v in query.items()})
+                await self._stream(writer, StreamClient("raw", FRAME_QUEUE, variant=key), MJPEG_HEADERS)
+            elif url.path == "/video_feed/annotated":
+                await self._stream(writer, StreamClient("annotated", FRAME_QUEUE), MJPEG_HEADERS)
+            elif url.path == "/api/events":
+                await self._events(writer, headers, query)
+            else:
+                writer.write(NOT_FOUND)
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, asyncio.TimeoutError,
+                ConnectionError):
+            pass    # cliente que se fue, que no envió headers o que dejó de leer
+        finally:
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except (ConnectionError, asyncio.TimeoutError):
+                pass
+
+    # ---- ciclo de vida ----
+
+    async def serve(self, host, port):
+        self.loop = asyncio.get_running_loop()
+        server = await asyncio.start_server(self._handle, host, port, limit=MAX_HEADER, backlog=1024)
+        print(f"⚡ Streaming asyncio en http://{host}:{port} (/video_feed, /video_feed/annotated, /api/events)")
+        async with server:
+            await server.serve_forever()
+
+    def start_in_thread(self, host, port):
+        thread = threading.Thread(target=lambda: asyncio.run(self.serve(host, port)), daemon=True)
+        thread.start()
+        return thread
+
+    def stats(self):
+        return {
+            "clients": {kind: len(clients) for kind, clients in self.clients.items()},
+            "connections": self.connections,
+            "frames_published": self.frames_published,
+            "parts_sent": self.parts_sent,
+            "frames_dropped": self.frames_dropped,
+            "sse_resets": self.sse_resets
+        }
+
+
+def main():
+    import app as facerec
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=facerec.ASYNC_STREAM_PORT or 5001)
+    args = parser.parse_args()
+    if facerec.ENGINE_MODE != 'worker':
+        print("⚠️ Sin ENGINE_MODE=worker este proceso no recibe resultados: sólo /video_feed tendrá datos")
+    facerec.start_async_streams(args.port, args.host).join()
+
+
+if __name__ == '__main__':
+    main()